@@ -0,0 +1,266 @@
+"""
+对话日志处理流程的基准测试
+
+把录制的ELK响应(_run_query/query_dialogs的out_file)或合成的记录依次送入各个阶段,
+在多个数据量下报告每个阶段的 记录/秒, round/秒 和内存峰值:
+
+    transform  KongmingELKServer.transform_record
+    group      KongmingLogAnalyzer.group_by_traceid
+    assemble   DialogRoundAssembler (query_dialogs按页增量组装round)
+    analyze    KongmingLogAnalyzer.render
+    excel      print_dialog_round_to_excel
+    console    print_dialog_round_table (输出丢弃)
+
+计时和内存分开测量: 先不开tracemalloc计时(取--repeat次中最快的一次), 再在tracemalloc下
+运行一次记录该阶段的分配峰值. 进程的最大RSS是所有阶段共同的高水位, 只在最后报告一次.
+
+用法:
+    python benchmarks/bench_pipeline.py --sizes 1000 10000 100000
+    python benchmarks/bench_pipeline.py --fixture logs/uat-0815-2000.json --sizes 2000 20000
+    python benchmarks/bench_pipeline.py --fixture synthetic.jsonl.gz --sizes 100000 1000000
+    python benchmarks/bench_pipeline.py --save baseline.json
+    python benchmarks/bench_pipeline.py --baseline baseline.json --tolerance 0.2
+
+与--baseline比较时, 任何阶段的吞吐量下降超过tolerance则以返回码1退出.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kongming.analyzer import KongmingLogAnalyzer
+from kongming.console import print_dialog_round_table
+from kongming.elk import KongmingELKServer
+from kongming.excel import print_dialog_round_to_excel
+from kongming.model import DialogRoundAssembler
+from kongming.synthetic import SyntheticLogGenerator, dialog_hits, read_jsonl
+
+STAGES = ['transform', 'group', 'assemble', 'analyze', 'excel', 'console']
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+
+# ---------------------------------------------------------------------------
+# 数据集
+
+def load_fixture(filename: str) -> List[Dict[str, Any]]:
+    """
+    读取录制的记录: ELK响应(含hits.hits), hit列表, 或每行一个hit的jsonl(可以是.jsonl.gz)
+    """
+    if filename.endswith('.jsonl') or filename.endswith('.jsonl.gz'):
+        return list(read_jsonl(filename))
+    with open(filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return data['hits']['hits']
+    return data
+
+def scale_hits(hits: List[Dict[str, Any]], size: int) -> List[Dict[str, Any]]:
+    """
+    把录制的记录截取或复制到size条
+
+    复制出的第k份在traceId/trace_id和_id后加上"-k", 使它们成为不同的trace.
+    消息正文中引用的traceId不会改写.
+    """
+    if size <= len(hits):
+        return hits[:size]
+    result = list(hits)
+    copy = 1
+    while len(result) < size:
+        for hit in hits[:size - len(result)]:
+            hit = json.loads(json.dumps(hit))
+            src = hit['_source']
+            for key in ['traceId', 'trace_id']:
+                if isinstance(src.get(key), str):
+                    src[key] = f'{src[key]}-{copy}'
+            if '_id' in hit:
+                hit['_id'] = f"{hit['_id']}-{copy}"
+            result.append(hit)
+        copy += 1
+    return result
+
+# ---------------------------------------------------------------------------
+# 各阶段
+
+def run_stages(raw_text: str, pagesize: int, stages: List[str], measure: Callable) -> Dict[str, Dict[str, float]]:
+    """
+    按顺序执行各阶段, measure(stage, func)执行func并返回(结果, 指标)
+
+    每个阶段的输入由前面的阶段产生; 未选中的前置阶段也会执行(不计入结果).
+    """
+    server = KongmingELKServer()
+    analyzer = KongmingLogAnalyzer()
+    results: Dict[str, Dict[str, float]] = {}
+
+    def step(stage, func):
+        if stage in stages:
+            value, metrics = measure(stage, func)
+            results[stage] = metrics
+            return value
+        return func()
+
+    hits = json.loads(raw_text)
+    records = step('transform', lambda: [server.transform_record(r) for r in hits])
+    step('group', lambda: analyzer.group_by_traceid(records))
+
+    # query_dialogs只会查到带central-manager对话字段的记录, 筛选相当于ELK的查询, 不计时
+    dialog_records = list(dialog_hits(records))
+
+    def assemble():
+        assembler = DialogRoundAssembler()
+        rounds = []
+        for start in range(0, len(dialog_records), pagesize):
+            rounds += assembler.add_records(dialog_records[start:start + pagesize])
+        rounds += assembler.flush()
+        return rounds
+    rounds = step('assemble', assemble)
+
+    step('analyze', lambda: analyzer.render(records))
+
+    if 'excel' in stages:
+        with tempfile.TemporaryDirectory() as tmp:
+            step('excel', lambda: print_dialog_round_to_excel(rounds, os.path.join(tmp, 'bench.xlsx')))
+
+    if 'console' in stages:
+        with contextlib.redirect_stdout(io.StringIO()):
+            step('console', lambda: print_dialog_round_table(rounds))
+
+    for metrics in results.values():
+        metrics['records'] = len(records)
+        metrics['rounds'] = len(rounds)
+    return results
+
+def time_stage(stage: str, func: Callable) -> Tuple[Any, Dict[str, float]]:
+    gc.collect()
+    begin = time.perf_counter()
+    value = func()
+    return value, {'seconds': time.perf_counter() - begin}
+
+def trace_stage(stage: str, func: Callable) -> Tuple[Any, Dict[str, float]]:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        value = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return value, {'peak_bytes': peak}
+
+def bench_size(hits: List[Dict[str, Any]], size: int, pagesize: int, repeat: int, stages: List[str], memory: bool) -> Dict[str, Dict[str, float]]:
+    raw_text = json.dumps(scale_hits(hits, size), ensure_ascii=False)
+
+    best: Dict[str, Dict[str, float]] = {}
+    for _ in range(repeat):
+        for stage, metrics in run_stages(raw_text, pagesize, stages, time_stage).items():
+            if stage not in best or metrics['seconds'] < best[stage]['seconds']:
+                best[stage] = metrics
+
+    if memory:
+        for stage, metrics in run_stages(raw_text, pagesize, stages, trace_stage).items():
+            best[stage]['peak_bytes'] = metrics['peak_bytes']
+
+    for metrics in best.values():
+        seconds = max(metrics['seconds'], 1e-9)
+        metrics['records_per_sec'] = metrics['records'] / seconds
+        metrics['rounds_per_sec'] = metrics['rounds'] / seconds
+    return best
+
+def max_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+# ---------------------------------------------------------------------------
+# 报告
+
+def print_report(results: Dict[int, Dict[str, Dict[str, float]]], baseline: Optional[Dict] = None, tolerance: float = 0.2) -> List[str]:
+    """打印结果表格, 返回相对baseline退化的 "数据量/阶段" 列表"""
+    from rich.console import Console
+    from rich.table import Table
+
+    regressions = []
+    table = Table(title="Pipeline benchmark", show_header=True, header_style="bold magenta")
+    for title in ["记录数", "阶段", "耗时(s)", "记录/秒", "round/秒", "内存峰值(MB)", "对比基线"]:
+        table.add_column(title, justify="left" if title == "阶段" else "right")
+
+    for size, stages in results.items():
+        for stage, metrics in stages.items():
+            change = ""
+            base = (baseline or {}).get(str(size), {}).get(stage)
+            if base:
+                ratio = metrics['records_per_sec'] / base['records_per_sec'] - 1
+                change = f"{ratio:+.1%}"
+                if ratio < -tolerance:
+                    change = f"[red]{change}[/red]"
+                    regressions.append(f"{size}/{stage}")
+            peak = metrics.get('peak_bytes')
+            table.add_row(str(size), stage,
+                          f"{metrics['seconds']:.3f}",
+                          f"{metrics['records_per_sec']:,.0f}",
+                          f"{metrics['rounds_per_sec']:,.0f}",
+                          "" if peak is None else f"{peak / 1024 / 1024:.1f}",
+                          change)
+        table.add_section()
+
+    console = Console()
+    console.print(table)
+    rss = max_rss_bytes()
+    if rss is not None:
+        console.print(f"进程最大RSS: {rss / 1024 / 1024:.1f} MB")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the ingest -> round -> render pipeline")
+    parser.add_argument('--fixture', help="录制的ELK响应/hit列表(json)或jsonl, 默认使用合成数据")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="数据量(记录数)")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--pagesize', type=int, default=1000, help="assemble阶段每页的记录数")
+    parser.add_argument('--repeat', type=int, default=1, help="计时重复次数, 取最快的一次")
+    parser.add_argument('--no-memory', action='store_true', help="不测量内存峰值(省去一次tracemalloc运行)")
+    parser.add_argument('--seed', type=int, default=0, help="合成数据的随机种子")
+    parser.add_argument('--save', help="把结果保存为json, 可作为之后的--baseline")
+    parser.add_argument('--baseline', help="与之前--save的结果比较")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="吞吐量下降超过这个比例视为退化")
+    args = parser.parse_args(argv)
+
+    if args.fixture:
+        hits = load_fixture(args.fixture)
+    else:
+        # 每个trace大约40条记录, 多生成一些再截取
+        hits = list(itertools.islice(SyntheticLogGenerator(traces=max(args.sizes) // 30 + 1, seed=args.seed), max(args.sizes)))
+
+    results = {}
+    for size in args.sizes:
+        results[size] = bench_size(hits, size, args.pagesize, args.repeat, args.stages, memory=not args.no_memory)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    regressions = print_report(results, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({str(size): stages for size, stages in results.items()}, f, indent=2)
+
+    if regressions:
+        print(f"性能退化: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
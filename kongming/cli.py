@@ -0,0 +1,490 @@
+"""
+kongming命令行
+
+    kongming dialogs --begin 2025-08-15T00:00:00 --end 2025-08-20T00:00:00 --size 2000 -o logs/uat-0815-2000.xlsx
+    kongming trace E5FE48B7-EF60-44FA-B296-8B5C6F90A6AB 8B87AA93-0315-4F0B-AA63-7AECC2DB550D
+    kongming trace --file traces.txt --jobs 8
+    kongming trace --file traces.txt --jobs 16 --async
+    cat traces.txt | kongming trace -
+    kongming range --begin 2025-08-10T11:34:00 --end 2025-08-10T11:36:00 --name 1111
+    kongming phrase terminalTraceId --term laname.keyword=central-manager --begin 2025-08-15 --size 1000
+    kongming export logs/uat-0815.csv.gz --begin 2025-08-15 --end 2025-08-16 --glass-product 1003
+    kongming export logs/uat-08.jsonl.gz --begin 2025-08-01 --end 2025-09-01 --size 1000000 --parallel 4
+    kongming sync logs/sync --begin 2025-08-15 --end 2025-08-16 --window 1h --jobs 4
+
+全局参数(--env, --server, --profile, --report等)写在子命令之前: kongming --env prod trace ...
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .analyzer import KongmingLogAnalyzer
+from .console import print_dialog_round_table
+from .elk import AsyncKongmingELKServer, KongmingELKServer
+from .export import available_formats, get_exporter
+from .instrument import print_report
+from .model import DialogLogFilter, DialogRound
+from .planner import DEFAULT_SHARD_HITS
+from .profiling import PROFILE_MODES, profile
+from .users import UserResolver
+
+DEFAULT_OUT_DIR = 'logs'
+
+_WINDOW_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+
+# ---------------------------------------------------------------------------
+# 参数
+
+def read_trace_ids(args: Iterable[str], filename: Optional[str] = None) -> List[str]:
+    """
+    合并命令行和文件中的traceId, 去重并保持顺序
+
+    "-"表示从标准输入读取; 文件中每行一个traceId, 空行和#开头的行被忽略.
+    """
+    def lines(f):
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
+    ids: List[str] = []
+    for arg in args:
+        if arg == '-':
+            ids += lines(sys.stdin)
+        else:
+            ids.append(arg)
+    if filename:
+        if filename == '-':
+            ids += lines(sys.stdin)
+        else:
+            with open(filename, 'r', encoding='utf-8') as f:
+                ids += lines(f)
+    return list(dict.fromkeys(ids))
+
+def parse_window(value: str) -> timedelta:
+    """'30m', '1h', '1d' -> timedelta"""
+    match = re.fullmatch(r'(\d+)([mhd])', value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid window '{value}', expected e.g. 30m, 1h, 1d")
+    return timedelta(seconds=int(match.group(1)) * _WINDOW_UNITS[match.group(2)])
+
+def parse_term(value: str) -> Tuple[str, str]:
+    """'laname.keyword=central-manager' -> (field, value)"""
+    if '=' not in value:
+        raise argparse.ArgumentTypeError(f"invalid term '{value}', expected field=value")
+    field, term = value.split('=', 1)
+    return field, term
+
+def _server_kwargs(args) -> Dict[str, Any]:
+    return dict(server=args.server, username=args.username, password=args.password, env=args.env)
+
+def _dialog_filter(args) -> DialogLogFilter:
+    return DialogLogFilter(timestamp_begin=args.begin,
+                           timestamp_end=args.end,
+                           glass_product=args.glass_product,
+                           id_type=args.id_type,
+                           id_value=args.id_value,
+                           phrase=args.phrase)
+
+def _users(args) -> Optional[UserResolver]:
+    return UserResolver(args.users) if args.users else None
+
+def _executor(args) -> Executor:
+    if args.processes:
+        return ProcessPoolExecutor(max_workers=args.jobs)
+    return ThreadPoolExecutor(max_workers=args.jobs, thread_name_prefix='kongming')
+
+def _ensure_dir(filename: str):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+def _log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+# ---------------------------------------------------------------------------
+# dialogs / export
+
+def _iter_dialog_batches(args) -> Iterator[List[DialogRound]]:
+    server = KongmingELKServer(**_server_kwargs(args))
+
+    def progress(fetched: int, total: int):
+        _log(f"{fetched}/{total} hits")
+
+    return server.iter_dialogs(_dialog_filter(args), size=args.size, pagesize=args.pagesize, progress=progress if args.progress else None,
+                               shard_hits=args.shard_hits, parallel=args.parallel)
+
+def cmd_dialogs(args) -> int:
+    """查询对话, 每取回一页就打印这一页组装完成的round, 同时可以写到文件"""
+    users = _users(args)
+    exporter = None
+    if args.output:
+        _ensure_dir(args.output)
+        exporter = get_exporter(args.output, users=users)
+    count = 0
+    try:
+        for batch in _iter_dialog_batches(args):
+            if not args.quiet:
+                print_dialog_round_table(batch, users=users)
+            if exporter is not None:
+                exporter.export(batch)
+            count += len(batch)
+    except BaseException:
+        if exporter is not None:
+            exporter.abort()
+        raise
+    if exporter is not None:
+        exporter.close()
+        _log(f"{count} dialog rounds written to {args.output}")
+    else:
+        _log(f"{count} dialog rounds")
+    return 0
+
+def cmd_export(args) -> int:
+    """查询对话并逐页流式写到文件, 格式由文件名后缀或--format决定"""
+    _ensure_dir(args.output)
+    exporter = get_exporter(args.output, format=args.format, compression=args.compression, users=_users(args))
+    with exporter:
+        for batch in _iter_dialog_batches(args):
+            exporter.export(batch)
+            _log(f"{exporter.rows_written} rows written")
+    _log(f"{exporter.rows_written} dialog rounds written to {args.output}")
+    return 0
+
+# ---------------------------------------------------------------------------
+# trace
+
+def _trace_result(trace_id: str) -> Dict[str, Any]:
+    return {'trace_id': trace_id, 'status': 'ok', 'records': 0, 'rounds': [], 'markdown': None, 'error': None}
+
+def _analyze_found(result: Dict[str, Any], found: Optional[Tuple[List[Dict[str, Any]], List[DialogRound]]], out_dir: str):
+    if not found:
+        result['status'] = 'not found'
+        return
+    records, rounds = found
+    markdown = os.path.join(out_dir, f"{result['trace_id']}.md")
+    KongmingLogAnalyzer().analyze(records, markdown)
+    result.update(records=len(records), rounds=rounds, markdown=markdown)
+
+def analyze_trace(server_kwargs: Dict[str, Any], trace_id: str, out_dir: str) -> Dict[str, Any]:
+    """
+    查询一个traceId所在的对话轮次和前后的全部日志, 写出{out_dir}/{trace_id}.json和.md
+
+    在工作线程或子进程中执行, 参数和返回值都可以pickle. 返回的status为 ok, not found 或 error.
+    """
+    result = _trace_result(trace_id)
+    try:
+        server = KongmingELKServer(**server_kwargs)
+        _analyze_found(result, server.query_dialog_by_trace_id(trace_id, out_file=os.path.join(out_dir, f"{trace_id}.json")), out_dir)
+    except Exception as e:
+        result.update(status='error', error=f"{type(e).__name__}: {e}")
+    return result
+
+async def analyze_trace_async(server: AsyncKongmingELKServer, trace_id: str, out_dir: str) -> Dict[str, Any]:
+    """analyze_trace的异步版本, 查询在事件循环中进行, 分析在线程池中进行"""
+    result = _trace_result(trace_id)
+    try:
+        found = await server.query_dialog_by_trace_id(trace_id, out_file=os.path.join(out_dir, f"{trace_id}.json"))
+        await asyncio.to_thread(_analyze_found, result, found, out_dir)
+    except Exception as e:
+        result.update(status='error', error=f"{type(e).__name__}: {e}")
+    return result
+
+def _iter_trace_results(args, trace_ids: List[str]) -> Iterator[Dict[str, Any]]:
+    server_kwargs = _server_kwargs(args)
+    with _executor(args) as executor:
+        futures = [executor.submit(analyze_trace, server_kwargs, trace_id, args.out_dir) for trace_id in trace_ids]
+        for future in as_completed(futures):
+            yield future.result()
+
+async def _gather_trace_results(args, trace_ids: List[str], report: Callable[[Dict[str, Any]], None]):
+    async with AsyncKongmingELKServer(**_server_kwargs(args), max_concurrency=args.jobs) as server:
+        for task in asyncio.as_completed([analyze_trace_async(server, trace_id, args.out_dir) for trace_id in trace_ids]):
+            report(await task)
+
+def cmd_trace(args) -> int:
+    """
+    批量分析traceId, 最多--jobs个同时进行, 完成一个输出一个
+
+    默认使用线程(查询以网络等待为主); --processes使用子进程, 分析阶段也可以用满多核,
+    此时--report和--profile不包含子进程中的耗时; --async在一个事件循环中并发查询.
+    """
+    trace_ids = read_trace_ids(args.trace_ids, args.file)
+    if not trace_ids:
+        _log("no trace id given")
+        return 2
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    users = _users(args)
+    done = []
+    failed = []
+
+    def report(result: Dict[str, Any]):
+        done.append(result['trace_id'])
+        if result['status'] == 'ok':
+            if not args.quiet:
+                print_dialog_round_table(result['rounds'], users=users)
+            _log(f"[{len(done)}/{len(trace_ids)}] {result['trace_id']}: {result['records']} records -> {result['markdown']}")
+        else:
+            failed.append(result['trace_id'])
+            _log(f"[{len(done)}/{len(trace_ids)}] {result['trace_id']}: {result['error'] or result['status']}")
+
+    if args.use_async:
+        asyncio.run(_gather_trace_results(args, trace_ids, report))
+    else:
+        for result in _iter_trace_results(args, trace_ids):
+            report(result)
+    _log(f"{len(trace_ids) - len(failed)}/{len(trace_ids)} traces analyzed")
+    return 1 if failed else 0
+
+# ---------------------------------------------------------------------------
+# range / phrase
+
+def _write_records(args, records: Optional[List[Dict[str, Any]]], name: str) -> int:
+    if not records:
+        _log("no records found")
+        return 1
+    markdown = os.path.join(args.out_dir, f"{name}.md")
+    KongmingLogAnalyzer().analyze(records, markdown)
+    _log(f"{len(records)} records -> {markdown}")
+    return 0
+
+def _output_name(args, default: str) -> str:
+    return args.name or re.sub(r'[^0-9A-Za-z_-]+', '', default) or 'records'
+
+def cmd_range(args) -> int:
+    """查询时间范围内的全部日志并分析"""
+    os.makedirs(args.out_dir, exist_ok=True)
+    name = _output_name(args, f"{args.begin or ''}-{args.end or ''}")
+    server = KongmingELKServer(**_server_kwargs(args))
+    records = server.query_by_time_range(timestamp_begin=args.begin, timestamp_end=args.end, size=args.size, pagesize=args.pagesize,
+                                         out_file=os.path.join(args.out_dir, f"{name}.json"))
+    return _write_records(args, records, name)
+
+def cmd_phrase(args) -> int:
+    """按短语(和term条件)查询日志并分析"""
+    os.makedirs(args.out_dir, exist_ok=True)
+    name = _output_name(args, args.phrase)
+    server = KongmingELKServer(**_server_kwargs(args))
+    records = server.query_by_phrase(args.phrase,
+                                     match_fields=args.fields,
+                                     terms=dict(args.term) if args.term else None,
+                                     timestamp_begin=args.begin,
+                                     timestamp_end=args.end,
+                                     size=args.size,
+                                     pagesize=args.pagesize,
+                                     out_file=os.path.join(args.out_dir, f"{name}.json"))
+    return _write_records(args, records, name)
+
+# ---------------------------------------------------------------------------
+# sync
+
+def sync_windows(begin: datetime, end: datetime, window: timedelta) -> List[Tuple[datetime, datetime]]:
+    """把[begin, end)切分为长度为window的时间窗口, 最后一个窗口可能较短"""
+    windows = []
+    start = begin
+    while start < end:
+        stop = min(start + window, end)
+        windows.append((start, stop))
+        start = stop
+    return windows
+
+def _utc(value: datetime) -> datetime:
+    """转换为不带时区的UTC时间; 不带时区的时间本身就按UTC解释(与发给ELK的查询一致)"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def sync_window(server_kwargs: Dict[str, Any], filter_kwargs: Dict[str, Any], filename: str,
+                size: int, pagesize: int, users_file: Optional[str] = None,
+                shard_hits: int = DEFAULT_SHARD_HITS, parallel: int = 1) -> int:
+    """
+    把一个时间窗口的对话导出到filename, 返回行数
+
+    先写到同目录下的临时文件(.开头, 后缀不变), 完成后改名, 所以存在的文件都是完整的.
+    """
+    directory, basename = os.path.split(filename)
+    partial = os.path.join(directory, f".{basename}")
+    server = KongmingELKServer(**server_kwargs)
+    exporter = get_exporter(partial, users=UserResolver(users_file) if users_file else None)
+    with exporter:
+        for batch in server.iter_dialogs(DialogLogFilter(**filter_kwargs), size=size, pagesize=pagesize, shard_hits=shard_hits, parallel=parallel):
+            exporter.export(batch)
+    os.replace(partial, filename)
+    return exporter.rows_written
+
+def cmd_sync(args) -> int:
+    """
+    按时间窗口把对话同步到目录中, 每个窗口一个文件, 多个窗口并发查询
+
+    时间按UTC解释. 已经存在的窗口文件被跳过, 中断后重新运行即可继续; 还没有结束的窗口(结束时间晚于
+    当前UTC时间, 或者没有指定--end时最后一个不完整的窗口)不会写出, 留给之后的运行. 指定--end时
+    比--window短的最后一个窗口在文件名中带上结束时间, 之后用更晚的--end同步时完整的窗口写到另一个文件.
+    跨越窗口边界的对话轮次会在两个窗口中各自组装为不完整的round.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    begin = _utc(datetime.fromisoformat(args.begin))
+    end = _utc(datetime.fromisoformat(args.end)) if args.end else now
+    os.makedirs(args.directory, exist_ok=True)
+
+    server_kwargs = _server_kwargs(args)
+    jobs: Dict[str, Dict[str, Any]] = {}
+    for start, stop in sync_windows(begin, end, args.window):
+        if stop > now or (args.end is None and stop - start < args.window):
+            _log(f"windows from {start.isoformat()} are not finished yet, skipped")
+            break
+        name = f"{start:%Y%m%dT%H%M%S}" if stop - start == args.window else f"{start:%Y%m%dT%H%M%S}-{stop:%Y%m%dT%H%M%S}"
+        filename = os.path.join(args.directory, f"{args.env}-dialogs-{name}.{args.format}")
+        if os.path.exists(filename):
+            continue
+        jobs[filename] = dict(timestamp_begin=start.isoformat(timespec='milliseconds'),
+                              timestamp_end=stop.isoformat(timespec='milliseconds'),
+                              glass_product=args.glass_product,
+                              id_type=args.id_type,
+                              id_value=args.id_value,
+                              phrase=args.phrase)
+    if not jobs:
+        _log("already up to date")
+        return 0
+
+    failed = 0
+    with _executor(args) as executor:
+        futures = {executor.submit(sync_window, server_kwargs, filter_kwargs, filename, args.size, args.pagesize, args.users,
+                                   args.shard_hits, args.parallel): filename
+                   for filename, filter_kwargs in jobs.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            filename = futures[future]
+            try:
+                _log(f"[{done}/{len(jobs)}] {filename}: {future.result()} rounds")
+            except Exception as e:
+                failed += 1
+                _log(f"[{done}/{len(jobs)}] {filename}: {type(e).__name__}: {e}")
+    return 1 if failed else 0
+
+# ---------------------------------------------------------------------------
+
+def _add_filter_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--begin', help="开始时间(含), 如 2025-08-15T00:00:00")
+    parser.add_argument('--end', help="结束时间(不含)")
+    parser.add_argument('--glass-product', help="眼镜类型代码, 如 1003")
+    parser.add_argument('--id-type', choices=['deviceId', 'glassDeviceId', 'iotDeviceId', 'xjAccountId', 'accountId'])
+    parser.add_argument('--id-value')
+    parser.add_argument('--phrase', help="请求/响应中包含的短语")
+
+def _add_size_arguments(parser: argparse.ArgumentParser, size: int = 10000):
+    parser.add_argument('--size', type=int, default=size, help="最多取回的对话轮次或记录数")
+    parser.add_argument('--pagesize', type=int, default=1000)
+
+def _add_shard_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--shard-hits', type=int, default=DEFAULT_SHARD_HITS,
+                        help="按命中数把时间窗口拆成分片, 每个分片最多的命中数; 0表示不拆分(最多取回10000条命中)")
+    parser.add_argument('--parallel', type=int, default=1, help="同时取回的分片数")
+
+def _add_jobs_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('-j', '--jobs', type=int, default=min(8, (os.cpu_count() or 1) * 2), help="同时进行的任务数")
+    parser.add_argument('--processes', action='store_true', help="使用子进程而不是线程")
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='kongming', description="Query and analyze kongming dialog logs from ELK")
+    parser.add_argument('--server', default="https://elk.xjsdtech.com")
+    parser.add_argument('--username', default="ai")
+    parser.add_argument('--password', default="ai@123456")
+    parser.add_argument('--env', choices=['uat', 'prod', 'fat'], default='uat')
+    parser.add_argument('--users', help="使用者映射文件, 如 device_user_map.csv")
+    parser.add_argument('--profile', choices=PROFILE_MODES,
+                        help="profile这次运行, 结果写在输出旁边; 也可以设置KONGMING_PROFILE")
+    parser.add_argument('--report', action='store_true', help="结束时打印各阶段耗时")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('dialogs', help="查询对话轮次, 打印表格, 可以同时写到文件")
+    _add_filter_arguments(p)
+    _add_size_arguments(p, size=2000)
+    _add_shard_arguments(p)
+    p.add_argument('-o', '--output', help="同时写到文件(.xlsx, .csv[.gz], .jsonl[.gz], .parquet)")
+    p.add_argument('--progress', action='store_true', help="打印取回的命中数")
+    p.add_argument('-q', '--quiet', action='store_true', help="不打印对话表格")
+    p.set_defaults(func=cmd_dialogs)
+
+    p = commands.add_parser('trace', help="批量分析traceId")
+    p.add_argument('trace_ids', nargs='*', metavar='TRACE_ID', help="traceId, - 表示从标准输入读取")
+    p.add_argument('-f', '--file', help="每行一个traceId的文件, - 表示标准输入")
+    p.add_argument('--out-dir', default=DEFAULT_OUT_DIR)
+    p.add_argument('-q', '--quiet', action='store_true', help="不打印对话表格")
+    _add_jobs_arguments(p)
+    p.add_argument('--async', dest='use_async', action='store_true', help="在一个事件循环中并发查询")
+    p.set_defaults(func=cmd_trace)
+
+    p = commands.add_parser('range', help="查询并分析时间范围内的全部日志")
+    p.add_argument('--begin', required=True)
+    p.add_argument('--end')
+    p.add_argument('--name', help="输出文件名(不含后缀), 默认由时间范围生成")
+    p.add_argument('--out-dir', default=DEFAULT_OUT_DIR)
+    _add_size_arguments(p)
+    p.set_defaults(func=cmd_range)
+
+    p = commands.add_parser('phrase', help="按短语查询并分析日志")
+    p.add_argument('phrase')
+    p.add_argument('--fields', nargs='+', default=['*'])
+    p.add_argument('--term', type=parse_term, action='append', metavar='FIELD=VALUE')
+    p.add_argument('--begin')
+    p.add_argument('--end')
+    p.add_argument('--name', help="输出文件名(不含后缀), 默认由短语生成")
+    p.add_argument('--out-dir', default=DEFAULT_OUT_DIR)
+    _add_size_arguments(p)
+    p.set_defaults(func=cmd_phrase)
+
+    p = commands.add_parser('export', help="查询对话并流式写到文件")
+    p.add_argument('output')
+    p.add_argument('--format', choices=available_formats())
+    p.add_argument('--compression')
+    _add_filter_arguments(p)
+    _add_size_arguments(p)
+    _add_shard_arguments(p)
+    p.add_argument('--progress', action='store_true', help="打印取回的命中数")
+    p.set_defaults(func=cmd_export)
+
+    p = commands.add_parser('sync', help="按时间窗口并发同步对话到目录, 可中断后继续")
+    p.add_argument('directory')
+    p.add_argument('--begin', required=True, help="开始时间(UTC)")
+    p.add_argument('--end', help="结束时间(UTC), 默认为当前时间; 还没有结束的窗口不会同步")
+    p.add_argument('--window', type=parse_window, default=timedelta(hours=1), help="每个文件的时间跨度, 如 30m, 1h, 1d")
+    p.add_argument('--format', choices=[f for f in ['csv', 'csv.gz', 'jsonl', 'jsonl.gz', 'parquet', 'xlsx'] if f.split('.')[0] in available_formats()],
+                   default='jsonl.gz')
+    p.add_argument('--glass-product')
+    p.add_argument('--id-type', choices=['deviceId', 'glassDeviceId', 'iotDeviceId', 'xjAccountId', 'accountId'])
+    p.add_argument('--id-value')
+    p.add_argument('--phrase')
+    _add_size_arguments(p)
+    _add_shard_arguments(p)
+    _add_jobs_arguments(p)
+    p.set_defaults(func=cmd_sync)
+    return parser
+
+def _profile_output(args) -> Optional[str]:
+    """profile结果放在这次运行的输出旁边"""
+    if getattr(args, 'output', None):
+        return args.output
+    if getattr(args, 'directory', None):
+        return os.path.join(args.directory, 'sync')
+    if getattr(args, 'out_dir', None):
+        return os.path.join(args.out_dir, args.command)
+    return None
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    with profile(_profile_output(args), mode=args.profile, name=args.command, all_threads=True) as profiler:
+        code = args.func(args)
+    if profiler is not None:
+        _log(f"profile written to {', '.join(profiler.files)}")
+    if args.report:
+        print_report()
+    return code
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,34 @@
-from typing import List
+from typing import List, Optional
 from .model import DialogRound
+from .schema import DIALOG_ROUND_SCHEMA
+from .users import USER_COLUMN_TITLE, UserResolver
+from . import instrument
 
 from .utils import convert_timestamp
 
-def print_dialog_round_table(rounds: List[DialogRound]):
+# 控制台表格只显示部分列: (schema中的key, 表头, rich列参数)
+_TABLE_COLUMNS = [
+    ('timestamp', "Timestamp", dict(style="dim", no_wrap=True)),  # 不换行
+    # ('session_id', "Session ID", dict(width=36)),
+    ('trace_id', "Trace ID", dict(no_wrap=True)),
+    # ('account_id', "Account ID", dict(width=15)),
+    ('device_id', "Device ID", dict(no_wrap=True)),
+    ('glass_device_id', "Glass Device ID", dict(no_wrap=True)),
+    ('glass_product', "眼镜类型", dict(no_wrap=True)),
+    ('nlu_query', "Query", dict(width=30)),
+    ('nlu_intent', "Intent", dict(no_wrap=True)),
+    ('llm_query', "LLM Query", dict(width=30)),
+]
+
+TABLE_SCHEMA = DIALOG_ROUND_SCHEMA.subset([key for key, _, _ in _TABLE_COLUMNS])
+
+def print_dialog_round_table(rounds: List[DialogRound], users: Optional[UserResolver] = None):
     """
     使用rich库打印DialogRound表格
     
     Args:
         rounds: DialogRound对象列表
+        users: 使用者映射, 提供时在序号之后显示使用者列
     """
     from rich.table import Table
     from rich.console import Console
@@ -21,32 +41,24 @@ def print_dialog_round_table(rounds: List[DialogRound]):
     
     # 添加列
     table.add_column("No.", style="dim", width=5, no_wrap=True)  # 序号列
-    table.add_column("Timestamp", style="dim", no_wrap=True)  # 不换行
-    # table.add_column("Session ID", width=36)
-    table.add_column("Trace ID", no_wrap=True)
-    # table.add_column("Account ID", width=15)
-    table.add_column("Device ID", no_wrap=True)
-    table.add_column("Glass Device ID", no_wrap=True)
-    table.add_column("眼镜类型", no_wrap=True)
-    table.add_column("Query", width=30)
-    table.add_column("Intent", no_wrap=True)
-    table.add_column("LLM Query", width=30)
+    if users is not None:
+        table.add_column(USER_COLUMN_TITLE, no_wrap=True)
+    for _, header, kwargs in _TABLE_COLUMNS:
+        table.add_column(header, **kwargs)
     
     # 添加行数据
+    extract = TABLE_SCHEMA.extract
+    llm_style = Style(bgcolor='light_sea_green')
     for idx, round in enumerate(rounds, 1):  # 序号从1开始
+        timestamp, *values = extract(round)
         table.add_row(
             str(idx),  # 序号
-            convert_timestamp(round.nlp_round.request_timestamp) if round.nlp_round.request_timestamp else "",
-            # round.sessionId or "",
-            round.traceId or "",
-            round.deviceId or "",
-            round.glassDeviceId or "",
-            round.glassProduct or "",
-            round.nlp_round.query or "",
-            str(round.nlp_round.intent or ""),
-            (round.llm_round.query or "") if round.llm_round else "",
-            style=Style(bgcolor='light_sea_green') if round.llm_round else None
+            *([users.resolve(round)] if users is not None else []),
+            convert_timestamp(timestamp) if timestamp else "",
+            *["" if value is None else str(value) for value in values],
+            style=llm_style if round.llm_round else None
         )
     
     # 打印表格
-    console.print(table)
+    with instrument.span('console.print'):
+        console.print(table)
@@ -1,9 +1,22 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
 import httpx
+import itertools
 import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from typing import List, Union, Dict, Any, Optional, Tuple, Any, Literal
+from typing import List, Union, Dict, Any, Optional, Tuple, Any, Literal, Iterator, AsyncIterator, Callable, Deque
 from .constants import CLEAN_CONTEXT_MAGIC_STRING
-from .model import DialogLogFilter, DialogRound, Location, NLPRound, LLMRound, NLPIntent, NLPUtterance, OssFile
+from .model import DialogLogFilter, DialogRound, DialogRoundAssembler, Location, NLPRound, LLMRound, NLPIntent, NLPUtterance, OssFile
+from .planner import DEFAULT_SHARD_HITS, QueryShard, plan_shards, plan_shards_async, shard_must_clause
+from .sessions import SessionIndex
+from .transport import MAX_RESULT_WINDOW, RETRY_STATUS, PageCursor, PageSizer, TransportConfig, TransportError, retry_delay
+from . import instrument
 
 
 null = None
@@ -40,17 +53,30 @@ def Message(x):
 
 KongmingEnvironmentType = Literal['uat', 'prod', 'fat']
 
+class QueryCancelled(Exception):
+    """查询被取消(cancel事件被设置)时抛出"""
+    pass
+
+def _check_cancelled(cancel: Optional[threading.Event]):
+    if cancel is not None and cancel.is_set():
+        raise QueryCancelled()
+
 class KongmingELKServer(object):
     DEFAUL_EXCLUDE_FIELDS = ["messageobj","log","level","fields","input","lblpl","lmt","class"]
 
+    # 按trace id精确查询时匹配的字段, 每个字段同时匹配它的.keyword子字段(text类型的字段只能用.keyword精确匹配)
+    TRACE_ID_FIELDS = ["traceId", "trace_id", "terminalTraceId", "requestId"]
+
     def __init__(self, server="https://elk.xjsdtech.com", 
                  username="ai", 
                  password="ai@123456", 
                  env:KongmingEnvironmentType="uat",
-                 exclude_fields:Union[List[str],None]=None):
+                 exclude_fields:Union[List[str],None]=None,
+                 transport:Optional[TransportConfig]=None):
         self.server=server
         self.auth = (username, password)
         self.exclude_fields = exclude_fields or KongmingELKServer.DEFAUL_EXCLUDE_FIELDS
+        self.transport = transport or TransportConfig()
 
         self.url = self._format_url(env)
 
@@ -139,6 +165,7 @@ class KongmingELKServer(object):
                     if msg.startswith(prefix):
                         msg = msg[len(prefix):]
                         src['message.prefix'] = prefix
+                        instrument.count_label('transform.prefix', prefix)
                         break
                 src['message'] = msg
 
@@ -197,6 +224,7 @@ class KongmingELKServer(object):
                                         ]:
                                 if x.startswith(prefix):
                                     x = x[len(prefix):]
+                                    instrument.count_label('transform.msg_prefix', prefix)
 
                                     if prefix == "{'get_dify_global_todos response: 200, text:":
                                         x = x[:-2]
@@ -253,45 +281,200 @@ class KongmingELKServer(object):
 
         return record
 
+    def _iter_query_pages(self,
+                          request_body:Dict[str, Any],
+                          size:int,
+                          pagesize:int,
+                          env:Optional[KongmingEnvironmentType]=None,
+                          out_file:Optional[str]=None,
+                          cancel:Optional[threading.Event]=None,
+                          cursor:Optional[PageCursor]=None,
+                          progress:bool=True) -> Iterator[Tuple[List[Dict[str, Any]], int]]:
+        """
+        逐页执行查询, 每取回一页就yield一次 (本页转换后的记录, 命中总数)
+
+        按request_body中的@timestamp排序用search_after翻页, 直到取满min(size, 命中总数).
+        第一页取pagesize条, 之后的页大小根据实际的耗时和响应大小调整(见PageSizer).
+        429/5xx和超时按self.transport重试, 超时的页减半; 仍然失败时抛出TransportError,
+        把它的cursor传回来可以从失败的那一页继续. 第一页返回其它非200响应时不yield任何结果.
+
+        每次请求之前和转换每一页之前检查cancel, 被设置时抛出QueryCancelled.
+        正在进行的请求不会被中断. progress为False时不显示tqdm进度条(由调用方汇总显示).
+        """
+        url = self._format_url(env) if env else self.url
+        cursor = cursor or PageCursor()
+        sizer = PageSizer(self.transport, pagesize)
+        progress_bar = None
+
+        try:
+            while cursor.fetched < size and (cursor.hits_total is None or cursor.fetched < cursor.hits_total):
+                res_json = self._fetch_page(url, request_body, cursor, sizer, size - cursor.fetched, cancel)
+                if res_json is None:
+                    return
+
+                if out_file and cursor.search_after is None:
+                    with open(out_file, mode='w', encoding='utf-8') as f_orig:
+                        json.dump(res_json, f_orig, ensure_ascii=False, indent=2)
+
+                total = res_json['hits']['total']
+                hits_total = total['value']
+                if total.get('relation', 'eq') == 'eq':
+                    cursor.hits_total = hits_total
+
+                hits = res_json['hits']['hits']
+                if not hits:
+                    break
+                # sort在transform_record中会被删除, 先记下翻页位置
+                records = cursor.advance(hits, size - cursor.fetched)
+                if not records:
+                    break
+
+                if progress_bar is None and progress and min(size, hits_total) > len(records):
+                    progress_bar = tqdm(total=min(size, hits_total), initial=len(records))
+                elif progress_bar is not None:
+                    progress_bar.update(len(records))
+
+                _check_cancelled(cancel)
+                yield self._transform_page(records), hits_total
+        finally:
+            if progress_bar is not None:
+                progress_bar.close()
+
+    def _fetch_page(self,
+                    url:str,
+                    request_body:Dict[str, Any],
+                    cursor:PageCursor,
+                    sizer:PageSizer,
+                    remaining:int,
+                    cancel:Optional[threading.Event]=None) -> Optional[Dict[str, Any]]:
+        """请求cursor处的下一页, 按self.transport重试; 第一页返回不可重试的错误时返回None"""
+        try:
+            res_json, response, elapsed = self._post_with_retry(url, lambda: cursor.request_body(request_body, sizer.next_size(remaining)),
+                                                                cancel=cancel, on_timeout=sizer.shrink)
+        except TransportError as e:
+            e.cursor = cursor
+            raise
+
+        if res_json is None:
+            if cursor.search_after is None:
+                return None
+            raise TransportError(f"ELK query failed: HTTP {response.status_code}", cursor, response.status_code)
+
+        sizer.observe(len(res_json['hits']['hits']), elapsed, len(response.content))
+        return res_json
+
+    def _search(self,
+                request_body:Dict[str, Any],
+                env:Optional[KongmingEnvironmentType]=None,
+                cancel:Optional[threading.Event]=None) -> Dict[str, Any]:
+        """执行一次不翻页的查询(例如只要计数或聚合), 按self.transport重试, 失败时抛出TransportError"""
+        url = self._format_url(env) if env else self.url
+        res_json, response, _ = self._post_with_retry(url, lambda: request_body, cancel=cancel)
+        if res_json is None:
+            raise TransportError(f"ELK query failed: HTTP {response.status_code}", None, response.status_code)
+        return res_json
+
+    def _post_with_retry(self,
+                         url:str,
+                         make_body:Callable[[], Dict[str, Any]],
+                         cancel:Optional[threading.Event]=None,
+                         on_timeout:Optional[Callable[[], None]]=None) -> Tuple[Optional[Dict[str, Any]], Optional[httpx.Response], float]:
+        """
+        发送查询, 429/5xx, 超时和连接错误按self.transport等待后重试
+
+        每次尝试前调用make_body生成请求体(例如超时后on_timeout缩小了页大小).
+        返回 (响应json, 响应, 耗时秒数); 不可重试的非200响应返回的json为None; 重试之后仍然失败时抛出TransportError.
+        """
+        config = self.transport
+        error = None
+        response = None
+        for attempt in range(config.retries + 1):
+            if attempt:
+                instrument.count('elk.retries')
+                delay = retry_delay(config, attempt - 1, response)
+                if cancel is not None:
+                    cancel.wait(delay)
+                else:
+                    time.sleep(delay)
+            _check_cancelled(cancel)
+
+            body = make_body()
+            response = None
+            begin = time.perf_counter()
+            try:
+                with instrument.span('elk.request'):
+                    response = httpx.post(url, auth=self.auth, headers=self.headers, json=body, timeout=config.timeout)
+            except httpx.TimeoutException as e:
+                instrument.count('elk.timeouts')
+                if on_timeout is not None:
+                    on_timeout()
+                error = f"timeout: {e}"
+                continue
+            except httpx.TransportError as e:
+                instrument.count('elk.errors')
+                error = f"{type(e).__name__}: {e}"
+                continue
+            elapsed = time.perf_counter() - begin
+            instrument.count('elk.requests')
+            instrument.count('elk.bytes', len(response.content))
+
+            if response.status_code == 200:
+                with instrument.span('elk.json'):
+                    return response.json(), response, elapsed
+
+            instrument.count('elk.errors')
+            error = f"HTTP {response.status_code}"
+            if response.status_code not in RETRY_STATUS:
+                return None, response, elapsed
+
+        raise TransportError(f"ELK query failed after {config.retries} retries: {error}", None,
+                             response.status_code if response is not None else None)
+
+    def _transform_page(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        instrument.count('elk.hits', len(records))
+        with instrument.span('elk.transform'):
+            return [self.transform_record(r) for r in records]
+
     def _run_query(self, 
                    request_body:Dict[str, Any], 
                    size:int,
                    pagesize:int,
                    env:Optional[KongmingEnvironmentType]=None,
                    out_file:Optional[str]=None):
-        url = self._format_url(env) if env else self.url
-
-        response = httpx.post(url, auth=self.auth, headers=self.headers, json=request_body, timeout=20)
         records = []
-
-        if response.status_code == 200:
-            res_json = response.json()
-
-            if out_file:
-                with open(out_file, mode='w', encoding='utf-8') as f_orig:
-                    json.dump(res_json, f_orig, ensure_ascii=False, indent=2)
-
-            hits_total = res_json['hits']['total']['value']
-            records = res_json['hits']['hits']
-
-            if min(size, hits_total) > pagesize:
-                for offset in tqdm(range(pagesize, min(size, hits_total), pagesize)):
-                    request_body['from'] = offset
-                    request_body['size'] = pagesize
-                    response = httpx.post(url, auth=self.auth, headers=self.headers, json=request_body)
-                    res_json = response.json()
-                    records += res_json['hits']['hits']
+        for page, _ in self._iter_query_pages(request_body=request_body, size=size, pagesize=pagesize, env=env, out_file=out_file):
+            records += page
 
         # print(json.dumps(request_body, indent=2, ensure_ascii=False))
-        return [self.transform_record(r) for r in records]
+        return records
 
     def query_dialogs(self, 
                       filter: DialogLogFilter, 
                       size:int=10000, 
                       pagesize:int=1000, 
                       env:Optional[KongmingEnvironmentType]=None,
-                      out_file:Optional[str]=None
+                      out_file:Optional[str]=None,
+                      cancel:Optional[threading.Event]=None,
+                      sessions:Optional[SessionIndex]=None,
+                      shard_hits:int=DEFAULT_SHARD_HITS,
+                      parallel:int=1
                     ) -> Tuple[Dict[str,Any],List[DialogRound]]:
+        """
+        查询对话记录并组装成round, 最多size个round
+
+        时间窗口按命中数拆成不超过shard_hits的分片依次取回, parallel>1时并行取回多个分片; shard_hits=0时不拆分.
+        """
+        records: List[Dict[str, Any]] = []
+        rounds: List[DialogRound] = []
+
+        for page, batch, _, _ in self._iter_dialog_batches(must_clause=self._dialog_must_clause(filter), size=size, pagesize=pagesize, env=env, out_file=out_file, cancel=cancel, sessions=sessions,
+                                                           shard_hits=shard_hits, parallel=parallel):
+            records += page
+            rounds += batch
+
+        return records, rounds
+
+    def _dialog_must_clause(self, filter: DialogLogFilter) -> List[Dict[str, Any]]:
         fields = ["central-nlp-request", "central-nlp-response", "central-answer-request", "central-answer-response"]
         must_clause = [
                         {
@@ -361,17 +544,22 @@ class KongmingELKServer(object):
                 }
             })
 
+        return must_clause
+
+    @staticmethod
+    def _dialog_query_size(size:int) -> int:
         # 对每个trace_id, 实际可能搜到4条或６条 (两次nlp请求+响应，１次llm请求+响应)，这里放大到８倍
-        query_size = min(size * 8, 10000)
+        return min(size * 8, 10000)
 
-        request_body = {
+    def _dialog_request_body(self, must_clause: List[Dict[str, Any]], query_size:int, pagesize:int) -> Dict[str, Any]:
+        return {
             "query": {
                 "bool": {
                     "must": must_clause,
                 }
             },
             "from": 0,
-            "size": query_size,
+            "size": min(pagesize, query_size),
             "sort": [
                 { "@timestamp": "asc" }
             ],
@@ -380,44 +568,156 @@ class KongmingELKServer(object):
             }
         }
 
-        # print(json.dumps(request_body, indent=2, ensure_ascii=False ))
-        records = self._run_query(request_body=request_body, size=query_size, pagesize=pagesize, env=env, out_file=out_file)
-
-        traceid_round_map = {}
-        for r in records:
-            traceId = r['_source']['traceId']
-            if traceId not in traceid_round_map:
-                traceid_round_map[traceId] = {
-                    'nlp_request': None,
-                    'nlp_response': None,
-                    'llm_request': None,
-                    'llm_response': None
-                }
-
-            # 在大模型请求时，同一个traceId可能会有２个NLU请求，第二个通话是清除上下文的动作，因此如果已经有第一个消息了，就不要再存入map
-            if 'central-nlp-request' in r['_source']:
-                if traceid_round_map[traceId].get('nlp_request') is None:
-                    traceid_round_map[traceId]['nlp_request'] = r
-            elif 'central-nlp-response' in r['_source']:
-                if traceid_round_map[traceId].get('nlp_request') is not None and traceid_round_map[traceId].get('nlp_response') is None:
-                    traceid_round_map[traceId]['nlp_response'] = r
-            elif 'central-answer-request' in r['_source']:
-                traceid_round_map[traceId]['llm_request'] = r
-            elif 'central-answer-response' in r['_source']:
-                traceid_round_map[traceId]['llm_response'] = r
-
-        rounds:List[DialogRound] = []
-
-        for traceId in traceid_round_map:
-            round = DialogRound.from_records(**traceid_round_map[traceId])
-
-            if round is not None:
-                rounds.append(round)
-
-        if len(rounds) > size:
-            rounds = rounds[:size]
+    def _iter_dialog_batches(self,
+                             must_clause: List[Dict[str, Any]],
+                             size:int,
+                             pagesize:int,
+                             env:Optional[KongmingEnvironmentType]=None,
+                             out_file:Optional[str]=None,
+                             cancel:Optional[threading.Event]=None,
+                             sessions:Optional[SessionIndex]=None,
+                             shard_hits:int=DEFAULT_SHARD_HITS,
+                             parallel:int=1
+                            ) -> Iterator[Tuple[List[Dict[str,Any]], List[DialogRound], int, int]]:
+        """
+        逐页查询对话记录并增量组装round
+
+        每取回一页yield一次 (本页记录, 本页新组装完成的round, 已取回的命中数, 计划取回的命中数).
+        指定sessions时, 新组装完成的round在yield之前加入会话索引.
+        记录的取回方式见_iter_dialog_pages; 组装够size个round之后不再请求新的页.
+        """
+        assembler = DialogRoundAssembler(size=size)
+        fetched = 0
+
+        with contextlib.closing(self._iter_dialog_pages(must_clause, size, pagesize, env=env, out_file=out_file, cancel=cancel,
+                                                        shard_hits=shard_hits, parallel=parallel)) as pages:
+            for page, total in pages:
+                fetched += len(page)
+                with instrument.span('dialogs.assemble'):
+                    batch = assembler.add_records(page)
+                instrument.count('dialogs.rounds', len(batch))
+                if sessions is not None:
+                    with instrument.span('dialogs.sessions'):
+                        sessions.add_rounds(batch)
+                yield page, batch, fetched, total
+
+                if assembler.done:
+                    return
+
+        with instrument.span('dialogs.assemble'):
+            batch = assembler.flush()
+        instrument.count('dialogs.rounds', len(batch))
+        if sessions is not None:
+            with instrument.span('dialogs.sessions'):
+                sessions.add_rounds(batch)
+        yield [], batch, fetched, fetched
+
+    def _iter_dialog_pages(self,
+                           must_clause: List[Dict[str, Any]],
+                           size:int,
+                           pagesize:int,
+                           env:Optional[KongmingEnvironmentType]=None,
+                           out_file:Optional[str]=None,
+                           cancel:Optional[threading.Event]=None,
+                           shard_hits:int=DEFAULT_SHARD_HITS,
+                           parallel:int=1
+                          ) -> Iterator[Tuple[List[Dict[str,Any]], int]]:
+        """
+        按@timestamp升序逐页取回对话记录, yield (本页记录, 计划取回的命中数)
+
+        先用plan_shards统计命中数, 把时间窗口拆成命中数不超过shard_hits的分片, 按时间顺序取回每个分片的全部记录.
+        分片首尾相接, 记录整体仍然按时间升序, 跨分片边界的trace可以由同一个DialogRoundAssembler正确组装.
+        parallel>1时同时取回接下来的parallel个分片, 调用方停止迭代后不再请求新的分片.
+        out_file只保存第一个分片的第一页.
+
+        shard_hits为0时不统计也不拆分, 只取回 min(size*8, 10000) 条命中(命中更多时round可能不完整).
+        """
+        if not shard_hits:
+            query_size = self._dialog_query_size(size)
+            request_body = self._dialog_request_body(must_clause, query_size, pagesize)
+            for page, hits_total in self._iter_query_pages(request_body=request_body, size=query_size, pagesize=pagesize, env=env, out_file=out_file, cancel=cancel):
+                yield page, min(query_size, hits_total)
+            return
+
+        plan = plan_shards(self, must_clause, shard_hits, env=env, cancel=cancel)
+        if plan.total_hits == 0:
+            return
+
+        def shard_pages(index: int, shard: QueryShard, shard_cancel: Optional[threading.Event]) -> Iterator[List[Dict[str, Any]]]:
+            request_body = self._dialog_request_body(shard_must_clause(must_clause, shard), max(1, shard.hits), pagesize)
+            # 分片的命中数以取回时为准: 窗口没有结束时间时, 最后一个分片在统计之后可能还有新的记录
+            for page, _ in self._iter_query_pages(request_body=request_body, size=sys.maxsize, pagesize=pagesize, env=env,
+                                                  out_file=out_file if index == 0 else None, cancel=shard_cancel, progress=False):
+                yield page
+
+        progress_bar = tqdm(total=plan.total_hits) if plan.total_hits > pagesize else None
+        try:
+            if parallel <= 1 or len(plan) == 1:
+                for index, shard in enumerate(plan.shards):
+                    for page in shard_pages(index, shard, cancel):
+                        if progress_bar is not None:
+                            progress_bar.update(len(page))
+                        yield page, plan.total_hits
+                return
+
+            recorder = instrument.current()
+            stop = threading.Event()
+
+            def fetch_shard(index: int, shard: QueryShard) -> List[List[Dict[str, Any]]]:
+                with instrument.recording(recorder):
+                    return list(shard_pages(index, shard, stop))
+
+            executor = ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='kongming-shard')
+            shards = enumerate(plan.shards)
+            futures = collections.deque(executor.submit(fetch_shard, index, shard) for index, shard in itertools.islice(shards, parallel))
+            try:
+                while futures:
+                    future = futures.popleft()
+                    following = next(shards, None)
+                    if following is not None:
+                        futures.append(executor.submit(fetch_shard, *following))
+                    # 等待时也要响应cancel
+                    while not concurrent.futures.wait([future], timeout=0.2).done:
+                        _check_cancelled(cancel)
+                    for page in future.result():
+                        if progress_bar is not None:
+                            progress_bar.update(len(page))
+                        yield page, plan.total_hits
+            finally:
+                stop.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+        finally:
+            if progress_bar is not None:
+                progress_bar.close()
+
+    def iter_dialogs(self,
+                     filter: DialogLogFilter,
+                     size:int=10000,
+                     pagesize:int=1000,
+                     env:Optional[KongmingEnvironmentType]=None,
+                     progress:Optional[Callable[[int, int], None]]=None,
+                     cancel:Optional[threading.Event]=None,
+                     sessions:Optional[SessionIndex]=None,
+                     shard_hits:int=DEFAULT_SHARD_HITS,
+                     parallel:int=1
+                    ) -> Iterator[List[DialogRound]]:
+        """
+        与query_dialogs相同的查询, 但每取回一页就yield这一页新组装完成的round
+
+        Args:
+            progress: 每页之后调用progress(已取回的命中数, 计划取回的命中数)
+            cancel: 被设置后不再请求新的页, 并抛出QueryCancelled
+            sessions: 组装完成的round同时加入这个会话索引
+            shard_hits: 每个分片最多的命中数, 0表示不拆分
+            parallel: 同时取回的分片数
+        """
+        for _, batch, fetched, total in self._iter_dialog_batches(must_clause=self._dialog_must_clause(filter), size=size, pagesize=pagesize, env=env, cancel=cancel, sessions=sessions,
+                                                                  shard_hits=shard_hits, parallel=parallel):
+            if progress:
+                progress(fetched, total)
+            if batch:
+                yield batch
 
-        return records, rounds
     def query_by_phrase(self, 
                         match_phrase:str,
                         match_fields:List[str]=["*"],
@@ -428,6 +728,16 @@ class KongmingELKServer(object):
                         pagesize:int=10,
                         env:Optional[KongmingEnvironmentType]=None,
                         out_file:Optional[str]=None):
+        request_body = self._phrase_request_body(match_phrase, match_fields, terms, timestamp_begin, timestamp_end, pagesize)
+        return self._run_query(request_body=request_body, size=size, pagesize=pagesize, env=env, out_file=out_file)
+
+    def _phrase_request_body(self,
+                             match_phrase:str,
+                             match_fields:List[str],
+                             terms:Union[Dict[str,Any],None],
+                             timestamp_begin:Optional[str],
+                             timestamp_end:Optional[str],
+                             pagesize:int) -> Dict[str, Any]:
         must_clause = [
                         {
                             "multi_match": {
@@ -535,9 +845,7 @@ class KongmingELKServer(object):
             }
         }
 
-
-        return self._run_query(request_body=request_body, size=size, pagesize=pagesize, env=env, out_file=out_file)
-
+        return request_body
 
     def query_by_time_range(self, 
                         timestamp_begin:Optional[str]=None,
@@ -549,6 +857,13 @@ class KongmingELKServer(object):
         if timestamp_begin is None and timestamp_end is None:
             return None
 
+        request_body = self._time_range_request_body(timestamp_begin, timestamp_end, pagesize)
+        return self._run_query(request_body=request_body, size=size, pagesize=pagesize, env=env, out_file=out_file)
+
+    def _time_range_request_body(self,
+                                 timestamp_begin:Optional[str],
+                                 timestamp_end:Optional[str],
+                                 pagesize:int) -> Dict[str, Any]:
         must_clause = []
 
         if timestamp_begin:
@@ -595,37 +910,552 @@ class KongmingELKServer(object):
             }
         }
 
-        return self._run_query(request_body=request_body, size=size, pagesize=pagesize, env=env, out_file=out_file)
+        return request_body
+
+    def _trace_id_clause(self, trace_id:str) -> Dict[str, Any]:
+        """在TRACE_ID_FIELDS上精确匹配trace_id, 任意一个字段匹配即可"""
+        return {
+            "bool": {
+                "should": [
+                    {
+                        "terms": { field: [trace_id] }
+                    } for name in self.TRACE_ID_FIELDS for field in (name, f"{name}.keyword")
+                ],
+                "minimum_should_match": 1
+            }
+        }
+
+    def _trace_id_request_body(self,
+                               trace_id:str,
+                               timestamp_begin:Optional[str],
+                               timestamp_end:Optional[str],
+                               pagesize:int) -> Dict[str, Any]:
+        request_body = self._time_range_request_body(timestamp_begin, timestamp_end, pagesize)
+        request_body["query"]["bool"]["must"].append(self._trace_id_clause(trace_id))
+        return request_body
+
+    def _trace_dialog_must_clauses(self, trace_id:str) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        查找trace_id对应round的查询, 按顺序尝试: (名称, must_clause)
+
+        先用terms精确匹配trace id字段; 没有结果时才在请求/响应中做短语查询.
+        """
+        return [
+            ("terms", self._dialog_must_clause(DialogLogFilter()) + [self._trace_id_clause(trace_id)]),
+            ("phrase", self._dialog_must_clause(DialogLogFilter(phrase=trace_id))),
+        ]
 
     def query_dialog_by_trace_id(self, trace_id:str, env:Optional[KongmingEnvironmentType]=None, out_file:Optional[str]=None):
+        rounds = self._query_trace_rounds(trace_id, env=env)
+
+        if rounds:
+            records = self.query_round_records(rounds[0], env=env, out_file=out_file)
+            if records is not None:
+                return records, rounds
+
+        return None
+
+    def _query_trace_rounds(self, trace_id:str, env:Optional[KongmingEnvironmentType]=None) -> List[DialogRound]:
+        """
+        查询trace_id的round, 见_trace_dialog_must_clauses
+
+        一个trace只有几条记录, 不需要统计和拆分分片. 标签计数trace.dialog_lookup记录由哪种查询得到了结果(没有结果时为none).
+        """
+        for lookup, must_clause in self._trace_dialog_must_clauses(trace_id):
+            rounds = []
+            for _, batch, _, _ in self._iter_dialog_batches(must_clause=must_clause, size=1, pagesize=10, env=env, shard_hits=0):
+                rounds += batch
+            if rounds:
+                instrument.count_label('trace.dialog_lookup', lookup)
+                return rounds
+
+        instrument.count_label('trace.dialog_lookup', 'none')
+        return []
+
+    def query_round_records(self,
+                            round: DialogRound,
+                            before: float = 15.0,
+                            after: float = 2.0,
+                            env:Optional[KongmingEnvironmentType]=None,
+                            out_file:Optional[str]=None) -> Optional[List[Dict[str, Any]]]:
+        """
+        查询一轮对话前后时间窗口内该trace_id的所有日志记录
+
+        时间窗口为 [nlp请求时间 - before, 响应时间 + after], 响应时间优先取llm响应.
+        round缺少时间戳时返回None.
+        """
+        window = self._round_time_window(round, before, after)
+        if window is None:
+            return None
+
+        return self._query_trace_records(round.traceId,
+                                         timestamp_begin=window[0],
+                                         timestamp_end=window[1],
+                                         size=10000,
+                                         pagesize=1000,
+                                         env=env,
+                                         out_file=out_file)
+
+    @staticmethod
+    def _round_time_window(round: DialogRound, before: float, after: float) -> Optional[Tuple[str, str]]:
         from .utils import adjust_timestamp
 
-        filter = DialogLogFilter(phrase=trace_id)
+        start_time = round.nlp_round.request_timestamp if round.nlp_round else None
+        stop_time = round.llm_round.response_timestamp if (round.llm_round and round.llm_round.response_timestamp) else None
+
+        if not stop_time:
+            stop_time = round.nlp_round.response_timestamp if (round.nlp_round and round.nlp_round.response_timestamp) else None
+
+        if not start_time or not stop_time:
+            return None
+
+        return adjust_timestamp(start_time, -before), adjust_timestamp(stop_time, after)
 
-        records, rounds = self.query_dialogs(filter, size=1, pagesize=10, env=env, out_file=None)
+    def query_by_trace_id(self, trace_id:str, size:int=10000, pagesize:int=10, env:Optional[KongmingEnvironmentType]=None, out_file:Optional[str]=None):
+        return self._query_trace_records(trace_id, size=size, pagesize=pagesize, env=env, out_file=out_file)
+
+    def _query_trace_records(self,
+                             trace_id:str,
+                             timestamp_begin:Optional[str]=None,
+                             timestamp_end:Optional[str]=None,
+                             size:int=10000,
+                             pagesize:int=10,
+                             env:Optional[KongmingEnvironmentType]=None,
+                             out_file:Optional[str]=None) -> List[Dict[str, Any]]:
+        """
+        查询trace_id的全部日志记录
+
+        先在TRACE_ID_FIELDS上用terms精确匹配; 没有结果时才退回所有字段上的短语查询(代价高, 而且会匹配到正文中提到这个id的记录).
+        标签计数trace.lookup记录由哪种查询得到了结果(terms / phrase, 都没有结果时为none).
+        """
+        request_body = self._trace_id_request_body(trace_id, timestamp_begin, timestamp_end, pagesize)
+        records = self._run_query(request_body=request_body, size=size, pagesize=pagesize, env=env, out_file=out_file)
+        if records:
+            instrument.count_label('trace.lookup', 'terms')
+            return records
+
+        records = self.query_by_phrase(trace_id, timestamp_begin=timestamp_begin, timestamp_end=timestamp_end,
+                                       size=size, pagesize=pagesize, env=env, out_file=out_file)
+        instrument.count_label('trace.lookup', 'phrase' if records else 'none')
+        return records
+
+
+class AsyncKongmingELKServer(KongmingELKServer):
+    """
+    KongmingELKServer的异步版本, 基于httpx.AsyncClient
+
+    查询方法与KongmingELKServer同名同参数, 但都是协程(iter_dialogs是异步生成器), 多个查询可以
+    在同一个事件循环中并发执行. 同时进行的请求数不超过max_concurrency, 包括一个查询内部的翻页:
+    第一页返回命中总数之后, 结果窗口(MAX_RESULT_WINDOW)以内的各页并发请求, 按顺序交给调用方.
+
+        async with AsyncKongmingELKServer(env='uat', max_concurrency=8) as server:
+            results = await asyncio.gather(*[server.query_dialog_by_trace_id(t) for t in trace_ids])
+
+    AsyncClient绑定创建它的事件循环, 一个实例只在一个事件循环中使用, 用完后aclose().
+    取消查询直接取消对应的task, 不需要cancel参数.
+    每个请求按transport重试; 页大小固定为pagesize, 因为各页是按from同时请求的.
+    结果窗口以外的记录从窗口的最后一条开始用search_after逐页请求.
+
+    Args:
+        max_concurrency: 同时进行的请求数上限
+        timeout: 每个请求的超时(秒), 默认为transport.timeout
+    """
+    def __init__(self, server="https://elk.xjsdtech.com",
+                 username="ai",
+                 password="ai@123456",
+                 env:KongmingEnvironmentType="uat",
+                 exclude_fields:Union[List[str],None]=None,
+                 transport:Optional[TransportConfig]=None,
+                 max_concurrency:int=8,
+                 timeout:Optional[float]=None):
+        super().__init__(server=server, username=username, password=password, env=env, exclude_fields=exclude_fields, transport=transport)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout if timeout is not None else self.transport.timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self) -> 'AsyncKongmingELKServer':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(auth=self.auth,
+                                             headers=self.headers,
+                                             timeout=self.timeout,
+                                             limits=httpx.Limits(max_connections=self.max_concurrency))
+        return self._client
+
+    async def _post(self, url:str, request_body:Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        发送一次查询, 429/5xx和超时按transport重试(等待时不占用并发数)
+
+        不可重试的非200响应返回None, 重试之后仍然失败时抛出TransportError.
+        """
+        config = self.transport
+        error = None
+        response = None
+        for attempt in range(config.retries + 1):
+            if attempt:
+                instrument.count('elk.retries')
+                await asyncio.sleep(retry_delay(config, attempt - 1, response))
+            response = None
+            try:
+                async with self._semaphore:
+                    with instrument.span('elk.request'):
+                        response = await self.client.post(url, json=request_body)
+            except httpx.TimeoutException as e:
+                instrument.count('elk.timeouts')
+                error = f"timeout: {e}"
+                continue
+            except httpx.TransportError as e:
+                instrument.count('elk.errors')
+                error = f"{type(e).__name__}: {e}"
+                continue
+            instrument.count('elk.requests')
+            instrument.count('elk.bytes', len(response.content))
+
+            if response.status_code == 200:
+                with instrument.span('elk.json'):
+                    return response.json()
+
+            instrument.count('elk.errors')
+            error = f"HTTP {response.status_code}"
+            if response.status_code not in RETRY_STATUS:
+                return None
+
+        raise TransportError(f"ELK query failed after {config.retries} retries: {error}", None,
+                             response.status_code if response is not None else None)
+
+    async def _search(self,
+                      request_body:Dict[str, Any],
+                      env:Optional[KongmingEnvironmentType]=None) -> Dict[str, Any]:
+        """与KongmingELKServer._search相同, 执行一次不翻页的查询"""
+        url = self._format_url(env) if env else self.url
+        res_json = await self._post(url, request_body)
+        if res_json is None:
+            raise TransportError(f"ELK query failed: {url}")
+        return res_json
+
+    async def _iter_query_pages(self,
+                                request_body:Dict[str, Any],
+                                size:int,
+                                pagesize:int,
+                                env:Optional[KongmingEnvironmentType]=None,
+                                out_file:Optional[str]=None) -> AsyncIterator[Tuple[List[Dict[str, Any]], int]]:
+        """
+        与KongmingELKServer._iter_query_pages相同, 逐页yield (本页转换后的记录, 命中总数)
+
+        第一页之后, 结果窗口以内的各页按from同时请求, 未完成的请求最多max_concurrency个, 仍按顺序yield;
+        超出结果窗口的部分用search_after逐页请求(见PageCursor). 调用方提前结束时取消并等待尚未完成的请求.
+        """
+        url = self._format_url(env) if env else self.url
+        cursor = PageCursor()
+
+        res_json = await self._post(url, request_body)
+        if res_json is None:
+            return
+
+        if out_file:
+            with open(out_file, mode='w', encoding='utf-8') as f_orig:
+                json.dump(res_json, f_orig, ensure_ascii=False, indent=2)
+
+        total = res_json['hits']['total']
+        hits_total = total['value']
+        if total.get('relation', 'eq') == 'eq':
+            cursor.hits_total = hits_total
+        # sort在transform_record中会被删除, 先记下翻页位置
+        records = cursor.advance(res_json['hits']['hits'], size)
+        if not records:
+            return
+        yield self._transform_page(records), hits_total
+
+        window_end = min(size, hits_total, MAX_RESULT_WINDOW)
+        offsets = iter(range(cursor.fetched, window_end, pagesize))
+        tasks: Deque[asyncio.Future] = collections.deque()
+
+        def submit():
+            offset = next(offsets, None)
+            if offset is not None:
+                tasks.append(asyncio.ensure_future(self._post(url, {**request_body, 'from': offset, 'size': min(pagesize, window_end - offset)})))
+
+        for _ in range(self.max_concurrency):
+            submit()
+        try:
+            while tasks:
+                res_json = await tasks.popleft()
+                submit()
+                if res_json is None:
+                    raise TransportError(f"ELK query failed: {url}", cursor)
+                records = cursor.advance(res_json['hits']['hits'], size - cursor.fetched)
+                if not records:
+                    return
+                yield self._transform_page(records), hits_total
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        while cursor.fetched < size and (cursor.hits_total is None or cursor.fetched < cursor.hits_total):
+            res_json = await self._post(url, cursor.request_body(request_body, min(pagesize, size - cursor.fetched)))
+            if res_json is None:
+                raise TransportError(f"ELK query failed: {url}", cursor)
+            records = cursor.advance(res_json['hits']['hits'], size - cursor.fetched)
+            if not records:
+                return
+            yield self._transform_page(records), hits_total
+
+    async def _run_query(self,
+                         request_body:Dict[str, Any],
+                         size:int,
+                         pagesize:int,
+                         env:Optional[KongmingEnvironmentType]=None,
+                         out_file:Optional[str]=None):
+        records = []
+        async for page, _ in self._iter_query_pages(request_body=request_body, size=size, pagesize=pagesize, env=env, out_file=out_file):
+            records += page
+        return records
+
+    async def _iter_dialog_batches(self,
+                                   must_clause: List[Dict[str, Any]],
+                                   size:int,
+                                   pagesize:int,
+                                   env:Optional[KongmingEnvironmentType]=None,
+                                   out_file:Optional[str]=None,
+                                   sessions:Optional[SessionIndex]=None,
+                                   shard_hits:int=DEFAULT_SHARD_HITS,
+                                   parallel:int=1
+                                  ) -> AsyncIterator[Tuple[List[Dict[str,Any]], List[DialogRound], int, int]]:
+        """与KongmingELKServer._iter_dialog_batches相同, 逐页yield (本页记录, 新组装完成的round, 已取回的命中数, 计划取回的命中数)"""
+        assembler = DialogRoundAssembler(size=size)
+        fetched = 0
+
+        pages = self._iter_dialog_pages(must_clause, size, pagesize, env=env, out_file=out_file, shard_hits=shard_hits, parallel=parallel)
+        async with contextlib.aclosing(pages):
+            async for page, total in pages:
+                fetched += len(page)
+                with instrument.span('dialogs.assemble'):
+                    batch = assembler.add_records(page)
+                instrument.count('dialogs.rounds', len(batch))
+                if sessions is not None:
+                    with instrument.span('dialogs.sessions'):
+                        sessions.add_rounds(batch)
+                yield page, batch, fetched, total
+
+                if assembler.done:
+                    return
+
+        with instrument.span('dialogs.assemble'):
+            batch = assembler.flush()
+        instrument.count('dialogs.rounds', len(batch))
+        if sessions is not None:
+            with instrument.span('dialogs.sessions'):
+                sessions.add_rounds(batch)
+        yield [], batch, fetched, fetched
+
+    async def _iter_dialog_pages(self,
+                                 must_clause: List[Dict[str, Any]],
+                                 size:int,
+                                 pagesize:int,
+                                 env:Optional[KongmingEnvironmentType]=None,
+                                 out_file:Optional[str]=None,
+                                 shard_hits:int=DEFAULT_SHARD_HITS,
+                                 parallel:int=1
+                                ) -> AsyncIterator[Tuple[List[Dict[str,Any]], int]]:
+        """
+        与KongmingELKServer._iter_dialog_pages相同, 按时间顺序逐个分片取回记录, yield (本页记录, 计划取回的命中数)
+
+        parallel>1时用task提前取回接下来的分片, 调用方提前结束时取消并等待它们.
+        """
+        if not shard_hits:
+            query_size = self._dialog_query_size(size)
+            request_body = self._dialog_request_body(must_clause, query_size, pagesize)
+            pages = self._iter_query_pages(request_body=request_body, size=query_size, pagesize=pagesize, env=env, out_file=out_file)
+            async with contextlib.aclosing(pages):
+                async for page, hits_total in pages:
+                    yield page, min(query_size, hits_total)
+            return
+
+        plan = await plan_shards_async(self, must_clause, shard_hits, env=env)
+        if plan.total_hits == 0:
+            return
+
+        async def shard_pages(index: int, shard: QueryShard) -> AsyncIterator[List[Dict[str, Any]]]:
+            request_body = self._dialog_request_body(shard_must_clause(must_clause, shard), max(1, shard.hits), pagesize)
+            pages = self._iter_query_pages(request_body=request_body, size=sys.maxsize, pagesize=pagesize, env=env,
+                                           out_file=out_file if index == 0 else None)
+            async with contextlib.aclosing(pages):
+                async for page, _ in pages:
+                    yield page
+
+        if parallel <= 1 or len(plan) == 1:
+            for index, shard in enumerate(plan.shards):
+                pages = shard_pages(index, shard)
+                async with contextlib.aclosing(pages):
+                    async for page in pages:
+                        yield page, plan.total_hits
+            return
+
+        async def fetch_shard(index: int, shard: QueryShard) -> List[List[Dict[str, Any]]]:
+            return [page async for page in shard_pages(index, shard)]
+
+        shards = enumerate(plan.shards)
+        tasks: Deque[asyncio.Future] = collections.deque()
+
+        def submit():
+            following = next(shards, None)
+            if following is not None:
+                tasks.append(asyncio.ensure_future(fetch_shard(*following)))
+
+        for _ in range(parallel):
+            submit()
+        try:
+            while tasks:
+                shard_result = await tasks.popleft()
+                submit()
+                for page in shard_result:
+                    yield page, plan.total_hits
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def query_dialogs(self,
+                            filter: DialogLogFilter,
+                            size:int=10000,
+                            pagesize:int=1000,
+                            env:Optional[KongmingEnvironmentType]=None,
+                            out_file:Optional[str]=None,
+                            sessions:Optional[SessionIndex]=None,
+                            shard_hits:int=DEFAULT_SHARD_HITS,
+                            parallel:int=1
+                           ) -> Tuple[Dict[str,Any],List[DialogRound]]:
+        records: List[Dict[str, Any]] = []
+        rounds: List[DialogRound] = []
+
+        batches = self._iter_dialog_batches(must_clause=self._dialog_must_clause(filter), size=size, pagesize=pagesize, env=env, out_file=out_file, sessions=sessions,
+                                            shard_hits=shard_hits, parallel=parallel)
+        async with contextlib.aclosing(batches):
+            async for page, batch, _, _ in batches:
+                records += page
+                rounds += batch
+
+        return records, rounds
+
+    async def iter_dialogs(self,
+                           filter: DialogLogFilter,
+                           size:int=10000,
+                           pagesize:int=1000,
+                           env:Optional[KongmingEnvironmentType]=None,
+                           progress:Optional[Callable[[int, int], None]]=None,
+                           sessions:Optional[SessionIndex]=None,
+                           shard_hits:int=DEFAULT_SHARD_HITS,
+                           parallel:int=1
+                          ) -> AsyncIterator[List[DialogRound]]:
+        """与KongmingELKServer.iter_dialogs相同, 每取回一页就yield这一页新组装完成的round"""
+        batches = self._iter_dialog_batches(must_clause=self._dialog_must_clause(filter), size=size, pagesize=pagesize, env=env, sessions=sessions,
+                                            shard_hits=shard_hits, parallel=parallel)
+        async with contextlib.aclosing(batches):
+            async for _, batch, fetched, total in batches:
+                if progress:
+                    progress(fetched, total)
+                if batch:
+                    yield batch
+
+    async def query_by_phrase(self,
+                              match_phrase:str,
+                              match_fields:List[str]=["*"],
+                              terms:Union[Dict[str,Any],None]=None,
+                              timestamp_begin:Optional[str]=None,
+                              timestamp_end:Optional[str]=None,
+                              size:int=10000,
+                              pagesize:int=10,
+                              env:Optional[KongmingEnvironmentType]=None,
+                              out_file:Optional[str]=None):
+        request_body = self._phrase_request_body(match_phrase, match_fields, terms, timestamp_begin, timestamp_end, pagesize)
+        return await self._run_query(request_body=request_body, size=size, pagesize=pagesize, env=env, out_file=out_file)
+
+    async def query_by_time_range(self,
+                                  timestamp_begin:Optional[str]=None,
+                                  timestamp_end:Optional[str]=None,
+                                  size:int=10000,
+                                  pagesize:int=10,
+                                  env:Optional[KongmingEnvironmentType]=None,
+                                  out_file:Optional[str]=None):
+        if timestamp_begin is None and timestamp_end is None:
+            return None
+
+        request_body = self._time_range_request_body(timestamp_begin, timestamp_end, pagesize)
+        return await self._run_query(request_body=request_body, size=size, pagesize=pagesize, env=env, out_file=out_file)
+
+    async def query_dialog_by_trace_id(self, trace_id:str, env:Optional[KongmingEnvironmentType]=None, out_file:Optional[str]=None):
+        rounds = await self._query_trace_rounds(trace_id, env=env)
 
         if rounds:
-            round = rounds[0]
-            start_time = round.nlp_round.request_timestamp
-            stop_time = round.llm_round.response_timestamp if (round.llm_round and round.llm_round.response_timestamp) else None
-
-            if not stop_time:
-                stop_time = round.nlp_round.response_timestamp if (round.nlp_round and round.nlp_round.response_timestamp) else None
-
-            if start_time and stop_time:
-                start_time = adjust_timestamp(start_time, -15.0)
-                stop_time = adjust_timestamp(stop_time, 2.0)
-
-                records = self.query_by_phrase(timestamp_begin=start_time,
-                                     timestamp_end=stop_time,
-                                     match_phrase=trace_id,
-                                     size=10000,
-                                     pagesize=1000,
-                                     out_file=out_file)
-                
+            records = await self.query_round_records(rounds[0], env=env, out_file=out_file)
+            if records is not None:
                 return records, rounds
 
         return None
 
-    def query_by_trace_id(self, trace_id:str, size:int=10000, pagesize:int=10, env:Optional[KongmingEnvironmentType]=None, out_file:Optional[str]=None):
-        return self.query_by_phrase(trace_id, size=size, pagesize=pagesize, env=env, out_file=out_file)
+    async def _query_trace_rounds(self, trace_id:str, env:Optional[KongmingEnvironmentType]=None) -> List[DialogRound]:
+        for lookup, must_clause in self._trace_dialog_must_clauses(trace_id):
+            rounds = []
+            batches = self._iter_dialog_batches(must_clause=must_clause, size=1, pagesize=10, env=env, shard_hits=0)
+            async with contextlib.aclosing(batches):
+                async for _, batch, _, _ in batches:
+                    rounds += batch
+            if rounds:
+                instrument.count_label('trace.dialog_lookup', lookup)
+                return rounds
+
+        instrument.count_label('trace.dialog_lookup', 'none')
+        return []
+
+    async def query_round_records(self,
+                                  round: DialogRound,
+                                  before: float = 15.0,
+                                  after: float = 2.0,
+                                  env:Optional[KongmingEnvironmentType]=None,
+                                  out_file:Optional[str]=None) -> Optional[List[Dict[str, Any]]]:
+        window = self._round_time_window(round, before, after)
+        if window is None:
+            return None
+
+        return await self._query_trace_records(round.traceId,
+                                               timestamp_begin=window[0],
+                                               timestamp_end=window[1],
+                                               size=10000,
+                                               pagesize=1000,
+                                               env=env,
+                                               out_file=out_file)
+
+    async def query_by_trace_id(self, trace_id:str, size:int=10000, pagesize:int=10, env:Optional[KongmingEnvironmentType]=None, out_file:Optional[str]=None):
+        return await self._query_trace_records(trace_id, size=size, pagesize=pagesize, env=env, out_file=out_file)
+
+    async def _query_trace_records(self,
+                                   trace_id:str,
+                                   timestamp_begin:Optional[str]=None,
+                                   timestamp_end:Optional[str]=None,
+                                   size:int=10000,
+                                   pagesize:int=10,
+                                   env:Optional[KongmingEnvironmentType]=None,
+                                   out_file:Optional[str]=None) -> List[Dict[str, Any]]:
+        request_body = self._trace_id_request_body(trace_id, timestamp_begin, timestamp_end, pagesize)
+        records = await self._run_query(request_body=request_body, size=size, pagesize=pagesize, env=env, out_file=out_file)
+        if records:
+            instrument.count_label('trace.lookup', 'terms')
+            return records
+
+        records = await self.query_by_phrase(trace_id, timestamp_begin=timestamp_begin, timestamp_end=timestamp_end,
+                                             size=size, pagesize=pagesize, env=env, out_file=out_file)
+        instrument.count_label('trace.lookup', 'phrase' if records else 'none')
+        return records
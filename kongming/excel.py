@@ -1,64 +1,25 @@
 from openpyxl import Workbook
-from openpyxl.styles import Font
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, NamedStyle
 from openpyxl.utils import get_column_letter
 
-from typing import List
+from typing import Iterable, Optional
 from .model import DialogRound
-from .constants import CLEAN_CONTEXT_MAGIC_STRING
-from .utils import convert_timestamp, calculate_time_difference
+from .schema import DIALOG_ROUND_SCHEMA, RoundSchema
+from .users import UserResolver, with_user_column
+from . import instrument
+
+# Excel单个工作表的最大行数(含标题行)
+EXCEL_MAX_ROWS = 1048576
+
+TITLE_STYLE_NAME = "kongming-title"
+CONTENT_STYLE_NAME = "kongming-content"
 
 def set_column_width(ws, column_index, width):
     c = get_column_letter(column_index)
     ws.column_dimensions[c].width = width
 
-def print_dialog_round_to_excel(rounds: List[DialogRound], filename: str):
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "对话记录"
-
-    titles = ["时间戳", 
-              "trace_id", 
-              "眼镜类型",
-              "位置",
-              "originType",
-              "functionType",
-              "locale",
-              "时区",
-              "语种",
-              "首轮",
-
-              "NLU查询",
-              "NLU意图",
-              "NLU回答",
-              "NLU Error",
-              "NLU耗时",
-              "LLM查询",
-              "LLM意图",
-              "LLM场景",  # channel_type flag
-              "图像文件",
-              "角色扮演",
-              "深度思考",
-              "深度搜索",
-              "视觉辅助",
-              "清上下文", # clean_context flag
-              "LLM回答",
-              "LLM思考",
-              "LLM搜索数据",
-              "LLM状态",
-              "LLM耗时",
-
-              "deviceId", 
-              "glassDeviceId",
-              'iotDeviceId',
-              "accountId",
-              "xjAccountId",
-              'sessionId',
-              'msgId',
-
-            ]
-    ws.append(titles)
-
+def _create_named_styles():
     title_font_attribs = {
         'name' : 'Calibri',
         'charset': None,
@@ -77,8 +38,6 @@ def print_dialog_round_to_excel(rounds: List[DialogRound], filename: str):
         'scheme':"minor"
     }
 
-    title_font = Font(**title_font_attribs)
-
     content_font_attribs = {
         'name' : 'Courier New',
         'charset': None,
@@ -97,78 +56,68 @@ def print_dialog_round_to_excel(rounds: List[DialogRound], filename: str):
         'scheme':"minor"
     }
 
-    content_font = Font(**content_font_attribs)
-
-    for col in range(len(titles)):
-        ws.cell(1, col + 1).font = title_font
-
-    set_column_width(ws, 1, 19)
-    set_column_width(ws, 2, 28)
-    set_column_width(ws, 4, 16)
-    set_column_width(ws, 10, 12)
-    set_column_width(ws, 11, 30)
-    set_column_width(ws, 12, 25)
-    set_column_width(ws, 13, 30)
-    set_column_width(ws, 16, 30)
-    set_column_width(ws, 19, 30)
-    set_column_width(ws, 25, 30)
-    set_column_width(ws, 33, 10)
-    set_column_width(ws, 34, 25)
-    set_column_width(ws, 36, 32)
-
-    for idx in [30, 31, 32, 35]:
-        set_column_width(ws, idx, 28)
+    return (NamedStyle(name=TITLE_STYLE_NAME, font=Font(**title_font_attribs)),
+            NamedStyle(name=CONTENT_STYLE_NAME, font=Font(**content_font_attribs)))
+
+def new_dialog_round_workbook(schema: RoundSchema = DIALOG_ROUND_SCHEMA):
+    """
+    创建一个write-only的对话记录workbook, 并按schema写好列宽和标题行
+
+    Returns:
+        (wb, append_row): workbook对象, 以及把一行数据追加到工作表的函数
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("对话记录")
+
+    title_style, content_style = _create_named_styles()
+    wb.add_named_style(title_style)
+    wb.add_named_style(content_style)
+
+    # write-only模式下列宽必须在写入第一行之前设置
+    for idx, column in enumerate(schema, 1):
+        if column.width is not None:
+            set_column_width(ws, idx, column.width)
+
+    # 命名样式已在上面注册到workbook, 单元格按名字引用
+    def styled_row(values, style_name):
+        row = []
+        for value in values:
+            if value is None or value == "":
+                # 空单元格不写样式, 写出时会被直接跳过
+                row.append(None)
+                continue
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = style_name
+            row.append(cell)
+        return row
+
+    ws.append(styled_row(schema.titles, TITLE_STYLE_NAME))
+
+    def append_row(values):
+        ws.append(styled_row(values, CONTENT_STYLE_NAME))
+
+    return wb, append_row
+
+def print_dialog_round_to_excel(rounds: Iterable[DialogRound], filename: str, users: Optional[UserResolver] = None):
+    """
+    以write-only模式把DialogRound流式写入Excel文件
+
+    rounds可以是列表, 也可以是生成器; 每行写出后即释放, 内存占用不随行数增长.
+    所有单元格共享两个命名样式, 不再为每个单元格单独设置字体.
+
+    Args:
+        rounds: DialogRound对象的可迭代序列
+        filename: 输出的xlsx文件名
+        users: 使用者映射, 提供时在第一列之前加入使用者列
+    """
+    schema = with_user_column(DIALOG_ROUND_SCHEMA, users)
+    wb, append_row = new_dialog_round_workbook(schema)
 
     # 添加行数据
-    for idx, round in enumerate(rounds, 1):  # 序号从1开始
-        ws.append([
-            # convert_timestamp(round.nlp_round.request_timestamp) if round.nlp_round.request_timestamp else "",
-            round.nlp_round.request_timestamp,
-            round.traceId or "",
-            int(round.glassProduct) if round.glassProduct else "",
-            str(round.location) if round.location else "",
-
-            round.originType if round.originType is not None else "",
-            round.functionType if round.functionType is not None else "",
-            round.local or "",
-            round.timeZone or "",
-            round.nluLanguage or "",
-            round.sessionFirstFlag if round.sessionFirstFlag is not None else "" or "",
-
-            (round.nlp_round.query if round.nlp_round.query != CLEAN_CONTEXT_MAGIC_STRING else "<清除上下文>") if round.nlp_round else "",
-            str(round.nlp_round.intent or "") if round.nlp_round else "",
-            str(round.nlp_round.utterance) if round.nlp_round and round.nlp_round.utterance else "",
-            str(round.nlp_round.error) if round.nlp_round and round.nlp_round.error else "",
-            calculate_time_difference(round.nlp_round.request_timestamp, round.nlp_round.response_timestamp) if round.nlp_round and round.nlp_round.response_timestamp else "",
-
-            (round.llm_round.query or "") if round.llm_round and round.llm_round.query else "",
-            (round.llm_round.intent_name or "") if round.llm_round and round.llm_round.intent_name else "",
-            round.llm_round.channel_type if round.llm_round and round.llm_round.channel_type is not None else "",
-
-            '\n'.join([file.ossUrl for file in round.llm_round.files]) if round.llm_round and round.llm_round.files else "",
-
-            round.llm_round.play_status if round.llm_round and round.llm_round.play_status is not None else "",
-            round.llm_round.use_deepseek if round.llm_round and round.llm_round.use_deepseek is not None else "",
-            round.llm_round.use_search if round.llm_round and round.llm_round.use_search is not None else "",
-            round.llm_round.visual_aids_status if round.llm_round and round.llm_round.visual_aids_status is not None else "",
-            round.llm_round.clean_context if round.llm_round and round.llm_round.clean_context is not None else "",
-
-            (round.llm_round.answer or "") if round.llm_round and round.llm_round.answer else "",
-            (round.llm_round.reason or "") if round.llm_round and round.llm_round.reason else "",
-            str(round.llm_round.thoughts_data) if round.llm_round and round.llm_round.thoughts_data else "",
-            round.llm_round.base_status if round.llm_round is not None else "",
-            calculate_time_difference(round.llm_round.request_timestamp, round.llm_round.response_timestamp) if round.llm_round and round.llm_round.response_timestamp else "",
-
-            round.deviceId or "",
-            round.glassDeviceId or "",
-            round.iotDeviceId or "",
-            round.accountId or "",
-            round.xjAccountId or "",
-            round.sessionId or "",
-            round.msgId or "",
-        ])
-
-        for col in range(len(titles)):
-            ws.cell(idx + 1, col + 1).font = content_font
-    
-    wb.save(filename)
+    extract = schema.extract
+    with instrument.span('excel.rows'):
+        for round in rounds:
+            append_row(extract(round))
+
+    with instrument.span('excel.save'):
+        wb.save(filename)
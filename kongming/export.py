@@ -0,0 +1,345 @@
+import abc
+import bz2
+import csv
+import gzip
+import importlib.util
+import io
+import json
+import lzma
+import os
+import threading
+
+from typing import Callable, Dict, Iterable, List, Optional, Type
+from .model import DialogRound
+from .excel import EXCEL_MAX_ROWS, new_dialog_round_workbook
+from .schema import DIALOG_ROUND_SCHEMA, RoundSchema
+from .users import UserResolver, with_user_column
+from . import instrument
+
+_COMPRESSION_SUFFIXES = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+}
+
+_TEXT_OPENERS = {
+    'gzip': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+}
+
+class ExportCancelled(Exception):
+    """导出被取消(cancel事件被设置)时抛出"""
+    pass
+
+def _split_compression_suffix(filename: str):
+    root, ext = os.path.splitext(filename)
+    if ext.lower() in _COMPRESSION_SUFFIXES:
+        return root, _COMPRESSION_SUFFIXES[ext.lower()]
+    return filename, None
+
+def _open_text(filename: str, compression: Optional[str]):
+    if compression is None:
+        return open(filename, mode='w', encoding='utf-8', newline='')
+    if compression not in _TEXT_OPENERS:
+        raise ValueError(f"unsupported compression '{compression}', expect one of {list(_TEXT_OPENERS)}")
+    return _TEXT_OPENERS[compression](filename, mode='wt', encoding='utf-8', newline='')
+
+
+class RoundExporter(abc.ABC):
+    """
+    对话记录导出器的基类
+
+    导出器按批接收行数据(每行是schema.extract得到的tuple, 缺失值为None), 子类必须实现
+    _open, _write_batch和_close, 否则无法创建. 用法:
+
+        with CsvRoundExporter('out.csv.gz') as exporter:
+            exporter.export(rounds)
+    """
+    format: str = ''
+
+    @classmethod
+    def available(cls) -> bool:
+        """依赖的可选包是否已安装"""
+        return True
+
+    def __init__(self,
+                 filename: str,
+                 compression: Optional[str] = None,
+                 batch_size: int = 1000,
+                 schema: RoundSchema = DIALOG_ROUND_SCHEMA):
+        self.filename = filename
+        self.schema = schema
+        self.compression = compression
+        self.batch_size = batch_size
+        self.rows_written = 0
+
+        self._batch: List[tuple] = []
+        self._opened = False
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self):
+        if not self._opened:
+            self._open()
+            self._opened = True
+
+    def write_row(self, row: tuple):
+        self._batch.append(row)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self._write_batch(self._batch)
+            self.rows_written += len(self._batch)
+            self._batch = []
+
+    def close(self):
+        if self._opened:
+            self.flush()
+            with instrument.span(f'export.{self.format}.close'):
+                self._close()
+            self._opened = False
+
+    def abort(self):
+        """丢弃尚未写出的行并关闭, 用于出错或取消时; 输出文件可能不完整"""
+        if self._opened:
+            self._batch = []
+            self._abort()
+            self._opened = False
+
+    def export(self,
+               rounds: Iterable[DialogRound],
+               progress: Optional[Callable[[int], None]] = None,
+               cancel: Optional[threading.Event] = None) -> int:
+        """
+        把rounds逐行写出, 返回本次写出的行数
+
+        Args:
+            progress: 每写出一批后调用progress(本次已写出的行数)
+            cancel: 每批之前检查, 被设置时抛出ExportCancelled
+        """
+        self.open()
+        extract = self.schema.extract
+        batch_size = self.batch_size
+        count = 0
+        with instrument.span(f'export.{self.format}'):
+            for round in rounds:
+                if count % batch_size == 0 and cancel is not None and cancel.is_set():
+                    raise ExportCancelled()
+                self.write_row(extract(round))
+                count += 1
+                if progress is not None and count % batch_size == 0:
+                    progress(count)
+            self.flush()
+        instrument.count('export.rows', count)
+        if progress is not None:
+            progress(count)
+        return count
+
+    @abc.abstractmethod
+    def _open(self):
+        pass
+
+    @abc.abstractmethod
+    def _write_batch(self, rows: List[tuple]):
+        pass
+
+    @abc.abstractmethod
+    def _close(self):
+        pass
+
+    def _abort(self):
+        self._close()
+
+
+class CsvRoundExporter(RoundExporter):
+    format = 'csv'
+
+    def _open(self):
+        self._file = _open_text(self.filename, self.compression)
+        # 写入BOM, Excel打开时才能正确识别UTF-8中文
+        self._file.write('\ufeff')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.schema.titles)
+
+    def _write_batch(self, rows: List[tuple]):
+        self._writer.writerows(rows)
+
+    def _close(self):
+        self._file.close()
+
+
+class JsonlRoundExporter(RoundExporter):
+    format = 'jsonl'
+
+    def _open(self):
+        self._file = _open_text(self.filename, self.compression)
+
+    def _write_batch(self, rows: List[tuple]):
+        titles = self.schema.titles
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(json.dumps(dict(zip(titles, row)), ensure_ascii=False))
+            buffer.write('\n')
+        self._file.write(buffer.getvalue())
+
+    def _close(self):
+        self._file.close()
+
+
+class ParquetRoundExporter(RoundExporter):
+    """
+    Parquet导出器, 需要安装pyarrow(pip install log-analyze[parquet])
+
+    compression为Parquet的列压缩算法(snappy, gzip, zstd, brotli, lz4, none), 默认snappy.
+    每一批数据写成一个row group. 与列类型不符的值(例如不是数字的眼镜类型)写为null.
+    """
+    format = 'parquet'
+
+    @classmethod
+    def available(cls) -> bool:
+        return importlib.util.find_spec('pyarrow') is not None
+
+    def _open(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        arrow_types = {str: pa.string(), int: pa.int64(), float: pa.float64(), bool: pa.bool_()}
+
+        self._pa = pa
+        self._schema = pa.schema([pa.field(c.title, arrow_types[c.type]) for c in self.schema])
+        self._writer = pq.ParquetWriter(self.filename,
+                                        self._schema,
+                                        compression=self.compression or 'snappy',
+                                        use_dictionary=[c.title for c in self.schema if c.dictionary])
+
+    def _write_batch(self, rows: List[tuple]):
+        columns = [self._array(values, field.type, column.type) for values, field, column in zip(zip(*rows), self._schema, self.schema)]
+        self._writer.write_batch(self._pa.RecordBatch.from_arrays(columns, schema=self._schema))
+
+    def _array(self, values: tuple, arrow_type, value_type: type):
+        pa = self._pa
+        try:
+            return pa.array(values, type=arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            return pa.array([value if value is None or isinstance(value, value_type) else None for value in values], type=arrow_type)
+
+    def _close(self):
+        self._writer.close()
+
+
+class ExcelRoundExporter(RoundExporter):
+    """
+    Excel导出器, 受限于单个工作表的最大行数; compression参数被忽略(xlsx本身即是zip压缩)
+    """
+    format = 'xlsx'
+
+    def _open(self):
+        self._wb, self._append_row = new_dialog_round_workbook(self.schema)
+
+    def _write_batch(self, rows: List[tuple]):
+        if self.rows_written + len(rows) > EXCEL_MAX_ROWS - 1:
+            raise ValueError(f"too many rows for an Excel worksheet (max {EXCEL_MAX_ROWS - 1}), use csv/jsonl/parquet instead")
+        for row in rows:
+            self._append_row(row)
+
+    def _close(self):
+        self._wb.save(self.filename)
+
+    def _abort(self):
+        # 没有保存过的workbook不会产生文件
+        self._wb = None
+
+
+EXPORTERS: Dict[str, Type[RoundExporter]] = {
+    'csv': CsvRoundExporter,
+    'jsonl': JsonlRoundExporter,
+    'parquet': ParquetRoundExporter,
+    'xlsx': ExcelRoundExporter,
+}
+
+def available_formats() -> List[str]:
+    """已安装所需依赖的导出格式"""
+    return [format for format, exporter in EXPORTERS.items() if exporter.available()]
+
+_FORMAT_SUFFIXES = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.json': 'jsonl',
+    '.parquet': 'parquet',
+    '.xlsx': 'xlsx',
+}
+
+def get_exporter(filename: str,
+                 format: Optional[str] = None,
+                 compression: Optional[str] = None,
+                 batch_size: int = 1000,
+                 schema: RoundSchema = DIALOG_ROUND_SCHEMA,
+                 users: Optional[UserResolver] = None) -> RoundExporter:
+    """
+    根据format(或文件名后缀)创建导出器
+
+    format为空时根据后缀推断, 例如 "a.csv.gz" 推断为csv格式且使用gzip压缩.
+    users不为None时在第一列之前加入使用者列.
+    """
+    root, suffix_compression = _split_compression_suffix(filename)
+
+    if format is None:
+        ext = os.path.splitext(root)[1].lower()
+        if ext not in _FORMAT_SUFFIXES:
+            raise ValueError(f"can not infer export format from '{filename}', expect one of {list(EXPORTERS)}")
+        format = _FORMAT_SUFFIXES[ext]
+
+    if format not in EXPORTERS:
+        raise ValueError(f"unsupported export format '{format}', expect one of {list(EXPORTERS)}")
+    if not EXPORTERS[format].available():
+        raise ValueError(f"export format '{format}' is not available, install pyarrow: pip install log-analyze[parquet]")
+
+    if format in ['csv', 'jsonl']:
+        compression = compression or suffix_compression
+
+    schema = with_user_column(schema, users)
+    return EXPORTERS[format](filename, compression=compression, batch_size=batch_size, schema=schema)
+
+def export_dialog_rounds(rounds: Iterable[DialogRound],
+                         filename: str,
+                         format: Optional[str] = None,
+                         compression: Optional[str] = None,
+                         batch_size: int = 1000,
+                         schema: RoundSchema = DIALOG_ROUND_SCHEMA,
+                         users: Optional[UserResolver] = None,
+                         progress: Optional[Callable[[int], None]] = None,
+                         cancel: Optional[threading.Event] = None) -> int:
+    """
+    把DialogRound导出到文件, 返回导出的行数
+
+    Args:
+        rounds: DialogRound对象的可迭代序列, 可以是生成器
+        filename: 输出文件名
+        format: csv, jsonl, parquet或xlsx; 为空时根据文件名后缀推断
+        compression: 压缩算法. csv/jsonl支持gzip, bz2, xz; parquet支持snappy, gzip, zstd等
+        batch_size: 每批写出的行数
+        schema: 导出的列, 默认为DIALOG_ROUND_SCHEMA
+        users: 使用者映射, 提供时导出使用者列
+        progress: 每写出一批后调用progress(已写出的行数)
+        cancel: 被设置后停止导出, 删除未写完的文件并抛出ExportCancelled
+    """
+    exporter = get_exporter(filename, format=format, compression=compression, batch_size=batch_size, schema=schema, users=users)
+    try:
+        with exporter:
+            return exporter.export(rounds, progress=progress, cancel=cancel)
+    except ExportCancelled:
+        if os.path.exists(filename):
+            os.remove(filename)
+        raise
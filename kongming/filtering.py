@@ -0,0 +1,362 @@
+import abc
+
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Sequence
+
+# 行位图用Python的int表示: 第i位为1表示第i行被选中
+
+def rows_to_bitmap(rows: Sequence[int]) -> int:
+    """
+    把升序排列的行号列表转换为位图
+    """
+    if not rows:
+        return 0
+    buf = bytearray((rows[-1] >> 3) + 1)
+    for row in rows:
+        buf[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(buf, 'little')
+
+def bitmap_to_flags(bitmap: int, row_count: int) -> bytes:
+    """
+    把位图展开成字节串, 便于O(1)地查询某一行: flags[row >> 3] >> (row & 7) & 1
+    """
+    return bitmap.to_bytes((row_count >> 3) + 1, 'little')
+
+def bitmap_to_rows(bitmap: int) -> List[int]:
+    rows = []
+    flags = bitmap.to_bytes((bitmap.bit_length() >> 3) + 1, 'little')
+    for pos, byte in enumerate(flags):
+        if byte:
+            base = pos << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    rows.append(base + bit)
+    return rows
+
+
+class ColumnIndex(object):
+    """
+    单列的倒排索引: 值 -> 升序行号列表, 位图按需生成并缓存
+
+    values按行号顺序保存每一行的值, 只会追加或原地替换, 不会变短,
+    因此其他线程可以安全地读取它的前缀.
+    """
+    def __init__(self):
+        self.rows: Dict[str, List[int]] = {}
+        self.values: List[str] = []
+        self._bitmaps: Dict[str, int] = {}
+        self._numbers: Dict[str, Optional[float]] = {}
+
+    def add(self, row: int, value: str):
+        rows = self.rows.get(value)
+        if rows is None:
+            self.rows[value] = [row]
+        else:
+            rows.append(row)
+        self.values.append(value)
+        self._bitmaps.pop(value, None)
+
+    def merge(self, other: 'ColumnIndex'):
+        """追加另一个索引(行号紧接在本索引之后)的内容"""
+        for value, rows in other.rows.items():
+            existing = self.rows.get(value)
+            if existing is None:
+                self.rows[value] = rows
+            else:
+                existing.extend(rows)
+            self._bitmaps.pop(value, None)
+        self.values.extend(other.values)
+
+    def replace(self, row: int, value: str):
+        """把已索引的一行改为新值"""
+        old = self.values[row]
+        if old == value:
+            return
+        rows = self.rows[old]
+        del rows[bisect_left(rows, row)]
+        if not rows:
+            del self.rows[old]
+        self._bitmaps.pop(old, None)
+
+        rows = self.rows.get(value)
+        if rows is None:
+            self.rows[value] = [row]
+        else:
+            insort(rows, row)
+        self._bitmaps.pop(value, None)
+        self.values[row] = value
+
+    def bitmap(self, value: str) -> int:
+        bitmap = self._bitmaps.get(value)
+        if bitmap is None:
+            bitmap = self._bitmaps[value] = rows_to_bitmap(self.rows.get(value, []))
+        return bitmap
+
+    def union(self, values: Iterable[str]) -> int:
+        bitmap = 0
+        for value in values:
+            if value in self.rows:
+                bitmap |= self.bitmap(value)
+        return bitmap
+
+    def number(self, value: str) -> Optional[float]:
+        """值的数值形式, 不是数字时为None; 按不同的值缓存"""
+        if value in self._numbers:
+            return self._numbers[value]
+        try:
+            number = float(value) if value else None
+        except ValueError:
+            number = None
+        self._numbers[value] = number
+        return number
+
+    def counts(self) -> Dict[str, int]:
+        return {value: len(rows) for value, rows in self.rows.items()}
+
+
+def build_partial_index(rows: Iterable[Sequence[str]], start_row: int, column_count: int) -> List[ColumnIndex]:
+    """
+    为一批行建立各列的索引, 行号从start_row开始
+
+    不依赖FilterEngine的状态, 可以在工作线程中执行, 结果再用FilterEngine.merge合并.
+    """
+    columns = [ColumnIndex() for _ in range(column_count)]
+    row = start_row
+    for values in rows:
+        for index, value in zip(columns, values):
+            index.add(row, value)
+        row += 1
+    return columns
+
+def count_values(values: Sequence[str], row_count: int, mask: Optional[int] = None) -> Dict[str, int]:
+    """
+    统计一列前row_count行中各个值出现的次数
+
+    Args:
+        values: 按行号顺序的值
+        mask: 只统计位图中的行, None表示统计所有行
+    """
+    counts: Dict[str, int] = {}
+    if mask is None:
+        for value in values[:row_count]:
+            counts[value] = counts.get(value, 0) + 1
+    else:
+        for row in bitmap_to_rows(mask):
+            if row >= row_count:
+                break
+            value = values[row]
+            counts[value] = counts.get(value, 0) + 1
+    return counts
+
+
+class ColumnFilter(abc.ABC):
+    """列筛选条件的基类, 子类根据列索引计算匹配的行位图"""
+    @abc.abstractmethod
+    def match(self, index: ColumnIndex) -> int:
+        pass
+
+    @abc.abstractmethod
+    def describe(self) -> str:
+        pass
+
+
+class ValueSetFilter(ColumnFilter):
+    """值等于values中的任意一个"""
+    def __init__(self, values: Iterable[str]):
+        self.values = frozenset(values)
+
+    def match(self, index: ColumnIndex) -> int:
+        return index.union(self.values)
+
+    def describe(self) -> str:
+        if len(self.values) == 1:
+            return f'= {next(iter(self.values))}'
+        return f'in {len(self.values)} values'
+
+
+class RangeFilter(ColumnFilter):
+    """数值在[low, high]之间, low/high为None表示不限"""
+    def __init__(self, low: Optional[float] = None, high: Optional[float] = None):
+        self.low = low
+        self.high = high
+
+    def match(self, index: ColumnIndex) -> int:
+        values = []
+        for value in index.rows:
+            number = index.number(value)
+            if number is None:
+                continue
+            if self.low is not None and number < self.low:
+                continue
+            if self.high is not None and number > self.high:
+                continue
+            values.append(value)
+        return index.union(values)
+
+    def describe(self) -> str:
+        return f'[{"" if self.low is None else self.low}, {"" if self.high is None else self.high}]'
+
+
+class SubstringFilter(ColumnFilter):
+    """值包含text, 默认不区分大小写"""
+    def __init__(self, text: str, case_sensitive: bool = False):
+        self.text = text
+        self.case_sensitive = case_sensitive
+
+    def match(self, index: ColumnIndex) -> int:
+        if self.case_sensitive:
+            values = [value for value in index.rows if self.text in value]
+        else:
+            text = self.text.lower()
+            values = [value for value in index.rows if text in value.lower()]
+        return index.union(values)
+
+    def describe(self) -> str:
+        return f'contains "{self.text}"'
+
+
+class FilterEngine(object):
+    """
+    多列筛选引擎
+
+    对每一列维护值 -> 行位图的索引, 结果集加载时建立一次, 之后行可以增量追加.
+    每次筛选条件变化时, 只需对各列条件的位图做与/或运算, 不再逐行比较.
+
+    Args:
+        column_count: 列数
+    """
+    MODE_AND = 'and'
+    MODE_OR = 'or'
+
+    def __init__(self, column_count: int):
+        self.column_count = column_count
+        self.row_count = 0
+        self.columns: List[ColumnIndex] = [ColumnIndex() for _ in range(column_count)]
+
+        self.filters: Dict[int, ColumnFilter] = {}
+        self.mode = FilterEngine.MODE_AND
+
+        # 索引或筛选条件每次变化都加1, 用于判断缓存的统计结果是否过期
+        self.version = 0
+
+        self._mask: Optional[int] = None
+        self._flags: Optional[bytes] = None
+
+    def reset(self):
+        self.row_count = 0
+        self.columns = [ColumnIndex() for _ in range(self.column_count)]
+        self._invalidate()
+
+    def merge(self, start_row: int, partial: List[ColumnIndex]):
+        """合并build_partial_index的结果, start_row必须等于当前的行数"""
+        if start_row != self.row_count:
+            raise ValueError(f"partial index starts at row {start_row}, expect {self.row_count}")
+        for index, other in zip(self.columns, partial):
+            index.merge(other)
+        self.row_count += len(partial[0].values) if partial else 0
+        self._invalidate()
+
+    def update_values(self, column: int, values: Dict[int, str]):
+        """某一列的部分行改变时只更新这些行: values为 {行号: 新值}"""
+        index = self.columns[column]
+        for row, value in values.items():
+            index.replace(row, value)
+        if values:
+            self._invalidate()
+
+    def set_filter(self, column: int, column_filter: Optional[ColumnFilter]):
+        if column_filter is None:
+            self.filters.pop(column, None)
+        else:
+            self.filters[column] = column_filter
+        self._invalidate()
+
+    def clear_filters(self):
+        self.filters.clear()
+        self._invalidate()
+
+    def set_mode(self, mode: str):
+        if mode not in [FilterEngine.MODE_AND, FilterEngine.MODE_OR]:
+            raise ValueError(f"unknown filter mode '{mode}'")
+        self.mode = mode
+        self._invalidate()
+
+    def _invalidate(self):
+        self._mask = None
+        self._flags = None
+        self.version += 1
+
+    def all_rows(self) -> int:
+        return (1 << self.row_count) - 1
+
+    def mask(self, exclude: Optional[int] = None) -> int:
+        """
+        当前筛选条件下被接受的行位图
+
+        Args:
+            exclude: 忽略这一列的条件(用于计算分面统计)
+        """
+        if exclude is None and self._mask is not None:
+            return self._mask
+
+        filters = [(column, f) for column, f in self.filters.items() if column != exclude]
+
+        if not filters:
+            mask = self.all_rows()
+        elif self.mode == FilterEngine.MODE_AND:
+            mask = self.all_rows()
+            for column, f in filters:
+                mask &= f.match(self.columns[column])
+                if not mask:
+                    break
+        else:
+            mask = 0
+            for column, f in filters:
+                mask |= f.match(self.columns[column])
+
+        if exclude is None:
+            self._mask = mask
+        return mask
+
+    def facet_masks(self) -> Dict[int, Optional[int]]:
+        """
+        计算分面统计需要的位图: 每列统计时忽略该列自身的条件
+
+        返回 {列: 位图}, 位图为None表示统计所有行. 没有条件的列共用同一个位图.
+        """
+        if not self.filters:
+            return {column: None for column in range(self.column_count)}
+        mask = self.mask()
+        masks: Dict[int, Optional[int]] = {}
+        for column in range(self.column_count):
+            if column in self.filters:
+                other = self.mask(exclude=column)
+                masks[column] = None if other == self.all_rows() else other
+            else:
+                masks[column] = mask
+        return masks
+
+    def histogram(self, column: int, faceted: bool = True) -> Dict[str, int]:
+        """
+        某一列的值 -> 行数统计
+
+        Args:
+            faceted: 只统计满足其他列筛选条件的行
+        """
+        index = self.columns[column]
+        if not faceted or not self.filters:
+            return index.counts()
+        return count_values(index.values, self.row_count, self.facet_masks()[column])
+
+    def accepts(self, row: int) -> bool:
+        if not self.filters:
+            return True
+        if row >= self.row_count:
+            # 尚未建立索引的行暂不显示, 索引合并后会重新筛选
+            return False
+        if self._flags is None:
+            self._flags = bitmap_to_flags(self.mask(), self.row_count)
+        return bool(self._flags[row >> 3] >> (row & 7) & 1)
+
+    def accepted_count(self) -> int:
+        return self.mask().bit_count()
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'kongming', 'images')
+
+class ImageCache(object):
+    """
+    按ossUrl缓存图片内容的两级LRU缓存: 内存 + 磁盘
+
+    下载使用共享连接池的requests.Session. 同一个url同时只会下载一次, 并发的请求
+    等待同一个Future. 内存和磁盘缓存都按总字节数限制大小, 超出时淘汰最久未使用的图片.
+
+    Args:
+        cache_dir: 磁盘缓存目录, 为None时只使用内存缓存
+        memory_bytes: 内存缓存的最大字节数
+        disk_bytes: 磁盘缓存的最大字节数
+        max_workers: 下载线程数, 同时也是连接池大小
+        timeout: 下载超时秒数
+    """
+    def __init__(self,
+                 cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+                 memory_bytes: int = 64 * 1024 * 1024,
+                 disk_bytes: int = 512 * 1024 * 1024,
+                 max_workers: int = 4,
+                 timeout: float = 10):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kongming-image')
+
+        self._lock = threading.Lock()
+        self._memory: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._memory_size = 0
+        self._inflight: Dict[str, Future] = {}
+        self._disk_size: Optional[int] = None
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def _remember(self, url: str, data: bytes):
+        # 调用方持有self._lock
+        if len(data) > self.memory_bytes:
+            return
+        old = self._memory.pop(url, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[url] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def get(self, url: str) -> Optional[bytes]:
+        """只查缓存, 不下载"""
+        with self._lock:
+            data = self._memory.get(url)
+            if data is not None:
+                self._memory.move_to_end(url)
+                return data
+
+        if not self.cache_dir:
+            return None
+        path = self._path(url)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path) # 修改时间即最近使用时间
+        except OSError:
+            return None
+
+        with self._lock:
+            self._remember(url, data)
+        return data
+
+    def fetch(self, url: str) -> bytes:
+        """返回url的内容, 缓存中没有时下载; 失败时抛出requests的异常"""
+        data = self.get(url)
+        if data is not None:
+            return data
+        return self.fetch_async(url).result()
+
+    def fetch_async(self, url: str) -> Future:
+        """
+        在下载线程中获取url的内容, 返回Future
+
+        同一个url正在下载时返回同一个Future.
+        """
+        with self._lock:
+            future = self._inflight.get(url)
+            if future is not None:
+                return future
+            data = self._memory.get(url)
+            if data is not None:
+                self._memory.move_to_end(url)
+                future = Future()
+                future.set_result(data)
+                return future
+            future = self._inflight[url] = self.executor.submit(self._load, url)
+        return future
+
+    def _load(self, url: str) -> bytes:
+        try:
+            data = self.get(url)
+            if data is None:
+                response = self.session.get(url, timeout=self.timeout)
+                response.raise_for_status()
+                data = response.content
+                with self._lock:
+                    self._remember(url, data)
+                self._store(url, data)
+            return data
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+
+    def _store(self, url: str, data: bytes):
+        if not self.cache_dir or len(data) > self.disk_bytes:
+            return
+        path = self._path(url)
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            return
+
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.is_file())
+            else:
+                self._disk_size += len(data)
+            if self._disk_size > self.disk_bytes:
+                self._prune_disk()
+
+    def _prune_disk(self):
+        """删除最久未使用的文件, 直到总大小降到限制的90%以下; 调用方持有self._lock"""
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                         for entry in os.scandir(self.cache_dir) if entry.is_file())
+        size = sum(size for _, size, _ in entries)
+        for _, file_size, path in entries:
+            if size <= self.disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                size -= file_size
+            except OSError:
+                pass
+        self._disk_size = size
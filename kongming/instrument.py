@@ -0,0 +1,230 @@
+import os
+import threading
+import time
+import tracemalloc
+
+from typing import Any, Dict, List, Optional
+
+# 设置KONGMING_TRACEMALLOC=1时启动tracemalloc, span会记录分配峰值(有额外的运行开销)
+if os.environ.get('KONGMING_TRACEMALLOC') and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+class SpanStats(object):
+    """一个阶段的累计耗时和分配峰值"""
+    __slots__ = ['count', 'total', 'max', 'peak_bytes']
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.peak_bytes: Optional[int] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'peak_bytes': self.peak_bytes,
+        }
+
+
+class _Span(object):
+    __slots__ = ['recorder', 'name', 'begin', 'memory_start', 'memory_peak']
+
+    def __init__(self, recorder: 'Instrumentation', name: str):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.memory_start = None
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # 外层span的峰值先结算, 再为本span重新计算峰值
+            self.recorder._propagate_peak(peak)
+            tracemalloc.reset_peak()
+            self.memory_start = current
+            self.memory_peak = current
+            self.recorder._stack().append(self)
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.begin
+        peak_bytes = None
+        if self.memory_start is not None:
+            stack = self.recorder._stack()
+            if stack and stack[-1] is self:
+                stack.pop()
+            elif self in stack:
+                # 协程中的span可以交错结束
+                stack.remove(self)
+            _, peak = tracemalloc.get_traced_memory()
+            self.memory_peak = max(self.memory_peak, peak)
+            self.recorder._propagate_peak(self.memory_peak)
+            peak_bytes = self.memory_peak - self.memory_start
+        self.recorder._record(self.name, elapsed, peak_bytes)
+        return False
+
+
+class Instrumentation(object):
+    """
+    按阶段记录耗时(span)和计数器(counter)
+
+    span的开销是两次perf_counter和一次加锁, 适合包在每页/每批的处理外面, 不要包在每条记录外面.
+    计数器可以带标签, 例如按message前缀统计transform_record的匹配次数.
+    tracemalloc在运行时, span同时记录其内部的内存分配峰值(相对进入时的增量);
+    tracemalloc是进程级的, 多个线程同时运行span时峰值会互相包含.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.spans: Dict[str, SpanStats] = {}
+        self.counters: Dict[str, float] = {}
+        self.labels: Dict[str, Dict[str, float]] = {}
+        self.started = time.time()
+
+    def reset(self):
+        with self._lock:
+            self.spans = {}
+            self.counters = {}
+            self.labels = {}
+            self.started = time.time()
+
+    def span(self, name: str) -> _Span:
+        """with instrumentation.span('elk.request'): ..."""
+        return _Span(self, name)
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_label(self, name: str, label: str, value: float = 1):
+        with self._lock:
+            counts = self.labels.get(name)
+            if counts is None:
+                counts = self.labels[name] = {}
+            counts[label] = counts.get(label, 0) + value
+
+    def _stack(self) -> List[_Span]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _propagate_peak(self, peak: int):
+        for span in self._stack():
+            if peak > span.memory_peak:
+                span.memory_peak = peak
+
+    def _record(self, name: str, elapsed: float, peak_bytes: Optional[int]):
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.count += 1
+            stats.total += elapsed
+            if elapsed > stats.max:
+                stats.max = elapsed
+            if peak_bytes is not None and (stats.peak_bytes is None or peak_bytes > stats.peak_bytes):
+                stats.peak_bytes = peak_bytes
+
+    def report(self) -> Dict[str, Any]:
+        """结构化的报告, 可以直接json.dump"""
+        with self._lock:
+            return {
+                'elapsed': time.time() - self.started,
+                'spans': {name: stats.as_dict() for name, stats in self.spans.items()},
+                'counters': dict(self.counters),
+                'labels': {name: dict(counts) for name, counts in self.labels.items()},
+            }
+
+    def summary(self) -> str:
+        """一行摘要: 各span的总耗时和主要计数器"""
+        report = self.report()
+        parts = [f"{name} {stats['total']:.2f}s" for name, stats in report['spans'].items()]
+        counters = report['counters']
+        if 'elk.hits' in counters:
+            parts.append(f"{int(counters['elk.hits'])} hits")
+        if 'elk.bytes' in counters:
+            parts.append(f"{counters['elk.bytes'] / 1024 / 1024:.1f} MB")
+        if 'dialogs.rounds' in counters:
+            parts.append(f"{int(counters['dialogs.rounds'])} rounds")
+        return ', '.join(parts)
+
+
+# 默认的记录器; 线程可以用recording()临时改用自己的记录器, 例如GUI的每次查询
+DEFAULT = Instrumentation()
+
+_current = threading.local()
+
+def current() -> Instrumentation:
+    """当前线程使用的记录器"""
+    return getattr(_current, 'recorder', None) or DEFAULT
+
+class recording(object):
+    """
+    在with块内让当前线程的span和计数器记录到recorder中
+
+        metrics = Instrumentation()
+        with recording(metrics):
+            server.query_dialogs(...)
+        print_report(metrics)
+    """
+    def __init__(self, recorder: Instrumentation):
+        self.recorder = recorder
+
+    def __enter__(self) -> Instrumentation:
+        self.previous = getattr(_current, 'recorder', None)
+        _current.recorder = self.recorder
+        return self.recorder
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current.recorder = self.previous
+        return False
+
+def span(name: str) -> _Span:
+    return current().span(name)
+
+def count(name: str, value: float = 1):
+    current().count(name, value)
+
+def count_label(name: str, label: str, value: float = 1):
+    current().count_label(name, label, value)
+
+
+def print_report(recorder: Optional[Instrumentation] = None, top_labels: int = 10):
+    """
+    使用rich打印各阶段耗时, 内存峰值和计数器
+
+    Args:
+        recorder: 默认为当前线程的记录器
+        top_labels: 带标签的计数器只显示次数最多的若干个标签
+    """
+    from rich.console import Console
+    from rich.markup import escape
+    from rich.table import Table
+
+    report = (recorder or current()).report()
+    console = Console()
+
+    table = Table(title=f"阶段耗时 (共 {report['elapsed']:.2f}s)", show_header=True, header_style="bold magenta")
+    for title in ["阶段", "次数", "总耗时(s)", "平均(ms)", "最长(ms)", "内存峰值(MB)"]:
+        table.add_column(title, justify="left" if title == "阶段" else "right")
+    for name, stats in sorted(report['spans'].items(), key=lambda item: -item[1]['total']):
+        peak = stats['peak_bytes']
+        table.add_row(name, str(stats['count']), f"{stats['total']:.3f}", f"{stats['mean'] * 1000:.1f}", f"{stats['max'] * 1000:.1f}",
+                      "" if peak is None else f"{peak / 1024 / 1024:.1f}")
+    console.print(table)
+
+    if report['counters'] or report['labels']:
+        table = Table(title="计数器", show_header=True, header_style="bold magenta")
+        table.add_column("名称")
+        table.add_column("值", justify="right")
+        for name, value in sorted(report['counters'].items()):
+            table.add_row(name, f"{value:,.0f}" if float(value).is_integer() else f"{value:,.3f}")
+        for name, counts in sorted(report['labels'].items()):
+            for label, value in sorted(counts.items(), key=lambda item: -item[1])[:top_labels]:
+                table.add_row(escape(f"{name}[{label.strip()}]"), f"{value:,.0f}")
+        console.print(table)
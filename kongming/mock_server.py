@@ -0,0 +1,632 @@
+import asyncio
+import fnmatch
+import json
+import random
+import threading
+import time
+
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from .synthetic import SyntheticLogGenerator, read_jsonl
+
+# Kibana console proxy的路径, 与KongmingELKServer._format_url一致
+PROXY_PATH = '/s/ai/api/console/proxy'
+
+# 与ELK默认的index.max_result_window相同
+MAX_RESULT_WINDOW = 10000
+
+_INTERVALS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+_CALENDAR_INTERVALS = {'minute': '1m', 'hour': '1h', 'day': '1d', 'week': '1w'}
+
+
+class QueryError(Exception):
+    """查询格式不支持或不正确, 对应ELK的400响应"""
+    pass
+
+
+def _to_epoch(value) -> Optional[float]:
+    """ELK日期值 -> Unix时间(秒): 数字视为毫秒, 没有时区的字符串按UTC处理"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value / 1000
+    try:
+        dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+def _interval_seconds(interval: str) -> float:
+    interval = _CALENDAR_INTERVALS.get(interval, interval)
+    for unit in sorted(_INTERVALS, key=len, reverse=True):
+        if interval.endswith(unit):
+            try:
+                return float(interval[:-len(unit)] or 1) * _INTERVALS[unit]
+            except ValueError:
+                break
+    raise QueryError(f"unsupported interval '{interval}'")
+
+def _field_value(src: Dict[str, Any], field: str):
+    """取_source中的字段: 先按完整的key查找(例如message.prefix), 再按.分隔的路径查找"""
+    if field.endswith('.keyword'):
+        field = field[:-len('.keyword')]
+    if field in src:
+        return src[field]
+    value: Any = src
+    for part in field.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def _text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def _filter_source(src: Dict[str, Any], source) -> Optional[Dict[str, Any]]:
+    """按_source的includes/excludes(支持通配符, 只作用于顶层字段)过滤"""
+    if source is False:
+        return None
+    if source is None or source is True:
+        return src
+    if isinstance(source, (str, list)):
+        includes, excludes = source if isinstance(source, list) else [source], []
+    else:
+        includes, excludes = source.get('includes') or [], source.get('excludes') or []
+    result = {}
+    for key, value in src.items():
+        if includes and not any(fnmatch.fnmatchcase(key, pattern) for pattern in includes):
+            continue
+        if any(fnmatch.fnmatchcase(key, pattern) for pattern in excludes):
+            continue
+        result[key] = value
+    return result
+
+
+class MockDataset(object):
+    """
+    模拟服务器使用的数据: 按@timestamp排序的hit列表
+
+    查询是对内存中数据的线性扫描, 有@timestamp范围条件时先用二分查找缩小范围.
+    同一个查询翻页时复用已经计算好的匹配结果(按query+sort缓存最近的若干个),
+    search_after翻页时记住每页最后一条的位置, 下一页不需要重新定位.
+    """
+    def __init__(self, hits: Iterable[Dict[str, Any]], cache_size: int = 16):
+        self.hits: List[Dict[str, Any]] = []
+        for pos, hit in enumerate(hits):
+            hit.setdefault('_id', str(pos))
+            hit.setdefault('_index', 'uat-kongming')
+            self.hits.append(hit)
+        self.hits.sort(key=lambda hit: hit['_source'].get('@timestamp') or '')
+        self.epochs = [_to_epoch(hit['_source'].get('@timestamp')) or 0.0 for hit in self.hits]
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[str, List[int]]' = OrderedDict()
+        self._cursors: 'OrderedDict[str, int]' = OrderedDict() # (查询, search_after) -> 下一页在匹配结果中的位置
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.hits)
+
+    @staticmethod
+    def from_file(filename: str) -> 'MockDataset':
+        """读取jsonl(.gz), ELK响应或hit列表"""
+        if filename.endswith('.jsonl') or filename.endswith('.jsonl.gz'):
+            return MockDataset(read_jsonl(filename))
+        with open(filename, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return MockDataset(data['hits']['hits'] if isinstance(data, dict) else data)
+
+    @staticmethod
+    def synthetic(traces: int, seed: int = 0, **kwargs) -> 'MockDataset':
+        return MockDataset(SyntheticLogGenerator(traces=traces, seed=seed, **kwargs))
+
+    # ------------------------------------------------------------------
+    # 查询
+
+    def _matcher(self, query: Optional[Dict[str, Any]]) -> Callable[[Dict[str, Any]], bool]:
+        if not query or 'match_all' in query:
+            return lambda src: True
+        if len(query) != 1:
+            raise QueryError(f"query must have exactly one clause: {list(query)}")
+        kind, body = next(iter(query.items()))
+
+        if kind == 'bool':
+            must = [self._matcher(q) for q in self._clauses(body.get('must')) + self._clauses(body.get('filter'))]
+            must_not = [self._matcher(q) for q in self._clauses(body.get('must_not'))]
+            should = [self._matcher(q) for q in self._clauses(body.get('should'))]
+            minimum = body.get('minimum_should_match', 0 if must else 1) if should else 0
+            def match_bool(src):
+                if not all(m(src) for m in must):
+                    return False
+                if any(m(src) for m in must_not):
+                    return False
+                return minimum <= 0 or sum(1 for m in should if m(src)) >= int(minimum)
+            return match_bool
+
+        if kind == 'exists':
+            field = body['field']
+            return lambda src: _field_value(src, field) is not None
+
+        if kind in ('term', 'terms'):
+            field, value = next(iter(body.items()))
+            if isinstance(value, dict):
+                value = value.get('value')
+            values = set(value) if kind == 'terms' else {value}
+            return lambda src: _field_value(src, field) in values
+
+        if kind == 'range':
+            field, bounds = next(iter(body.items()))
+            convert = _to_epoch if field == '@timestamp' else (lambda v: v)
+            checks = [(op, convert(bounds[op])) for op in ('gte', 'gt', 'lte', 'lt') if op in bounds]
+            def match_range(src):
+                value = convert(_field_value(src, field))
+                if value is None:
+                    return False
+                for op, bound in checks:
+                    if (op == 'gte' and value < bound) or (op == 'gt' and value <= bound) \
+                            or (op == 'lte' and value > bound) or (op == 'lt' and value >= bound):
+                        return False
+                return True
+            return match_range
+
+        if kind in ('match_phrase', 'match'):
+            field, value = next(iter(body.items()))
+            if isinstance(value, dict):
+                value = value.get('query')
+            return self._phrase_matcher(str(value), [field])
+
+        if kind == 'multi_match':
+            return self._phrase_matcher(str(body['query']), body.get('fields') or ['*'])
+
+        raise QueryError(f"unsupported query '{kind}'")
+
+    @staticmethod
+    def _clauses(clauses) -> List[Dict[str, Any]]:
+        if clauses is None:
+            return []
+        return clauses if isinstance(clauses, list) else [clauses]
+
+    @staticmethod
+    def _phrase_matcher(phrase: str, fields: List[str]) -> Callable[[Dict[str, Any]], bool]:
+        """
+        短语匹配近似为不区分大小写的子串匹配
+
+        ELK对分词后的文本做短语匹配, 对于按"key":"value"这类短语查询原始json字段的用法, 子串匹配的结果相同.
+        """
+        phrase = phrase.lower()
+        if '*' in fields:
+            return lambda src: any(phrase in _text(value).lower() for value in src.values())
+        return lambda src: any(phrase in _text(_field_value(src, field)).lower() for field in fields)
+
+    @staticmethod
+    def _time_bounds(query: Optional[Dict[str, Any]]) -> Tuple[Optional[float], Optional[float]]:
+        """从顶层bool.must/filter中找出@timestamp的范围, 用于二分查找"""
+        low = high = None
+        if not query or 'bool' not in query:
+            clauses = [query] if query else []
+        else:
+            clauses = MockDataset._clauses(query['bool'].get('must')) + MockDataset._clauses(query['bool'].get('filter'))
+        for clause in clauses:
+            bounds = clause.get('range', {}).get('@timestamp')
+            if bounds:
+                if 'gte' in bounds or 'gt' in bounds:
+                    low = _to_epoch(bounds.get('gte', bounds.get('gt')))
+                if 'lte' in bounds or 'lt' in bounds:
+                    high = _to_epoch(bounds.get('lte', bounds.get('lt')))
+        return low, high
+
+    def _sort_keys(self, sort) -> List[Tuple[str, bool]]:
+        """[(字段, 是否降序)]"""
+        keys = []
+        for item in self._clauses(sort):
+            if isinstance(item, str):
+                keys.append((item, False))
+                continue
+            field, order = next(iter(item.items()))
+            if isinstance(order, dict):
+                order = order.get('order', 'asc')
+            keys.append((field, order == 'desc'))
+        return keys
+
+    def _sort_value(self, pos: int, field: str):
+        hit = self.hits[pos]
+        if field == '@timestamp':
+            return int(round(self.epochs[pos] * 1000))
+        if field == '_id':
+            return hit['_id']
+        if field in ('_doc', '_shard_doc'):
+            return pos
+        value = _field_value(hit['_source'], field)
+        return value if isinstance(value, (int, float, str)) else _text(value)
+
+    @staticmethod
+    def _key(query, sort, index) -> str:
+        return json.dumps([query, sort, index], sort_keys=True, ensure_ascii=False)
+
+    def matches(self, query: Optional[Dict[str, Any]], sort=None, index: str = '*') -> List[int]:
+        """按sort排序的匹配行号, 结果会缓存"""
+        key = self._key(query, sort, index)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+
+        matcher = self._matcher(query)
+        low, high = self._time_bounds(query)
+        start = 0 if low is None else bisect_left(self.epochs, low)
+        stop = len(self.hits) if high is None else bisect_right(self.epochs, high)
+        patterns = index.split(',')
+        rows = [pos for pos in range(start, stop)
+                if any(fnmatch.fnmatchcase(self.hits[pos].get('_index', ''), pattern) for pattern in patterns)
+                and matcher(self.hits[pos]['_source'])]
+
+        # 数据已按@timestamp升序, 默认排序和按@timestamp升序排序不需要重新排序;
+        # 但已经按优先级更低的字段排过序时, @timestamp也要重新排序
+        resorted = False
+        for field, descending in reversed(self._sort_keys(sort)):
+            if field == '@timestamp' and not descending and not resorted:
+                continue
+            rows.sort(key=lambda pos: self._sort_value(pos, field), reverse=descending)
+            resorted = True
+
+        with self._lock:
+            self._cache[key] = rows
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return rows
+
+    def search(self, body: Dict[str, Any], index: str = '*', max_result_window: int = MAX_RESULT_WINDOW) -> Dict[str, Any]:
+        """执行_search请求, 返回与ELK格式相同的响应"""
+        begin = time.perf_counter()
+        query = body.get('query')
+        sort = body.get('sort')
+        sort_keys = self._sort_keys(sort)
+        offset = int(body.get('from', 0))
+        size = int(body.get('size', 10))
+        if offset + size > max_result_window:
+            raise QueryError(f"Result window is too large, from + size must be less than or equal to: [{max_result_window}] but was [{offset + size}]")
+
+        rows = self.matches(query, sort, index)
+
+        first = offset
+        search_after = body.get('search_after')
+        if search_after is not None:
+            if not sort_keys:
+                raise QueryError("search_after requires sort")
+            if offset:
+                raise QueryError("from parameter must be set to 0 when search_after is used")
+            first = self._search_after(rows, sort_keys, search_after, self._key(query, sort, index))
+
+        page = rows[first:first + size]
+        if sort_keys and page:
+            # 客户端通常用本页最后一条的sort作为下一页的search_after;
+            # 与ELK相同, 下一页从sort严格大于它的记录开始, 与它相同的记录被跳过
+            last = [self._sort_value(page[-1], field) for field, _ in sort_keys]
+            following = first + len(page)
+            while following < len(rows) and [self._sort_value(rows[following], field) for field, _ in sort_keys] == last:
+                following += 1
+            cursor = self._key(query, sort, index) + json.dumps(last, ensure_ascii=False)
+            with self._lock:
+                self._cursors[cursor] = following
+                while len(self._cursors) > 1024:
+                    self._cursors.popitem(last=False)
+
+        hits = []
+        for pos in page:
+            hit = self.hits[pos]
+            item = {'_index': hit['_index'], '_id': hit['_id'], '_score': None if sort_keys else 1.0}
+            source = _filter_source(hit['_source'], body.get('_source'))
+            if source is not None:
+                item['_source'] = source
+            if sort_keys:
+                item['sort'] = [self._sort_value(pos, field) for field, _ in sort_keys]
+            hits.append(item)
+
+        total = len(self.matches(query, sort, index))
+        track_total_hits = body.get('track_total_hits', MAX_RESULT_WINDOW)
+        if track_total_hits is True or (not isinstance(track_total_hits, bool) and total <= track_total_hits):
+            total_hits = {'value': total, 'relation': 'eq'}
+        else:
+            total_hits = {'value': MAX_RESULT_WINDOW if track_total_hits is False else track_total_hits, 'relation': 'gte'}
+
+        response: Dict[str, Any] = {
+            'timed_out': False,
+            '_shards': {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0},
+            'hits': {'total': total_hits, 'max_score': None, 'hits': hits},
+        }
+        aggs = body.get('aggs') or body.get('aggregations')
+        if aggs:
+            response['aggregations'] = self._aggregations(aggs, self.matches(query, sort, index))
+        response['took'] = int((time.perf_counter() - begin) * 1000)
+        return response
+
+    def _search_after(self, rows: List[int], sort_keys: List[Tuple[str, bool]], search_after: List[Any], key: str) -> int:
+        """rows中第一个排在search_after之后的位置"""
+        with self._lock:
+            first = self._cursors.get(key + json.dumps(list(search_after), ensure_ascii=False))
+        if first is not None:
+            return first
+
+        after = tuple(search_after)
+        def is_after(pos):
+            for (field, descending), value in zip(sort_keys, after):
+                current = self._sort_value(pos, field)
+                if current != value:
+                    return current < value if descending else current > value
+            return False
+        # rows已按sort_keys排序, is_after在rows上先全为False后全为True, 二分查找第一个True的位置
+        low, high = 0, len(rows)
+        while low < high:
+            mid = (low + high) // 2
+            if is_after(rows[mid]):
+                high = mid
+            else:
+                low = mid + 1
+        return low
+
+    # ------------------------------------------------------------------
+    # 聚合
+
+    def _aggregations(self, aggs: Dict[str, Any], rows: List[int]) -> Dict[str, Any]:
+        result = {}
+        for name, spec in aggs.items():
+            sub = spec.get('aggs') or spec.get('aggregations')
+            kinds = [kind for kind in spec if kind not in ('aggs', 'aggregations')]
+            if len(kinds) != 1:
+                raise QueryError(f"aggregation '{name}' must have exactly one type")
+            kind = kinds[0]
+            body = spec[kind]
+            result[name] = self._aggregation(kind, body, rows, sub)
+        return result
+
+    def _aggregation(self, kind: str, body: Dict[str, Any], rows: List[int], sub: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        field = body.get('field', '@timestamp')
+
+        if kind == 'date_histogram':
+            interval = _interval_seconds(body.get('fixed_interval') or body.get('calendar_interval') or body.get('interval') or '1h')
+            min_doc_count = body.get('min_doc_count', 0)
+            buckets: Dict[float, List[int]] = {}
+            for pos in rows:
+                epoch = self.epochs[pos] if field == '@timestamp' else _to_epoch(_field_value(self.hits[pos]['_source'], field))
+                if epoch is None:
+                    continue
+                buckets.setdefault(epoch - epoch % interval, []).append(pos)
+            keys = sorted(buckets)
+            if keys and min_doc_count == 0:
+                # 与ELK一样补齐中间的空桶
+                count = int(round((keys[-1] - keys[0]) / interval)) + 1
+                keys = [keys[0] + i * interval for i in range(count)]
+            items = []
+            for key in keys:
+                bucket_rows = buckets.get(key, [])
+                if len(bucket_rows) < min_doc_count:
+                    continue
+                item = {
+                    'key_as_string': datetime.fromtimestamp(key, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                    'key': int(key * 1000),
+                    'doc_count': len(bucket_rows),
+                }
+                if sub:
+                    item.update(self._aggregations(sub, bucket_rows))
+                items.append(item)
+            return {'buckets': items}
+
+        if kind == 'terms':
+            groups: Dict[Any, List[int]] = {}
+            for pos in rows:
+                value = _field_value(self.hits[pos]['_source'], field)
+                if value is not None:
+                    groups.setdefault(value if isinstance(value, (int, float, str)) else _text(value), []).append(pos)
+            ordered = sorted(groups.items(), key=lambda item: (-len(item[1]), str(item[0])))
+            size = body.get('size', 10)
+            items = []
+            for key, bucket_rows in ordered[:size]:
+                item = {'key': key, 'doc_count': len(bucket_rows)}
+                if sub:
+                    item.update(self._aggregations(sub, bucket_rows))
+                items.append(item)
+            return {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': sum(len(bucket_rows) for _, bucket_rows in ordered[size:]),
+                'buckets': items,
+            }
+
+        if kind in ('min', 'max'):
+            if field == '@timestamp':
+                values = [self.epochs[pos] * 1000 for pos in rows]
+            else:
+                values = [v for v in (_field_value(self.hits[pos]['_source'], field) for pos in rows) if isinstance(v, (int, float))]
+            if not values:
+                return {'value': None}
+            value = min(values) if kind == 'min' else max(values)
+            result: Dict[str, Any] = {'value': value}
+            if field == '@timestamp':
+                result['value_as_string'] = datetime.fromtimestamp(value / 1000, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+            return result
+
+        if kind == 'value_count':
+            return {'value': sum(1 for pos in rows if _field_value(self.hits[pos]['_source'], field) is not None)}
+
+        if kind == 'cardinality':
+            return {'value': len({_text(_field_value(self.hits[pos]['_source'], field)) for pos in rows} - {''})}
+
+        raise QueryError(f"unsupported aggregation '{kind}'")
+
+
+class MockServerConfig(BaseModel):
+    """
+    模拟服务器的行为
+
+    延迟 = latency + latency_per_hit * 返回的hit数, 再乘以[1 - jitter, 1 + jitter]内的随机系数.
+    """
+    latency: float = 0.0                 # 每个请求的基础延迟(秒)
+    latency_per_hit: float = 0.0         # 每返回一条hit增加的延迟(秒)
+    jitter: float = 0.0                  # 延迟的随机波动比例
+    max_concurrency: int = 0             # 同时处理的请求数, 超出的请求排队; 0表示不限
+    rate_limit: float = 0.0              # 每秒允许的请求数, 超出时返回429; 0表示不限
+    error_rate: float = 0.0              # 随机返回错误的概率
+    error_status: List[int] = [500, 502, 503]
+    timeout_rate: float = 0.0            # 随机挂起的概率, 挂起timeout_delay秒后才返回
+    timeout_delay: float = 30.0
+    max_result_window: int = MAX_RESULT_WINDOW
+    username: Optional[str] = None       # 设置后要求Basic认证
+    password: Optional[str] = None
+    seed: Optional[int] = None
+
+
+class _RateLimiter(object):
+    """令牌桶, 桶容量为一秒的请求数"""
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def acquire(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def create_app(dataset: MockDataset, config: Optional[MockServerConfig] = None):
+    """
+    创建模拟Kibana console proxy的FastAPI应用
+
+    支持 POST /s/ai/api/console/proxy?path=<index>/_search&method=GET, 请求体为ELK的_search请求.
+    GET /_mock/stats 返回请求统计, POST /_mock/stats/reset 清零.
+    """
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+
+    config = config or MockServerConfig()
+    rng = random.Random(config.seed)
+    limiter = _RateLimiter(config.rate_limit) if config.rate_limit > 0 else None
+    semaphore = asyncio.Semaphore(config.max_concurrency) if config.max_concurrency > 0 else None
+    stats = {'requests': 0, 'hits': 0, 'errors': 0, 'throttled': 0, 'timeouts': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+    app = FastAPI(title="kongming mock ELK")
+    app.state.dataset = dataset
+    app.state.config = config
+    app.state.stats = stats
+
+    def error(status: int, reason: str) -> 'JSONResponse':
+        return JSONResponse(status_code=status, content={'statusCode': status, 'error': reason, 'message': reason})
+
+    def authorized(request: 'Request') -> bool:
+        if config.username is None:
+            return True
+        import base64
+        expected = base64.b64encode(f'{config.username}:{config.password or ""}'.encode('utf-8')).decode('ascii')
+        return request.headers.get('authorization') == f'Basic {expected}'
+
+    async def handle(request: 'Request', body: Dict[str, Any]) -> 'JSONResponse':
+        path = request.query_params.get('path', '')
+        if not path.endswith('_search'):
+            return error(400, f"unsupported path '{path}'")
+        index = path[:-len('_search')].rstrip('/') or '*'
+
+        if config.timeout_rate and rng.random() < config.timeout_rate:
+            stats['timeouts'] += 1
+            await asyncio.sleep(config.timeout_delay)
+        if config.error_rate and rng.random() < config.error_rate:
+            stats['errors'] += 1
+            return error(rng.choice(config.error_status), "injected error")
+
+        try:
+            response = await asyncio.to_thread(dataset.search, body, index, config.max_result_window)
+        except QueryError as e:
+            stats['errors'] += 1
+            return JSONResponse(status_code=400, content={'error': {'type': 'search_phase_execution_exception', 'reason': str(e)}, 'status': 400})
+
+        returned = len(response['hits']['hits'])
+        delay = config.latency + config.latency_per_hit * returned
+        if config.jitter:
+            delay *= rng.uniform(1 - config.jitter, 1 + config.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        stats['hits'] += returned
+        return JSONResponse(content=response)
+
+    @app.post(PROXY_PATH)
+    async def proxy(request: Request):
+        stats['requests'] += 1
+        if request.query_params.get('method', 'GET').upper() not in ('GET', 'POST'):
+            return error(400, "unsupported method")
+        if 'kbn-xsrf' not in request.headers:
+            return error(400, "Request must contain a kbn-xsrf header.")
+        if not authorized(request):
+            return error(401, "Unauthorized")
+        if limiter is not None and not limiter.acquire():
+            stats['throttled'] += 1
+            return error(429, "Too Many Requests")
+        try:
+            body = json.loads(await request.body() or b'{}')
+        except ValueError:
+            return error(400, "invalid json body")
+
+        stats['in_flight'] += 1
+        stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+        try:
+            if semaphore is None:
+                return await handle(request, body)
+            async with semaphore:
+                return await handle(request, body)
+        finally:
+            stats['in_flight'] -= 1
+
+    @app.get('/_mock/stats')
+    async def get_stats():
+        return dict(stats, documents=len(dataset))
+
+    @app.post('/_mock/stats/reset')
+    async def reset_stats():
+        for key in stats:
+            if key != 'in_flight':
+                stats[key] = 0
+        return dict(stats)
+
+    return app
+
+def run(dataset: MockDataset, config: Optional[MockServerConfig] = None, host: str = '127.0.0.1', port: int = 9200):
+    """用uvicorn运行模拟服务器, 之后可以用 KongmingELKServer(server=f'http://{host}:{port}') 访问"""
+    import uvicorn
+
+    uvicorn.run(create_app(dataset, config), host=host, port=port, log_level='warning')
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the Kibana console proxy of the kongming ELK")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--data', help="jsonl(.gz), ELK响应或hit列表文件")
+    source.add_argument('--synthetic', type=int, metavar='TRACES', help="使用合成数据, 指定trace数量")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9200)
+    for name, field in MockServerConfig.model_fields.items():
+        if field.annotation in (int, float):
+            parser.add_argument(f'--{name.replace("_", "-")}', type=field.annotation, default=field.default)
+    args = parser.parse_args(argv)
+
+    dataset = MockDataset.from_file(args.data) if args.data else MockDataset.synthetic(args.synthetic, seed=args.seed)
+    # --seed同时决定合成数据和模拟的延迟/错误
+    config = MockServerConfig(**{name: getattr(args, name) for name in MockServerConfig.model_fields if hasattr(args, name)})
+    print(f"serving {len(dataset)} documents on http://{args.host}:{args.port}")
+    run(dataset, config, host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
@@ -244,4 +244,139 @@ class DialogRound(BaseModel):
         round.nlp_round = NLPRound.from_records(nlp_request, nlp_response)
         round.llm_round = LLMRound.from_records(llm_request, llm_response)
 
-        return round
\ No newline at end of file
+        return round
+
+class DialogRoundAssembler(object):
+    """
+    把按@timestamp升序到达的central-manager记录增量组装成DialogRound
+
+    每个traceId收集nlp请求/响应和大模型请求/响应4条记录. 一个trace在以下情况视为完整:
+    已收到nlp响应和大模型响应; 已收到nlp响应, 没有大模型请求, 并且最新记录已比nlp响应晚grace秒
+    (大模型请求紧跟在nlp响应之后, 只是可能落在下一批记录中); 或者它的最后一条记录比目前见到的
+    最新记录早horizon秒以上. 完整的round按trace首次出现的顺序输出, 与一次性组装的结果顺序一致.
+
+    输出之后的trace保留到它的最后一条记录之后2*horizon秒: 期间到达的记录(例如很晚的大模型响应)
+    补进已输出的round对象, query_dialogs等一次性返回结果的调用得到的round与一次性组装相同.
+
+    Args:
+        size: 最多输出的round数量, None表示不限
+        horizon: 等待一个trace后续记录的最长时间(秒, 按日志时间计算)
+        grace: 收到nlp响应后等待大模型请求的时间(秒, 按日志时间计算)
+    """
+    def __init__(self, size: Optional[int] = None, horizon: float = 60.0, grace: float = 2.0):
+        self.size = size
+        self.horizon = horizon
+        self.grace = grace
+        self.emitted = 0
+
+        # traceId -> [最后一条记录的时间, {nlp_request, nlp_response, llm_request, llm_response}], 按首次出现的顺序
+        self._pending: Dict[str, list] = {}
+        # 已输出的trace: traceId -> [最后一条记录的时间, parts, round], 按输出的顺序
+        self._emitted: Dict[str, list] = {}
+        self._latest: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.size is not None and self.emitted >= self.size
+
+    @staticmethod
+    def _add_part(parts: Dict, r: Dict):
+        src = r['_source']
+        # 在大模型请求时，同一个traceId可能会有２个NLU请求，第二个通话是清除上下文的动作，因此如果已经有第一个消息了，就不要再存入map
+        if 'central-nlp-request' in src:
+            if parts['nlp_request'] is None:
+                parts['nlp_request'] = r
+        elif 'central-nlp-response' in src:
+            if parts['nlp_request'] is not None and parts['nlp_response'] is None:
+                parts['nlp_response'] = r
+        elif 'central-answer-request' in src:
+            parts['llm_request'] = r
+        elif 'central-answer-response' in src:
+            parts['llm_response'] = r
+
+    def add_records(self, records: List[Dict]) -> List['DialogRound']:
+        """加入一批记录, 返回因此变得完整的round"""
+        from .utils import timestamp_to_epoch
+
+        patched = set()
+        for r in records:
+            src = r['_source']
+            traceId = src['traceId']
+            timestamp = src.get('@timestamp')
+            seen = timestamp_to_epoch(timestamp) if timestamp else None
+            if seen is not None and (self._latest is None or seen > self._latest):
+                self._latest = seen
+
+            entry = self._pending.get(traceId)
+            if entry is None:
+                entry = self._emitted.get(traceId)
+                if entry is not None:
+                    patched.add(traceId)
+                else:
+                    entry = self._pending[traceId] = [seen, {
+                        'nlp_request': None,
+                        'nlp_response': None,
+                        'llm_request': None,
+                        'llm_response': None
+                    }]
+
+            if seen is not None:
+                entry[0] = seen
+            self._add_part(entry[1], r)
+
+        for traceId in patched:
+            _, parts, round = self._emitted[traceId]
+            assembled = DialogRound.from_records(**parts)
+            round.nlp_round = assembled.nlp_round
+            round.llm_round = assembled.llm_round
+
+        return self._collect(final=False)
+
+    def flush(self) -> List['DialogRound']:
+        """所有记录都已到达, 输出剩余的round"""
+        rounds = self._collect(final=True)
+        self._emitted.clear()
+        return rounds
+
+    def _expired(self, last_seen: Optional[float], horizon: float) -> bool:
+        return last_seen is not None and self._latest is not None and self._latest - last_seen > horizon
+
+    def _nlu_only(self, parts: Dict) -> bool:
+        """已收到nlp响应, 并且过了grace秒仍没有大模型请求"""
+        from .utils import timestamp_to_epoch
+
+        if parts['nlp_response'] is None or parts['llm_request'] is not None or self._latest is None:
+            return False
+        timestamp = parts['nlp_response']['_source'].get('@timestamp')
+        return timestamp is not None and self._latest - timestamp_to_epoch(timestamp) > self.grace
+
+    def _collect(self, final: bool) -> List['DialogRound']:
+        rounds: List[DialogRound] = []
+
+        while self._pending and not self.done:
+            traceId, (last_seen, parts) = next(iter(self._pending.items()))
+
+            if not final:
+                complete = parts['nlp_response'] is not None and parts['llm_response'] is not None
+                if not complete and not self._expired(last_seen, self.horizon) and not self._nlu_only(parts):
+                    break
+
+            del self._pending[traceId]
+
+            round = DialogRound.from_records(**parts)
+            if round is not None:
+                rounds.append(round)
+                self.emitted += 1
+                self._emitted[traceId] = [last_seen, parts, round]
+
+        if self.done:
+            self._pending.clear()
+
+        # 已输出的trace在最后一条记录之后保留2*horizon秒, 等待迟到的记录
+        while self._emitted:
+            traceId, (last_seen, _, _) = next(iter(self._emitted.items()))
+            if not self._expired(last_seen, 2 * self.horizon):
+                break
+            del self._emitted[traceId]
+
+        return rounds
@@ -0,0 +1,182 @@
+import math
+
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+import threading
+
+from . import instrument
+
+if TYPE_CHECKING:
+    from .elk import AsyncKongmingELKServer, KongmingELKServer, KongmingEnvironmentType
+
+# 每个分片最多的命中数. 分片内部仍然按页取回, 这个值决定并行的粒度和提前结束时最多多取回多少
+DEFAULT_SHARD_HITS = 5000
+
+# date_histogram最多的桶数, 桶越细分片越接近DEFAULT_SHARD_HITS
+MAX_BUCKETS = 1000
+
+
+class QueryShard(object):
+    """
+    查询时间窗口中的一段 [begin, end)
+
+    begin/end为None表示沿用原查询的边界(第一个分片的开始和最后一个分片的结束), 否则是UTC的ISO时间字符串.
+    hits是规划时统计的命中数.
+    """
+    __slots__ = ['begin', 'end', 'hits']
+
+    def __init__(self, begin: Optional[str], end: Optional[str], hits: int):
+        self.begin = begin
+        self.end = end
+        self.hits = hits
+
+    def __repr__(self):
+        return f"QueryShard({self.begin!r}, {self.end!r}, hits={self.hits})"
+
+
+class ShardPlan(object):
+    """
+    规划结果: 按时间顺序排列的分片
+
+    Args:
+        shards: 分片, 首尾相接覆盖整个查询窗口
+        total_hits: 窗口内的命中总数
+        interval_ms: 统计时使用的date_histogram间隔, 没有拆分时为None
+    """
+    def __init__(self, shards: List[QueryShard], total_hits: int, interval_ms: Optional[int] = None):
+        self.shards = shards
+        self.total_hits = total_hits
+        self.interval_ms = interval_ms
+
+    def __len__(self):
+        return len(self.shards)
+
+
+def _iso(epoch_ms: int) -> str:
+    return datetime.fromtimestamp(epoch_ms / 1000, tz=timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+def _is_timestamp_range(clause: Dict[str, Any]) -> bool:
+    return '@timestamp' in clause.get('range', {})
+
+def shard_must_clause(must_clause: List[Dict[str, Any]], shard: QueryShard) -> List[Dict[str, Any]]:
+    """把must_clause中的@timestamp范围收窄到分片的范围"""
+    if shard.begin is None and shard.end is None:
+        return must_clause
+
+    bounds: Dict[str, Any] = {}
+    result = []
+    for clause in must_clause:
+        if _is_timestamp_range(clause):
+            bounds = dict(clause['range']['@timestamp'])
+        else:
+            result.append(clause)
+
+    if shard.begin is not None:
+        bounds.pop('gt', None)
+        bounds['gte'] = shard.begin
+    if shard.end is not None:
+        bounds.pop('lte', None)
+        bounds['lt'] = shard.end
+    result.append({"range": {"@timestamp": bounds}})
+    return result
+
+def pack_buckets(buckets: List[Tuple[int, int]], budget: int) -> List[QueryShard]:
+    """
+    把按时间排序的(桶开始时间毫秒, 命中数)依次装进分片, 每个分片的命中数不超过budget
+
+    单个桶超过budget时独占一个分片. 第一个分片的开始和最后一个分片的结束为None(沿用原查询的边界).
+    """
+    shards: List[QueryShard] = []
+    begin: Optional[int] = None
+    hits = 0
+    for key, count in buckets:
+        if hits and hits + count > budget:
+            shards.append(QueryShard(None if begin is None else _iso(begin), _iso(key), hits))
+            begin = key
+            hits = 0
+        hits += count
+    shards.append(QueryShard(None if begin is None else _iso(begin), None, hits))
+    return shards
+
+def _count_request(must_clause: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "query": {"bool": {"must": must_clause}},
+        "size": 0,
+        "track_total_hits": True,
+        "aggs": {
+            "first": {"min": {"field": "@timestamp"}},
+            "last": {"max": {"field": "@timestamp"}},
+        }
+    }
+
+def _histogram_interval(res_json: Dict[str, Any], budget: int, max_buckets: int) -> Tuple[int, Optional[int]]:
+    """根据计数请求的结果返回 (命中总数, date_histogram的间隔毫秒数), 不需要拆分时间隔为None"""
+    total = res_json['hits']['total']['value']
+    first = res_json.get('aggregations', {}).get('first', {}).get('value')
+    last = res_json.get('aggregations', {}).get('last', {}).get('value')
+
+    if total <= budget or first is None or last is None or last <= first:
+        return total, None
+
+    # 桶数为分片数的若干倍, 分片才能装得比较满
+    buckets_wanted = min(max_buckets, math.ceil(total / budget) * 8)
+    return total, max(1, math.ceil((last - first) / buckets_wanted))
+
+def _histogram_request(must_clause: List[Dict[str, Any]], interval_ms: int) -> Dict[str, Any]:
+    return {
+        "query": {"bool": {"must": must_clause}},
+        "size": 0,
+        "aggs": {
+            "hits": {
+                "date_histogram": {"field": "@timestamp", "fixed_interval": f"{interval_ms}ms", "min_doc_count": 1}
+            }
+        }
+    }
+
+def _histogram_plan(res_json: Dict[str, Any], total: int, budget: int, interval_ms: int) -> ShardPlan:
+    buckets = [(int(bucket['key']), bucket['doc_count']) for bucket in res_json['aggregations']['hits']['buckets']]
+    shards = pack_buckets(buckets, budget)
+    instrument.count('plan.shards', len(shards))
+    return ShardPlan(shards, total, interval_ms)
+
+def _single_shard_plan(total: int) -> ShardPlan:
+    instrument.count('plan.shards')
+    return ShardPlan([QueryShard(None, None, total)], total)
+
+def plan_shards(server: 'KongmingELKServer',
+                must_clause: List[Dict[str, Any]],
+                budget: int = DEFAULT_SHARD_HITS,
+                env: Optional['KongmingEnvironmentType'] = None,
+                cancel: Optional[threading.Event] = None,
+                max_buckets: int = MAX_BUCKETS) -> ShardPlan:
+    """
+    统计查询的命中数, 把时间窗口拆成命中数不超过budget的分片
+
+    第一次请求只要命中总数和最早/最晚的时间(size=0), 总数不超过budget时不拆分;
+    否则再用date_histogram按时间统计, 按桶装入分片. 两次请求都不返回文档.
+    """
+    with instrument.span('plan.count'):
+        res_json = server._search(_count_request(must_clause), env=env, cancel=cancel)
+    total, interval_ms = _histogram_interval(res_json, budget, max_buckets)
+    if interval_ms is None:
+        return _single_shard_plan(total)
+
+    with instrument.span('plan.histogram'):
+        res_json = server._search(_histogram_request(must_clause, interval_ms), env=env, cancel=cancel)
+    return _histogram_plan(res_json, total, budget, interval_ms)
+
+async def plan_shards_async(server: 'AsyncKongmingELKServer',
+                            must_clause: List[Dict[str, Any]],
+                            budget: int = DEFAULT_SHARD_HITS,
+                            env: Optional['KongmingEnvironmentType'] = None,
+                            max_buckets: int = MAX_BUCKETS) -> ShardPlan:
+    """与plan_shards相同, 用于AsyncKongmingELKServer"""
+    with instrument.span('plan.count'):
+        res_json = await server._search(_count_request(must_clause), env=env)
+    total, interval_ms = _histogram_interval(res_json, budget, max_buckets)
+    if interval_ms is None:
+        return _single_shard_plan(total)
+
+    with instrument.span('plan.histogram'):
+        res_json = await server._search(_histogram_request(must_clause, interval_ms), env=env)
+    return _histogram_plan(res_json, total, budget, interval_ms)
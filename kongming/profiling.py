@@ -0,0 +1,294 @@
+import cProfile
+import contextlib
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+from . import instrument
+
+# KONGMING_PROFILE=1或sample: 采样; cprofile: 确定性profile; 未设置或0: 不profile
+# KONGMING_PROFILE_INTERVAL: 采样间隔(秒)
+# KONGMING_PROFILE_DIR: 没有输出文件时(例如GUI查询), profile结果写到这个目录
+PROFILE_MODES = ['sample', 'cprofile']
+
+DEFAULT_INTERVAL = 0.005
+
+DEFAULT_DIR = 'logs'
+
+Frame = Tuple[str, str, int] # (函数名, 文件, 行号)
+
+
+def profile_mode(mode: Optional[str] = None) -> Optional[str]:
+    """
+    解析profile模式, mode为None时读取KONGMING_PROFILE
+
+    Returns:
+        'sample', 'cprofile', 或None表示不profile
+    """
+    if mode is None:
+        mode = os.environ.get('KONGMING_PROFILE', '')
+    mode = mode.strip().lower()
+    if mode in ['', '0', 'off', 'false', 'no']:
+        return None
+    if mode in ['1', 'on', 'true', 'yes']:
+        return 'sample'
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"unknown profile mode: {mode}, expected one of {PROFILE_MODES}")
+    return mode
+
+def profile_base(output: Optional[str] = None, name: str = 'profile') -> str:
+    """
+    profile结果的文件名前缀
+
+    有输出文件时放在输出文件旁边: logs/uat-0815.xlsx, logs/uat-0815.csv.gz -> logs/uat-0815.profile;
+    否则为 KONGMING_PROFILE_DIR/{name}-时间.profile
+    """
+    if output:
+        root, ext = os.path.splitext(output)
+        if ext.lower() in ['.gz', '.bz2', '.xz']:
+            root = os.path.splitext(root)[0]
+        return root + '.profile'
+    directory = os.environ.get('KONGMING_PROFILE_DIR', DEFAULT_DIR)
+    return os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.profile")
+
+
+class _Sampler(object):
+    """
+    在后台线程中定时采样目标线程的调用栈
+
+    纯python实现, 不需要额外的依赖; 采样线程需要拿到GIL才能采样, 所以实际间隔会比interval略长,
+    每个样本的权重使用实际经过的时间. thread_id为None时采样除自身以外的所有线程,
+    每个线程的样本各自计入经过的时间.
+    """
+    def __init__(self, thread_id: Optional[int], interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Dict[Tuple[Frame, ...], float] = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='kongming-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        last = time.perf_counter()
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            if self.thread_id is not None:
+                if self.thread_id not in frames:
+                    break
+                frames = {self.thread_id: frames[self.thread_id]}
+            for thread_id, frame in frames.items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                key = tuple(stack)
+                self.stacks[key] = self.stacks.get(key, 0.0) + (now - last)
+                self.samples += 1
+            last = now
+
+
+class Profiler(object):
+    """
+    在一段代码外运行profiler, 结束时把结果写到base开头的文件中
+
+    sample模式(采样, 开销小, 适合完整的查询):
+        {base}.folded            collapsed stacks, 可以用flamegraph.pl / speedscope打开
+        {base}.speedscope.json   speedscope格式, 直接拖到 https://www.speedscope.app
+        {base}.txt               按函数汇总的自身/累计耗时
+    cprofile模式(确定性, 每次函数调用都记录, 会明显拖慢transform_record这类热点):
+        {base}.prof              pstats格式, 可以用snakeviz等工具打开
+        {base}.txt               按累计耗时和自身耗时排序的函数列表
+
+    两种模式的{base}.txt末尾都附带instrument记录的各阶段耗时.
+    默认只profile调用start()的线程: GUI中在QueryWorker线程内使用.
+    all_threads=True时采样所有线程(例如命令行的并发任务), cprofile模式不支持.
+
+        with Profiler('logs/uat-0815.profile'):
+            records, rounds = server.query_dialogs(...)
+
+    Args:
+        base: 输出文件名前缀, 见profile_base()
+        mode: 'sample' 或 'cprofile'
+        interval: 采样间隔(秒)
+        top: 汇总中列出的函数个数
+        all_threads: 采样所有线程
+    """
+    def __init__(self, base: str, mode: str = 'sample', interval: float = DEFAULT_INTERVAL, top: int = 40, all_threads: bool = False):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"unknown profile mode: {mode}, expected one of {PROFILE_MODES}")
+        if all_threads and mode == 'cprofile':
+            raise ValueError("cprofile mode only profiles the calling thread")
+        self.base = base
+        self.mode = mode
+        self.interval = interval
+        self.top = top
+        self.all_threads = all_threads
+        self.files: List[str] = []
+        self._sampler: Optional[_Sampler] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._recorder: Optional[instrument.Instrumentation] = None
+
+    def __enter__(self) -> 'Profiler':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        self._recorder = instrument.current()
+        self.started = time.perf_counter()
+        if self.mode == 'sample':
+            self._sampler = _Sampler(None if self.all_threads else threading.get_ident(), self.interval)
+            self._sampler.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self) -> List[str]:
+        """停止profile并写出结果, 返回写出的文件"""
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        self.elapsed = time.perf_counter() - self.started
+
+        directory = os.path.dirname(self.base)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self._sampler is not None:
+            self.files = self._write_samples(self._sampler)
+        else:
+            self.files = self._write_pstats(self._profile)
+        self._sampler = None
+        self._profile = None
+        return self.files
+
+    def _write_samples(self, sampler: _Sampler) -> List[str]:
+        stacks = sampler.stacks
+
+        folded = f"{self.base}.folded"
+        with open(folded, 'w', encoding='utf-8') as f:
+            for stack, seconds in stacks.items():
+                # collapsed格式的计数为整数, 以毫秒计
+                f.write(f"{';'.join(_frame_name(frame) for frame in stack)} {max(1, round(seconds * 1000))}\n")
+
+        frame_index: Dict[Frame, int] = {}
+        samples = []
+        weights = []
+        for stack, seconds in stacks.items():
+            samples.append([frame_index.setdefault(frame, len(frame_index)) for frame in stack])
+            weights.append(seconds)
+        name = os.path.basename(self.base)
+        speedscope = f"{self.base}.speedscope.json"
+        with open(speedscope, 'w', encoding='utf-8') as f:
+            json.dump({
+                '$schema': 'https://www.speedscope.app/file-format-schema.json',
+                'name': name,
+                'exporter': 'kongming.profiling',
+                'activeProfileIndex': 0,
+                'shared': {'frames': [{'name': frame[0], 'file': frame[1], 'line': frame[2]} for frame in frame_index]},
+                'profiles': [{
+                    'type': 'sampled',
+                    'name': name,
+                    'unit': 'seconds',
+                    'startValue': 0,
+                    'endValue': sum(weights),
+                    'samples': samples,
+                    'weights': weights,
+                }],
+            }, f, ensure_ascii=False)
+
+        self_time: Dict[Frame, float] = {}
+        total_time: Dict[Frame, float] = {}
+        for stack, seconds in stacks.items():
+            self_time[stack[-1]] = self_time.get(stack[-1], 0.0) + seconds
+            # 递归的函数在一个栈中只计一次累计时间
+            for frame in set(stack):
+                total_time[frame] = total_time.get(frame, 0.0) + seconds
+        sampled = sum(stacks.values())
+
+        out = io.StringIO()
+        out.write(f"sampling profile: {self.elapsed:.3f}s wall, {sampler.samples} samples, interval {self.interval * 1000:.1f}ms\n\n")
+        for title, times in [('self', self_time), ('cumulative', total_time)]:
+            out.write(f"top {self.top} functions by {title} time:\n")
+            out.write(f"{'seconds':>10} {'%':>6}  function\n")
+            for frame, seconds in sorted(times.items(), key=lambda item: -item[1])[:self.top]:
+                out.write(f"{seconds:10.3f} {seconds / sampled * 100 if sampled else 0:6.1f}  {_frame_name(frame)}\n")
+            out.write("\n")
+        summary = self._write_summary(out.getvalue())
+        return [folded, speedscope, summary]
+
+    def _write_pstats(self, profile: cProfile.Profile) -> List[str]:
+        prof = f"{self.base}.prof"
+        profile.dump_stats(prof)
+
+        out = io.StringIO()
+        out.write(f"cProfile: {self.elapsed:.3f}s wall\n\n")
+        stats = pstats.Stats(profile, stream=out)
+        stats.strip_dirs()
+        for sort in [pstats.SortKey.CUMULATIVE, pstats.SortKey.TIME]:
+            stats.sort_stats(sort).print_stats(self.top)
+        summary = self._write_summary(out.getvalue())
+        return [prof, summary]
+
+    def _write_summary(self, text: str) -> str:
+        summary = f"{self.base}.txt"
+        with open(summary, 'w', encoding='utf-8') as f:
+            f.write(text)
+            if self._recorder is not None:
+                f.write("instrumentation:\n")
+                json.dump(self._recorder.report(), f, ensure_ascii=False, indent=2)
+                f.write("\n")
+        return summary
+
+
+def _frame_name(frame: Frame) -> str:
+    qualname, filename, line = frame
+    return f"{qualname} ({os.path.basename(filename)}:{line})"
+
+def profile(output: Optional[str] = None,
+            mode: Optional[str] = None,
+            name: str = 'profile',
+            interval: Optional[float] = None,
+            all_threads: bool = False):
+    """
+    按KONGMING_PROFILE(或mode参数)决定是否profile一段代码, 未开启时什么都不做
+
+        with profile('logs/uat-0815-2000.xlsx') as profiler:
+            ...
+        if profiler: print(profiler.files)
+
+    Args:
+        output: 这次运行的输出文件, profile结果写在它旁边; None时写到KONGMING_PROFILE_DIR
+        mode: 'sample' / 'cprofile', None时读取环境变量
+        name: 没有输出文件时的文件名前缀
+        interval: 采样间隔(秒), None时读取KONGMING_PROFILE_INTERVAL
+        all_threads: 采样所有线程, 见Profiler
+    """
+    mode = profile_mode(mode)
+    if mode is None:
+        return contextlib.nullcontext()
+    if interval is None:
+        interval = float(os.environ.get('KONGMING_PROFILE_INTERVAL', DEFAULT_INTERVAL))
+    return Profiler(profile_base(output, name), mode=mode, interval=interval, all_threads=all_threads and mode == 'sample')
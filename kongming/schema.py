@@ -0,0 +1,197 @@
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+from .constants import CLEAN_CONTEXT_MAGIC_STRING
+from .model import DialogRound
+from .utils import calculate_time_difference
+
+# getter的签名: (round, nlp_round, llm_round) -> 值, 缺失时返回None
+ColumnGetter = Callable[[DialogRound, Any, Any], Any]
+
+_SOURCES = ['round', 'nlp', 'llm']
+
+class Column(object):
+    """
+    DialogRound表格中的一列
+
+    大多数列只需声明source和attr: 从round本身, round.nlp_round或round.llm_round上取
+    attr属性, 取不到(对象为None, 值为None或空字符串)时为None, 否则经convert转换.
+    需要组合多个字段的列直接提供getter.
+
+    Args:
+        key: 列的英文标识, 渲染器按key查找列
+        title: 列标题
+        type: 值类型(str, int, float, bool), 用于Parquet等有类型的输出
+        source: 'round', 'nlp' 或 'llm'
+        attr: 属性名
+        convert: 对非空值的转换函数
+        getter: 自定义取值函数, 提供时忽略source/attr/convert
+        width: Excel中的列宽, None表示使用默认列宽
+        tooltip: 内容较长, 在GUI中需要显示tooltip
+        dictionary: 取值重复率高, 在Parquet中使用字典编码
+    """
+    def __init__(self,
+                 key: str,
+                 title: str,
+                 type: type = str,
+                 source: str = 'round',
+                 attr: Optional[str] = None,
+                 convert: Optional[Callable[[Any], Any]] = None,
+                 getter: Optional[ColumnGetter] = None,
+                 width: Optional[float] = None,
+                 tooltip: bool = False,
+                 dictionary: bool = False):
+        if getter is None:
+            if source not in _SOURCES:
+                raise ValueError(f"unknown column source '{source}', expect one of {_SOURCES}")
+            getter = Column._attr_getter(source, attr or key, convert)
+
+        self.key = key
+        self.title = title
+        self.type = type
+        self.getter = getter
+        self.width = width
+        self.tooltip = tooltip
+        self.dictionary = dictionary
+
+    def __repr__(self):
+        return f'Column({self.key!r}, {self.title!r})'
+
+    @staticmethod
+    def _attr_getter(source: str, attr: str, convert: Optional[Callable[[Any], Any]]) -> ColumnGetter:
+        pos = _SOURCES.index(source)
+
+        if convert is None:
+            def getter(*objs):
+                obj = objs[pos]
+                if obj is None:
+                    return None
+                value = getattr(obj, attr)
+                return None if value == "" else value
+        else:
+            def getter(*objs):
+                obj = objs[pos]
+                if obj is None:
+                    return None
+                value = getattr(obj, attr)
+                return None if value is None or value == "" else convert(value)
+
+        return getter
+
+
+class RoundSchema(object):
+    """
+    一组有序的列, 编译成一个行提取函数
+
+    extract(round)对每个round只取一次nlp_round/llm_round, 然后依次调用各列的getter,
+    返回一个tuple. 所有渲染器(Excel, 导出器, 控制台, GUI)都通过它取值,
+    因此每行的取值逻辑只有一份, 结果也可以整体缓存.
+    """
+    def __init__(self, columns: Sequence[Column]):
+        self.columns: List[Column] = list(columns)
+        self.keys: List[str] = [c.key for c in self.columns]
+        self.titles: List[str] = [c.title for c in self.columns]
+        self._positions = {key: pos for pos, key in enumerate(self.keys)}
+        self.extract: Callable[[DialogRound], Tuple] = self._compile()
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def _compile(self):
+        getters = tuple(c.getter for c in self.columns)
+
+        def extract(round: DialogRound) -> Tuple:
+            nlp = round.nlp_round
+            llm = round.llm_round
+            return tuple([getter(round, nlp, llm) for getter in getters])
+
+        return extract
+
+    def index(self, key: str) -> int:
+        """返回key对应列的位置"""
+        return self._positions[key]
+
+    def column(self, key: str) -> Column:
+        return self.columns[self._positions[key]]
+
+    def subset(self, keys: Iterable[str]) -> 'RoundSchema':
+        """按keys的顺序选出部分列, 组成新的schema"""
+        return RoundSchema([self.column(key) for key in keys])
+
+    def extract_rows(self, rounds: Iterable[DialogRound]) -> List[Tuple]:
+        extract = self.extract
+        return [extract(round) for round in rounds]
+
+    def extract_columns(self, rounds: Iterable[DialogRound]) -> List[List]:
+        """按列取值, 返回每列一个list, 便于按列批量处理(例如写Parquet)"""
+        rows = self.extract_rows(rounds)
+        if not rows:
+            return [[] for _ in self.columns]
+        return [list(values) for values in zip(*rows)]
+
+
+def _int_or_raw(value):
+    """转换为int; 不是数字时保留原值, 个别异常数据不影响整行的输出"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+def _nlu_query(round, nlp, llm):
+    if nlp is None:
+        return None
+    return nlp.query if nlp.query != CLEAN_CONTEXT_MAGIC_STRING else "<清除上下文>"
+
+def _latency(obj):
+    if obj is None or not obj.request_timestamp or not obj.response_timestamp:
+        return None
+    return calculate_time_difference(obj.request_timestamp, obj.response_timestamp)
+
+def _llm_files(round, nlp, llm):
+    if llm is None or not llm.files:
+        return None
+    return '\n'.join([file.ossUrl for file in llm.files if file.ossUrl])
+
+
+DIALOG_ROUND_SCHEMA = RoundSchema([
+    Column('timestamp', "时间戳", source='nlp', attr='request_timestamp', width=19),
+    Column('trace_id', "trace_id", attr='traceId', width=28),
+    Column('glass_product', "眼镜类型", int, attr='glassProduct', convert=_int_or_raw, dictionary=True),
+    Column('location', "位置", attr='location', convert=str, width=16),
+    Column('origin_type', "originType", int, attr='originType'),
+    Column('function_type', "functionType", int, attr='functionType'),
+    Column('locale', "locale", attr='local', dictionary=True),
+    Column('time_zone', "时区", attr='timeZone', dictionary=True),
+    Column('nlu_language', "语种", attr='nluLanguage', dictionary=True),
+    Column('session_first', "首轮", bool, attr='sessionFirstFlag', width=12),
+
+    Column('nlu_query', "NLU查询", getter=_nlu_query, width=30, tooltip=True),
+    Column('nlu_intent', "NLU意图", source='nlp', attr='intent', convert=str, width=25, dictionary=True),
+    Column('nlu_utterance', "NLU回答", source='nlp', attr='utterance', convert=str, width=30, tooltip=True),
+    Column('nlu_error', "NLU Error", source='nlp', attr='error', convert=str),
+    Column('nlu_latency', "NLU耗时", float, getter=lambda round, nlp, llm: _latency(nlp)),
+    Column('llm_query', "LLM查询", source='llm', attr='query', width=30, tooltip=True),
+    Column('llm_intent', "LLM意图", source='llm', attr='intent_name', dictionary=True),
+    Column('channel_type', "LLM场景", int, source='llm', attr='channel_type'),        # channel_type flag
+    Column('files', "图像文件", getter=_llm_files, width=30, tooltip=True),
+    Column('play_status', "角色扮演", int, source='llm', attr='play_status'),
+    Column('use_deepseek', "深度思考", int, source='llm', attr='use_deepseek'),
+    Column('use_search', "深度搜索", int, source='llm', attr='use_search'),
+    Column('visual_aids_status', "视觉辅助", int, source='llm', attr='visual_aids_status'),
+    Column('clean_context', "清上下文", int, source='llm', attr='clean_context'),     # clean_context flag
+    Column('llm_answer', "LLM回答", source='llm', attr='answer', width=30, tooltip=True),
+    Column('llm_reason', "LLM思考", source='llm', attr='reason'),
+    Column('thoughts_data', "LLM搜索数据", source='llm', attr='thoughts_data', convert=lambda x: str(x) if x else None),
+    Column('base_status', "LLM状态", int, source='llm', attr='base_status'),
+    Column('llm_latency', "LLM耗时", float, getter=lambda round, nlp, llm: _latency(llm)),
+
+    Column('device_id', "deviceId", attr='deviceId', width=28, dictionary=True),
+    Column('glass_device_id', "glassDeviceId", attr='glassDeviceId', width=28, dictionary=True),
+    Column('iot_device_id', 'iotDeviceId', attr='iotDeviceId', width=28, dictionary=True),
+    Column('account_id', "accountId", attr='accountId', width=10, dictionary=True),
+    Column('xj_account_id', "xjAccountId", attr='xjAccountId', width=25, dictionary=True),
+    Column('session_id', 'sessionId', attr='sessionId', width=28, dictionary=True),
+    Column('msg_id', 'msgId', attr='msgId', width=32),
+])
@@ -0,0 +1,204 @@
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Set
+
+from .constants import CLEAN_CONTEXT_MAGIC_STRING
+from .model import DialogRound
+from .utils import timestamp_to_epoch
+
+def _epoch(timestamp_str: Optional[str]) -> Optional[float]:
+    if not timestamp_str:
+        return None
+    try:
+        return timestamp_to_epoch(timestamp_str)
+    except ValueError:
+        return None
+
+def clears_context(round: DialogRound) -> bool:
+    """round是否是清除上下文的动作: 大模型请求带clean_context, 或NLP请求是清除上下文的特殊字符串"""
+    if round.llm_round is not None and round.llm_round.clean_context:
+        return True
+    return round.nlp_round is not None and round.nlp_round.query == CLEAN_CONTEXT_MAGIC_STRING
+
+
+class SessionTurn(object):
+    """
+    会话中的一轮对话
+
+    turn和context在round加入会话时计算, 之后如果有更早的round插入会重新编号.
+    """
+    __slots__ = ['round', 'epoch', 'turn', 'gap', 'context', 'clears_context']
+
+    def __init__(self, round: DialogRound, epoch: float):
+        self.round = round
+        self.epoch = epoch
+        self.turn = 0                        # 会话中的轮次, 从1开始
+        self.gap: Optional[float] = None     # 与上一轮相隔的秒数, 第一轮为None
+        self.context = 0                     # 所在上下文的序号, 从1开始, 每次清除上下文之后加1
+        self.clears_context = clears_context(round)
+
+
+class Session(object):
+    """
+    一个sessionId下按时间排序的所有对话轮次
+
+    Args:
+        session_id: 会话ID
+    """
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.turns: List[SessionTurn] = []
+        self._epochs: List[float] = []
+
+    def __len__(self):
+        return len(self.turns)
+
+    @property
+    def rounds(self) -> List[DialogRound]:
+        return [turn.round for turn in self.turns]
+
+    @property
+    def start(self) -> float:
+        return self._epochs[0]
+
+    @property
+    def end(self) -> float:
+        return self._epochs[-1]
+
+    @property
+    def duration(self) -> float:
+        return self._epochs[-1] - self._epochs[0]
+
+    @property
+    def context_clears(self) -> int:
+        return sum(1 for turn in self.turns if turn.clears_context)
+
+    @property
+    def max_gap(self) -> float:
+        return max((turn.gap for turn in self.turns if turn.gap is not None), default=0.0)
+
+    def add(self, turn: SessionTurn):
+        """
+        加入一轮对话并重新编号其后的轮次
+
+        轮次基本按时间顺序到达, 此时只需要计算新加入的一轮.
+        """
+        pos = bisect_right(self._epochs, turn.epoch)
+        self._epochs.insert(pos, turn.epoch)
+        self.turns.insert(pos, turn)
+        self._renumber(pos)
+
+    def _renumber(self, pos: int):
+        turns = self.turns
+        if pos == 0:
+            prev = None
+            context = 1
+        else:
+            prev = turns[pos - 1]
+            context = prev.context + 1 if prev.clears_context else prev.context
+
+        for turn in turns[pos:]:
+            turn.turn = prev.turn + 1 if prev is not None else 1
+            turn.gap = turn.epoch - prev.epoch if prev is not None else None
+            turn.context = context
+            if turn.clears_context:
+                context += 1
+            prev = turn
+
+    def context_turns(self, context: Optional[int] = None) -> List[SessionTurn]:
+        """
+        某个上下文中的轮次
+
+        Args:
+            context: 上下文序号, None表示最后一个上下文(即大模型当前能看到的对话)
+        """
+        if not self.turns:
+            return []
+        if context is None:
+            context = self.turns[-1].context
+        return [turn for turn in self.turns if turn.context == context]
+
+
+class SessionIndex(object):
+    """
+    按sessionId把对话轮次串成会话
+
+    round可以分批增量加入(例如在组装round的同时), 每个会话内按时间排序并计算轮次, 间隔和上下文.
+    按traceId查找所在会话是一次dict查找, 查询一个会话的开销只与会话本身的大小有关.
+    没有sessionId或时间戳无法解析的round不会加入索引.
+    """
+    def __init__(self):
+        self._sessions: Dict[str, Session] = {}
+        self._turns: Dict[str, SessionTurn] = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str):
+        return session_id in self._sessions
+
+    def clear(self):
+        self._sessions.clear()
+        self._turns.clear()
+
+    def add_rounds(self, rounds: Iterable[DialogRound]) -> Set[str]:
+        """加入一批round, 返回受影响的sessionId"""
+        touched = set()
+        for round in rounds:
+            if not round.sessionId or round.traceId in self._turns:
+                continue
+            epoch = _epoch(round.timestamp)
+            if epoch is None:
+                continue
+            session = self._sessions.get(round.sessionId)
+            if session is None:
+                session = self._sessions[round.sessionId] = Session(round.sessionId)
+            turn = SessionTurn(round, epoch)
+            session.add(turn)
+            self._turns[round.traceId] = turn
+            touched.add(round.sessionId)
+        return touched
+
+    def session(self, session_id: str) -> Optional[Session]:
+        return self._sessions.get(session_id)
+
+    def turn(self, trace_id: str) -> Optional[SessionTurn]:
+        """traceId对应的轮次"""
+        return self._turns.get(trace_id)
+
+    def session_of(self, round: DialogRound) -> Optional[Session]:
+        """round所在的会话"""
+        if round.traceId not in self._turns:
+            return None
+        return self._sessions.get(round.sessionId)
+
+    def sessions(self,
+                 min_turns: int = 1,
+                 since: Optional[float] = None,
+                 until: Optional[float] = None,
+                 min_gap: Optional[float] = None,
+                 clears_context: Optional[bool] = None) -> List[Session]:
+        """
+        按条件查询会话, 结果按开始时间排序
+
+        Args:
+            min_turns: 最少轮数
+            since: 会话在这个Unix时间之后(含)仍有对话
+            until: 会话在这个Unix时间之前开始
+            min_gap: 存在两轮之间间隔不少于min_gap秒
+            clears_context: True只返回清除过上下文的会话, False只返回没有清除过的, None不限
+        """
+        result = []
+        for session in self._sessions.values():
+            if len(session) < min_turns:
+                continue
+            if since is not None and session.end < since:
+                continue
+            if until is not None and session.start >= until:
+                continue
+            if min_gap is not None and session.max_gap < min_gap:
+                continue
+            if clears_context is not None and (session.context_clears > 0) != clears_context:
+                continue
+            result.append(session)
+        result.sort(key=lambda session: session.start)
+        return result
@@ -0,0 +1,168 @@
+from bisect import bisect_right
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from .model import DialogRound
+from .utils import timestamp_to_epoch
+
+# 统计的时间粒度(秒)
+STATS_INTERVALS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+# 耗时直方图的分箱上界(秒): 第i个箱为 [LATENCY_BINS[i-1], LATENCY_BINS[i]), 最后一个箱为 >= LATENCY_BINS[-1]
+LATENCY_BINS = [0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0]
+
+def latency_bin_labels() -> List[str]:
+    """各分箱的标题, 例如 <0.25s, 0.25-0.5s, >=32s"""
+    labels = [f"<{LATENCY_BINS[0]:g}s"]
+    labels += [f"{low:g}-{high:g}s" for low, high in zip(LATENCY_BINS, LATENCY_BINS[1:])]
+    labels.append(f">={LATENCY_BINS[-1]:g}s")
+    return labels
+
+def _epoch(timestamp_str: Optional[str]) -> Optional[float]:
+    if not timestamp_str:
+        return None
+    try:
+        return timestamp_to_epoch(timestamp_str)
+    except ValueError:
+        return None
+
+def _latency(obj) -> Optional[float]:
+    if obj is None:
+        return None
+    begin, end = _epoch(obj.request_timestamp), _epoch(obj.response_timestamp)
+    if begin is None or end is None:
+        return None
+    return abs(end - begin)
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """
+    已排序数据的p分位数(0 <= p <= 100), 相邻两个值之间线性插值; 没有数据时返回None
+    """
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * p / 100
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+
+class BucketSummary(NamedTuple):
+    start: float                 # 时间段开始的Unix时间
+    count: int                   # 对话轮数
+    nlu_p50: Optional[float]
+    nlu_p95: Optional[float]
+    nlu_p99: Optional[float]
+    llm_count: int               # 有大模型请求的轮数
+    llm_p50: Optional[float]
+    llm_p95: Optional[float]
+    llm_p99: Optional[float]
+    nlu_error_rate: float        # NLP响应中带有NLPError的比例
+    llm_error_rate: float        # 大模型请求中base_status不是2(最终结果)的比例
+    nlu_histogram: Tuple[int, ...]  # NLU耗时落在各分箱(LATENCY_BINS)的轮数
+    llm_histogram: Tuple[int, ...]
+
+
+class TimeBucket(object):
+    """一个时间段内的累计数据, 耗时保存原始值, 计算分位数时再排序; 直方图在加入时累计"""
+    __slots__ = ['start', 'count', 'nlu_errors', 'llm_count', 'llm_errors', 'nlu_latencies', 'llm_latencies',
+                 'nlu_histogram', 'llm_histogram', '_summary']
+
+    def __init__(self, start: float):
+        self.start = start
+        self.count = 0
+        self.nlu_errors = 0
+        self.llm_count = 0
+        self.llm_errors = 0
+        self.nlu_latencies: List[float] = []
+        self.llm_latencies: List[float] = []
+        self.nlu_histogram = [0] * (len(LATENCY_BINS) + 1)
+        self.llm_histogram = [0] * (len(LATENCY_BINS) + 1)
+        self._summary: Optional[BucketSummary] = None
+
+    def add(self, round: DialogRound):
+        self._summary = None
+        self.count += 1
+
+        nlp = round.nlp_round
+        if nlp is not None:
+            if nlp.error is not None:
+                self.nlu_errors += 1
+            latency = _latency(nlp)
+            if latency is not None:
+                self.nlu_latencies.append(latency)
+                self.nlu_histogram[bisect_right(LATENCY_BINS, latency)] += 1
+
+        llm = round.llm_round
+        if llm is not None:
+            self.llm_count += 1
+            if llm.base_status != 2:
+                self.llm_errors += 1
+            latency = _latency(llm)
+            if latency is not None:
+                self.llm_latencies.append(latency)
+                self.llm_histogram[bisect_right(LATENCY_BINS, latency)] += 1
+
+    def summary(self) -> BucketSummary:
+        if self._summary is None:
+            # 数据基本按时间顺序到达, 原地排序近似线性
+            self.nlu_latencies.sort()
+            self.llm_latencies.sort()
+            nlu, llm = self.nlu_latencies, self.llm_latencies
+            self._summary = BucketSummary(
+                start=self.start,
+                count=self.count,
+                nlu_p50=percentile(nlu, 50),
+                nlu_p95=percentile(nlu, 95),
+                nlu_p99=percentile(nlu, 99),
+                llm_count=self.llm_count,
+                llm_p50=percentile(llm, 50),
+                llm_p95=percentile(llm, 95),
+                llm_p99=percentile(llm, 99),
+                nlu_error_rate=self.nlu_errors / self.count if self.count else 0.0,
+                llm_error_rate=self.llm_errors / self.llm_count if self.llm_count else 0.0,
+                nlu_histogram=tuple(self.nlu_histogram),
+                llm_histogram=tuple(self.llm_histogram),
+            )
+        return self._summary
+
+
+class RoundStats(object):
+    """
+    按时间段统计对话轮数, NLU/LLM耗时分位数, 耗时直方图和错误率
+
+    数据可以增量追加, 每次只有新数据落入的时间段需要重新计算分位数.
+    没有使用numpy: 分桶只是对Unix时间做整除, 每轮对话的开销是一次时间戳解析.
+
+    Args:
+        interval: 时间段长度(秒), 例如STATS_INTERVALS['minute']
+        utc_offset: 时区偏移(秒), 按天统计时时间段从当地时间的0点开始
+    """
+    def __init__(self, interval: int = STATS_INTERVALS['minute'], utc_offset: float = 0):
+        self.interval = interval
+        self.utc_offset = utc_offset
+        self.buckets: Dict[float, TimeBucket] = {}
+        self.total = TimeBucket(0)
+
+    def add_rounds(self, rounds: Iterable[DialogRound]) -> Set[float]:
+        """加入一批round, 返回受影响的时间段开始时间"""
+        interval, offset = self.interval, self.utc_offset
+        touched = set()
+        for round in rounds:
+            epoch = _epoch(round.timestamp)
+            if epoch is None:
+                continue
+            start = epoch - (epoch + offset) % interval
+            bucket = self.buckets.get(start)
+            if bucket is None:
+                bucket = self.buckets[start] = TimeBucket(start)
+            bucket.add(round)
+            self.total.add(round)
+            touched.add(start)
+        return touched
+
+    def summaries(self) -> List[BucketSummary]:
+        """按时间顺序返回每个时间段的统计"""
+        return [self.buckets[start].summary() for start in sorted(self.buckets)]
@@ -0,0 +1,403 @@
+import gzip
+import heapq
+import json
+import random
+import time
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .constants import CLEAN_CONTEXT_MAGIC_STRING
+from .utils import timestamp_to_epoch
+
+# 组装round需要的central-manager字段, 与KongmingELKServer._dialog_must_clause一致
+DIALOG_FIELDS = ["central-nlp-request", "central-nlp-response", "central-answer-request", "central-answer-response"]
+
+_QUERIES = [
+    "今天天气怎么样", "明天北京会下雨吗", "帮我拍张照片", "这是什么花", "给妈妈打电话", "播放周杰伦的歌",
+    "导航到最近的加油站", "提醒我下午三点开会", "翻译一下这段话", "讲个笑话", "现在几点了", "声音大一点",
+    "附近有什么好吃的", "帮我识别一下这个菜单", "今天的新闻有哪些", "打开录像", "我刚才说了什么", "这个多少钱",
+]
+
+_INTENTS = [
+    ("weather", "query"), ("camera", "take_photo"), ("phonecall", "call"), ("music", "play"),
+    ("navigation", "route"), ("reminder", "create"), ("translate", "translate"), ("system", "volume_up"),
+    ("chat", "llm"), ("vision", "recognize"),
+]
+
+# 生成回答用的语料, 按偏移截取任意长度
+_CORPUS = ("根据最新的信息，今天天气晴朗，最高气温二十六度，最低气温十七度，东南风三级。"
+           "建议您外出时注意防晒，适当增减衣物。这朵花是月季，蔷薇科蔷薇属植物，花期较长。"
+           "附近一公里内有三家餐厅，评分最高的是一家川菜馆，人均消费约八十元。"
+           "好的，已经为您设置了下午三点的会议提醒。这段话的意思是：欢迎来到我们的城市。") * 4
+
+_DOMAINS = ["weather", "music", "phonecall", "camera", "navigation", "chat", "vision", "system"]
+
+_GLASS_PRODUCTS = ['1001', '1002', '1003', '1004', '1005', '5001', '5002']
+
+def _timestamp(epoch: float) -> str:
+    """Unix时间 -> ELK的UTC时间戳字符串, 例如 2025-08-18T20:06:10.149Z"""
+    millis = int(epoch * 1000)
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(millis // 1000)) + f'.{millis % 1000:03d}Z'
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+class SyntheticLogGenerator(object):
+    """
+    生成与ELK中格式一致的kongming日志记录(未经transform_record处理的hit)
+
+    每个trace模拟一次完整的请求: asr-server识别, api-server收发, central-manager的合规/NLP/大模型/提示问题,
+    cc-talk和nlp-intent-prejudge/arbitrator的NLU过程, xr_llms_service_qa和domain-service-cc-qa的大模型过程.
+    message使用transform_record会剥离的前缀/后缀格式, 包括 ,---headers 和嵌套一层的json.
+
+    记录按@timestamp升序产生, 不同trace在时间上交错, 与ELK按时间排序的查询结果一致.
+    生成是流式的, 内存占用只与同时进行中的trace数量有关, 可以生成上百万条记录.
+
+    Args:
+        traces: trace数量
+        seed: 随机种子, 相同参数和种子生成相同的数据
+        start: 第一个trace的时间
+        rate: 平均每秒开始的trace数
+        devices: 设备数量, 同一设备的连续请求属于同一个会话
+        fanout: 每个trace的中间记录(asr中间结果, brpc调用, 流式输出)数量的倍数
+        answer_chars: 大模型回答的平均字数
+        llm_ratio: 进入大模型的trace比例, 其余只有NLU结果
+        clean_context_ratio: 大模型请求前先清除上下文的比例
+        error_ratio: NLP错误和大模型失败(base_status不是2)的比例
+        noise_ratio: 每条正常记录之外产生噪声记录(ping帧, 健康检查, _jsonparsefailure等)的概率
+        extra_fields: 是否带上ELK中的log/fields/input等字段(transform_record会删除它们)
+        env: 索引名中的环境
+    """
+    def __init__(self,
+                 traces: int = 1000,
+                 seed: int = 0,
+                 start: str = '2025-08-18T00:00:00.000Z',
+                 rate: float = 5.0,
+                 devices: int = 200,
+                 fanout: float = 1.0,
+                 answer_chars: int = 120,
+                 llm_ratio: float = 0.6,
+                 clean_context_ratio: float = 0.05,
+                 error_ratio: float = 0.02,
+                 noise_ratio: float = 0.05,
+                 extra_fields: bool = True,
+                 env: str = 'uat'):
+        self.traces = traces
+        self.seed = seed
+        self.start = timestamp_to_epoch(start)
+        self.rate = rate
+        self.devices = devices
+        self.fanout = fanout
+        self.answer_chars = answer_chars
+        self.llm_ratio = llm_ratio
+        self.clean_context_ratio = clean_context_ratio
+        self.error_ratio = error_ratio
+        self.noise_ratio = noise_ratio
+        self.extra_fields = extra_fields
+        self.env = env
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self.hits()
+
+    def hits(self) -> Iterator[Dict[str, Any]]:
+        """按@timestamp升序产生所有记录"""
+        rng = random.Random(self.seed)
+        pending: List[Tuple[float, int, Dict[str, Any]]] = []
+        sessions: Dict[int, List] = {} # device -> [sessionId, 轮数, 上次请求时间]
+        seq = 0
+        epoch = self.start
+
+        for trace in range(self.traces):
+            epoch += rng.expovariate(self.rate)
+            # 比当前trace开始时间早的记录不会再有更早的记录插入, 可以输出
+            while pending and pending[0][0] <= epoch:
+                yield heapq.heappop(pending)[2]
+            for offset, hit in self._trace(rng, trace, epoch, sessions):
+                heapq.heappush(pending, (epoch + offset, seq, hit))
+                seq += 1
+
+        while pending:
+            yield heapq.heappop(pending)[2]
+
+    def pages(self, pagesize: int = 1000) -> Iterator[Dict[str, Any]]:
+        """按页产生ELK _search响应; 流式生成时总数未知, hits.total为截至本页的累计记录数"""
+        page: List[Dict[str, Any]] = []
+        fetched = 0
+        for hit in self.hits():
+            page.append(hit)
+            if len(page) >= pagesize:
+                fetched += len(page)
+                yield search_response(page, fetched)
+                page = []
+        if page:
+            yield search_response(page, fetched + len(page))
+
+    # ------------------------------------------------------------------
+    # 单个trace
+
+    def _count(self, rng: random.Random, base: int) -> int:
+        return max(1, int(round(base * self.fanout * rng.uniform(0.5, 1.5))))
+
+    def _text(self, rng: random.Random, chars: int) -> str:
+        chars = max(1, min(chars, len(_CORPUS)))
+        offset = rng.randrange(len(_CORPUS) - chars + 1)
+        return _CORPUS[offset:offset + chars]
+
+    def _hit(self, rng: random.Random, epoch: float, laname: Optional[str], trace_id: Optional[str], message: Optional[str], **fields) -> Dict[str, Any]:
+        timestamp = _timestamp(epoch)
+        src: Dict[str, Any] = {'@timestamp': timestamp, 'ltime': timestamp}
+        if laname is not None:
+            src['laname'] = laname
+        if trace_id is not None:
+            src['traceId'] = trace_id
+        if message is not None:
+            src['message'] = message
+        src.update(fields)
+        if self.extra_fields:
+            src['level'] = 'INFO'
+            src['lenv'] = self.env
+            src['lnode'] = f'node-{rng.randrange(8)}'
+            src['log'] = {'file': {'path': f'/var/log/{laname or "app"}/app.log'}, 'offset': rng.getrandbits(30)}
+            src['input'] = {'type': 'log'}
+            src['fields'] = {'app': laname or 'unknown', 'env': self.env}
+            src['type'] = 'kongming'
+        return {
+            '_index': f'{self.env}-kongming-{timestamp[:10].replace("-", ".")}',
+            '_id': '%020x' % rng.getrandbits(80),
+            '_score': None,
+            '_ignored': ['message.keyword'],
+            'sort': [int(epoch * 1000)],
+            '_source': src,
+        }
+
+    def _session(self, rng: random.Random, device: int, epoch: float, sessions: Dict[int, List]) -> Tuple[str, bool]:
+        state = sessions.get(device)
+        # 超过5分钟没有请求时开始新的会话
+        if state is None or epoch - state[2] > 300:
+            state = sessions[device] = ['%032x' % rng.getrandbits(128), 0, epoch]
+        state[1] += 1
+        state[2] = epoch
+        return state[0], state[1] == 1
+
+    def _trace(self, rng: random.Random, trace: int, epoch: float, sessions: Dict[int, List]) -> List[Tuple[float, Dict[str, Any]]]:
+        """生成一个trace的所有记录, 返回 (相对trace开始的秒数, hit)"""
+        records: List[Tuple[float, Dict[str, Any]]] = []
+
+        def add(offset, *args, **kwargs):
+            records.append((offset, self._hit(rng, epoch + offset, *args, **kwargs)))
+            if rng.random() < self.noise_ratio:
+                records.append((offset, self._noise(rng, epoch + offset)))
+
+        bits = rng.getrandbits(128)
+        trace_id = f'{bits >> 96:08X}-{bits >> 80 & 0xFFFF:04X}-{bits >> 64 & 0xFFFF:04X}-{bits >> 48 & 0xFFFF:04X}-{bits & 0xFFFFFFFFFFFF:012X}'
+        request_id = '%032x' % rng.getrandbits(128)
+        device = rng.randrange(self.devices)
+        session_id, first = self._session(rng, device, epoch, sessions)
+        query = rng.choice(_QUERIES)
+        namespace, name = rng.choice(_INTENTS)
+        use_llm = namespace in ('chat', 'vision') or rng.random() < self.llm_ratio
+        nlp_error = rng.random() < self.error_ratio
+        clean_context = use_llm and rng.random() < self.clean_context_ratio
+
+        metadata = {
+            'terminalTraceId': trace_id,
+            'sessionId': session_id,
+            'msgId': '%016x' % rng.getrandbits(64),
+            'sessionFirstFlag': first,
+            'deviceId': f'{device:012x}',
+            'glassDeviceId': f'{device * 7919 % (1 << 48):012x}',
+            'iotDeviceId': '%064x' % (device * 2654435761),
+            'accountId': str(100000 + device),
+            'glassProduct': _GLASS_PRODUCTS[device % len(_GLASS_PRODUCTS)],
+            'originType': 0 if rng.random() < 0.8 else 1,
+            'functionType': 0 if rng.random() < 0.9 else 2,
+            'longitude': round(116.3 + device % 50 / 100 + rng.random() / 1000, 6),
+            'latitude': round(39.8 + device % 30 / 100 + rng.random() / 1000, 6),
+            'local': 'zh_CN',
+            'timeZone': 'Asia/Shanghai',
+            'nluLanguage': 'zh',
+        }
+
+        # asr-server: 开始识别, 中间结果, 最终结果
+        add(0.0, 'asr-server', None, _dumps({'requestId': request_id, 'event': 'asr_start'}),
+            **{'asr-recognize-start': _dumps({'requestId': request_id, 'sampleRate': 16000})})
+        partials = self._count(rng, 3)
+        for i in range(partials):
+            add(0.1 + i * 0.15, 'asr-server', None, _dumps({'requestId': request_id, 'event': 'asr_result_success', 'text': query[:len(query) * (i + 1) // (partials + 1)]}))
+        offset = 0.15 + partials * 0.15
+        add(offset, 'asr-server', None, 'asr-result:' + _dumps({'requestId': request_id, 'text': query, 'final': True}),
+            **{'asr-recognize-result': _dumps({'requestId': request_id, 'text': query})})
+        add(offset + 0.01, None, trace_id, 'speech client onMessage received: ' + _dumps({'traceId': trace_id, 'type': 'asr', 'text': query}),
+            modules='speech-client:onMessage')
+
+        # api-server收到请求, 带有,---headers
+        offset += 0.05
+        headers = {'x-trace-id': trace_id, 'x-device-id': metadata['deviceId'], 'user-agent': 'glass/3.2.1'}
+        add(offset, 'api-server', trace_id, 'received client request text: ' + _dumps({'q': query, 'traceId': trace_id}) + ',---headers' + repr(headers),
+            **{'api-server-request': _dumps({'header': {'traceId': trace_id}, 'payload': {'q': query}, 'metadata': metadata})})
+
+        # central-manager: 收到请求, 合规检查, NLP请求
+        offset += 0.03
+        add(offset, 'central-manager', trace_id, 'receive request:' + _dumps({'q': query, 'metadata': metadata}))
+        add(offset + 0.01, 'central-manager', trace_id, '合规文本请求' + _dumps({'text': query, 'traceId': trace_id}))
+        # 合规文本响应是嵌套了一层的json字符串
+        add(offset + 0.05, 'central-manager', trace_id, '合规文本响应' + _dumps(_dumps({'code': 0, 'pass': True, 'traceId': trace_id})) + ',耗时:' + str(rng.randint(10, 80)))
+        offset += 0.07
+        nlp_request = {'payload': {'q': query}, 'metadata': metadata}
+        add(offset, 'central-manager', trace_id, 'post  body ' + _dumps(nlp_request) + ',url:http://cc-talk.svc.cluster.local/nlp',
+            **{'central-nlp-request': _dumps(nlp_request)})
+
+        # NLU: cc-talk, 预判, 仲裁
+        add(offset + 0.01, 'cc-talk', trace_id, _dumps({'cc-talk': {'title': 'new request', 'traceId': trace_id}}))
+        add(offset + 0.02, 'nlp-intent-prejudge', trace_id, f'begin ml prejudge, query={query}')
+        domains = rng.sample(_DOMAINS, 2)
+        add(offset + 0.06, 'nlp-intent-prejudge', trace_id, f'domain judge strategy result: modelSelectedDomains={domains}, ruleSelectedDomains=[]')
+        calls = self._count(rng, 2)
+        for i in range(calls):
+            instance = rng.choice(domains) + '-service'
+            add(offset + 0.07 + i * 0.04, 'cc-talk', trace_id, _dumps({'cc-talk': {'brpc': 'request', 'instance': instance, 'method_name': 'Parse'}}))
+            add(offset + 0.09 + i * 0.04, 'cc-talk', trace_id, _dumps({'cc-talk': {'brpc': 'response', 'instance': instance, 'latency_ms': rng.randint(5, 60)}}))
+        offset += 0.1 + calls * 0.04
+        add(offset, 'nlp-intent-arbitrator', trace_id, f'arbitrator model result domain={namespace}, score={rng.random():.4f}')
+        add(offset + 0.01, 'cc-talk', trace_id, 'AppendDebugInfo ' + _dumps({'domain': namespace, 'intent': name}))
+        add(offset + 0.02, 'cc-talk', trace_id, _dumps({'cc-talk': {'title': 'return response', 'traceId': trace_id}}))
+
+        if nlp_error:
+            nlp_payload = {'code': rng.choice([500, 504]), 'errorMsg': 'nlu service timeout'}
+        else:
+            nlp_payload = {'utterance': {'id': '', 'screen': '', 'speech': self._text(rng, 20)}, 'isNextRecorded': False, 'isSoundOpened': True}
+        nlp_response = {'payload': {'header': {'namespace': namespace, 'name': name}, 'payload': nlp_payload}}
+        offset += 0.04
+        add(offset, 'central-manager', trace_id, ' nlp _result:' + _dumps(nlp_response) + ' 耗时:' + str(rng.randint(50, 400)),
+            **{'central-nlp-response': _dumps(nlp_response)})
+
+        if use_llm:
+            if clean_context:
+                # 同一个traceId的第二个NLP请求用于清除上下文, 组装round时会被忽略
+                clear_request = {'payload': {'q': CLEAN_CONTEXT_MAGIC_STRING}, 'metadata': metadata}
+                add(offset + 0.01, 'central-manager', trace_id, 'post  body ' + _dumps(clear_request),
+                    **{'central-nlp-request': _dumps(clear_request)})
+                add(offset + 0.03, 'central-manager', trace_id, ' nlp _result:' + _dumps({'payload': {'header': {'namespace': 'system', 'name': 'clean_context'}, 'payload': {}}}),
+                    **{'central-nlp-response': _dumps({'payload': {'header': {'namespace': 'system', 'name': 'clean_context'}, 'payload': {}}})})
+            offset = self._llm(rng, add, offset + 0.05, trace_id, query, clean_context)
+
+        # 提示问题
+        hinter_request = {'traceId': trace_id, 'query': query, 'count': 3}
+        add(offset + 0.02, 'central-manager', trace_id, 'hinter request params:' + _dumps(hinter_request),
+            **{'central-hinter-request': _dumps(hinter_request)})
+        add(offset + 0.3, 'central-manager', trace_id, None,
+            **{'central-hinter-response': _dumps({'hints': [rng.choice(_QUERIES) for _ in range(3)]})})
+
+        # 偶尔有可见即可说
+        if rng.random() < 0.05:
+            add(offset + 0.05, None, trace_id, 'say visible v2 start, request:' + _dumps({'traceId': trace_id, 'texts': rng.sample(_QUERIES, 3)}))
+
+        add(offset + 0.35, 'api-server', trace_id, None,
+            **{'api-server-response': _dumps({'header': {'traceId': trace_id, 'namespace': namespace, 'name': name}, 'payload': nlp_payload})})
+        return records
+
+    def _llm(self, rng: random.Random, add, offset: float, trace_id: str, query: str, clean_context: bool) -> float:
+        """大模型请求/流式响应, 返回结束时间"""
+        failed = rng.random() < self.error_ratio
+        answer = self._text(rng, max(1, int(rng.gauss(self.answer_chars, self.answer_chars / 3))))
+        files = None
+        if rng.random() < 0.2:
+            name = '%016x' % rng.getrandbits(64)
+            files = [{'ossUrl': f'https://kongming-oss.example.com/images/{name}.jpg', 'resourceName': f'{name}.jpg',
+                      'resourceOssName': f'images/{name}.jpg', 'resourceSize': str(rng.randint(50000, 900000)), 'resourceType': 'image'}]
+        answer_request = {
+            'query': query, 'raw_query': query, 'channel_type': 1, 'clean_context': 1 if clean_context else 0,
+            'intent_name': 'chat', 'files': files, 'play_status': 1, 'use_deepseek': int(rng.random() < 0.3),
+            'use_search': int(rng.random() < 0.2), 'visual_aids_status': 0, 'traceId': trace_id,
+        }
+        add(offset, 'central-manager', trace_id, 'answer request params:' + _dumps(answer_request),
+            **{'central-answer-request': _dumps(answer_request)})
+
+        add(offset + 0.01, 'xr_llms_service_qa', trace_id, _dumps({'trace_id': trace_id, 'modules': 'server.py:answer',
+                                                                    'msg': 'Get request: ' + repr({'answer request, query': query, 'trace_id': trace_id})}))
+        add(offset + 0.02, 'xr_llms_service_qa', trace_id, _dumps({'trace_id': trace_id, 'modules': 'prompt.py:build',
+                                                                    'msg': 'system_prompt: 你是一个智能眼镜助手, 回答要简洁. ' + self._text(rng, 200)}))
+        add(offset + 0.03, 'domain-service-cc-qa', trace_id, _dumps({'trace_id': trace_id, 'modules': 'predict.py:predict',
+                                                                      'msg': 'Starting _predict_with_model, query=' + query}))
+        add(offset + 0.08, 'domain-service-cc-qa', trace_id, _dumps({'trace_id': trace_id, 'modules': 'predict.py:predict',
+                                                                      'msg': 'pre_subtopic: ' + rng.choice(_DOMAINS)}))
+
+        latency = rng.uniform(0.8, 3.0)
+        add(offset + 0.1, 'central-manager', trace_id, 'answer 连接成功, traceId:' + trace_id)
+        chunks = 1 if failed else self._count(rng, 5)
+        for i in range(chunks):
+            at = offset + 0.1 + latency * (i + 1) / (chunks + 1)
+            partial = answer[:len(answer) * (i + 1) // (chunks + 1)]
+            # 流式输出不是合法的python字面量, transform_record会保留原字符串
+            add(at, 'xr_llms_service_qa', trace_id, _dumps({'trace_id': trace_id, 'modules': 'stream.py:yield',
+                                                             'msg': f"stream chunk {i}: {{'base_status': 1, 'answer': '{partial}'}}"}))
+            add(at + 0.005, 'central-manager', trace_id, 'answers  response:' + _dumps({'base_status': 1, 'answer': partial, 'type': 'stream'}))
+
+        offset += 0.15 + latency
+        base_status = rng.choice([-1, 3]) if failed else 2
+        payload: Dict[str, Any] = {'answer': '' if failed else answer, 'base_status': base_status}
+        if answer_request['use_deepseek']:
+            payload['reason'] = {'answer': self._text(rng, self.answer_chars * 2), 'reasoning_latency': rng.randint(500, 5000)}
+        if answer_request['use_search']:
+            payload['thoughts_data'] = [{'title': rng.choice(_QUERIES), 'url': f'https://search.example.com/{rng.getrandbits(32):x}'} for _ in range(3)]
+        add(offset - 0.01, 'xr_llms_service_qa', trace_id, _dumps({'trace_id': trace_id, 'modules': 'server.py:answer',
+                                                                    'msg': 'response: ' + repr({'Final answer': payload['answer'], 'base_status': base_status})}))
+        add(offset, 'central-manager', trace_id, 'answers  response:' + _dumps({'base_status': base_status, 'answer': payload['answer'], 'type': 'final'}) + ', latency=' + str(int(latency * 1000)),
+            **{'central-answer-response': _dumps({'header': {'traceId': trace_id}, 'payload': payload})})
+        add(offset + 0.02, 'xr_llms_service_qa', trace_id, _dumps({'trace_id': trace_id, 'modules': 'utils.py:save_profile_to_redis:88',
+                                                                    'msg': 'save profile to redis succeed! profile info: ' + repr({'trace_id': trace_id, 'turns': rng.randint(1, 20)})}))
+        return offset
+
+    def _noise(self, rng: random.Random, epoch: float) -> Dict[str, Any]:
+        """KongmingLogAnalyzer.shall_ignore会忽略的记录"""
+        kind = rng.randrange(4)
+        if kind == 0:
+            return self._hit(rng, epoch, 'api-server', '-', 'try to send  ping frame')
+        if kind == 1:
+            return self._hit(rng, epoch, 'central-manager', '-', 'healthExamination')
+        if kind == 2:
+            return self._hit(rng, epoch, 'api-server', '-', f'Duplicate contact data for device: {rng.getrandbits(48):012x}')
+        hit = self._hit(rng, epoch, 'central-manager', '-', '{"payload": {"q": "truncated')
+        hit['_source']['tags'] = ['_jsonparsefailure']
+        return hit
+
+
+def search_response(hits: List[Dict[str, Any]], total: int, took: int = 5) -> Dict[str, Any]:
+    """把一页记录包装成ELK _search的响应格式"""
+    return {
+        'took': took,
+        'timed_out': False,
+        '_shards': {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0},
+        'hits': {
+            'total': {'value': total, 'relation': 'eq'},
+            'max_score': None,
+            'hits': hits,
+        },
+    }
+
+def write_jsonl(hits: Iterable[Dict[str, Any]], filename: str) -> int:
+    """每行一条记录写入文件, 文件名以.gz结尾时gzip压缩; 返回记录数"""
+    opener = gzip.open if filename.endswith('.gz') else open
+    count = 0
+    with opener(filename, 'wt', encoding='utf-8') as f:
+        for hit in hits:
+            f.write(_dumps(hit))
+            f.write('\n')
+            count += 1
+    return count
+
+def read_jsonl(filename: str) -> Iterator[Dict[str, Any]]:
+    """逐行读取write_jsonl写出的文件"""
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def dialog_hits(hits: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """只保留query_dialogs会查到的记录(带有central-manager的NLP/大模型字段)"""
+    for hit in hits:
+        src = hit['_source']
+        if any(field in src for field in DIALOG_FIELDS):
+            yield hit
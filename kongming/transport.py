@@ -0,0 +1,156 @@
+import random
+
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+from pydantic import BaseModel
+
+# 这些响应可以重试: 限流和网关/服务端的临时错误
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# ELK的index.max_result_window默认值: from + size不能超过它, 更多的结果只能用search_after翻页
+MAX_RESULT_WINDOW = 10000
+
+
+class TransportConfig(BaseModel):
+    """
+    ELK查询的翻页和重试参数
+
+    页大小从调用方给的pagesize开始, 之后根据已取回页的 每条记录的耗时 和 每条记录的字节数
+    调整到 target_seconds / target_bytes 以内, 每次最多扩大growth倍; 超时的页减半重试.
+    """
+    min_pagesize: int = 10
+    max_pagesize: int = 2000
+    target_seconds: float = 2.0           # 每页期望的响应时间
+    target_bytes: int = 4 * 1024 * 1024   # 每页期望的响应大小
+    growth: float = 2.0
+    timeout: float = 20.0                 # 每个请求的超时(秒)
+    retries: int = 5                      # 每页最多重试次数
+    backoff_base: float = 0.5             # 第n次重试前最多等待 backoff_base * 2^n 秒
+    backoff_max: float = 30.0
+
+
+class TransportError(Exception):
+    """
+    一页在重试之后仍然失败
+
+    cursor是失败时的翻页位置, 传回_iter_query_pages(cursor=...)可以从这一页继续, 不会重新取回之前的页.
+    """
+    def __init__(self, message: str, cursor: Optional['PageCursor'] = None, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.cursor = cursor
+        self.status_code = status_code
+
+
+def retry_delay(config: TransportConfig, attempt: int, response: Optional[httpx.Response] = None, rng: random.Random = random) -> float:
+    """
+    第attempt次(从0开始)重试前等待的秒数
+
+    full jitter: 在[0, min(backoff_max, backoff_base * 2^attempt)]中随机取值, 避免多个客户端同时重试;
+    响应带Retry-After时至少等待这么久.
+    """
+    delay = rng.uniform(0, min(config.backoff_max, config.backoff_base * 2 ** attempt))
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), config.backoff_max))
+            except ValueError:
+                pass
+    return delay
+
+
+class PageSizer(object):
+    """
+    根据已取回页的耗时和大小决定下一页取多少条
+
+    每条记录的耗时和字节数用指数滑动平均估计, 下一页的条数使两者都不超过目标.
+    请求本身的固定开销也摊到每条记录上, 所以小页会被估计得偏慢, 页大小逐步增大到目标附近.
+    """
+    def __init__(self, config: TransportConfig, initial: int):
+        self.config = config
+        self.size = max(config.min_pagesize, min(config.max_pagesize, initial))
+        self.seconds_per_hit: Optional[float] = None
+        self.bytes_per_hit: Optional[float] = None
+
+    def observe(self, hits: int, seconds: float, nbytes: int, alpha: float = 0.5):
+        """记录一页的结果并计算下一页的大小"""
+        if hits <= 0:
+            return
+        seconds_per_hit = seconds / hits
+        bytes_per_hit = nbytes / hits
+        if self.seconds_per_hit is None:
+            self.seconds_per_hit = seconds_per_hit
+            self.bytes_per_hit = bytes_per_hit
+        else:
+            self.seconds_per_hit += alpha * (seconds_per_hit - self.seconds_per_hit)
+            self.bytes_per_hit += alpha * (bytes_per_hit - self.bytes_per_hit)
+
+        config = self.config
+        ideal = min(config.target_seconds / max(self.seconds_per_hit, 1e-6),
+                    config.target_bytes / max(self.bytes_per_hit, 1.0))
+        size = min(int(ideal), int(self.size * config.growth))
+        self.size = max(config.min_pagesize, min(config.max_pagesize, size))
+
+    def shrink(self):
+        """页超时, 下一次请求减半"""
+        self.size = max(self.config.min_pagesize, self.size // 2)
+
+    def next_size(self, remaining: int) -> int:
+        return max(1, min(self.size, remaining))
+
+
+class PageCursor(object):
+    """
+    search_after翻页的位置
+
+    请求按@timestamp排序, 同一毫秒的记录可能被页边界切开. 下一页从最后一条的时间戳前1毫秒开始,
+    这一毫秒中已经取回的记录(按_id)会再返回一次, 所以页大小加上它们的条数, 再丢弃这些重复的记录.
+    请求的每一页至少包含一条新记录, 同一毫秒的记录再多也不会漏掉或重复.
+    """
+    def __init__(self):
+        self.search_after: Optional[List[Any]] = None
+        self.boundary_ids: Set[str] = set()
+        self.fetched = 0
+        self.hits_total: Optional[int] = None
+
+    def request_body(self, request_body: Dict[str, Any], size: int) -> Dict[str, Any]:
+        """
+        请求下一页的查询, size是需要的新记录条数
+        """
+        body = dict(request_body)
+        body.pop('from', None)
+        if self.search_after is not None:
+            first = self.search_after[0]
+            if isinstance(first, (int, float)):
+                body['search_after'] = [first - 1] + list(self.search_after[1:])
+                size += len(self.boundary_ids)
+            else:
+                body['search_after'] = list(self.search_after)
+        body['size'] = size
+        return body
+
+    def advance(self, records: List[Dict[str, Any]], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        根据一页原始记录(transform_record之前, 需要其中的sort)移动位置, 返回其中新的记录, 最多limit条
+
+        返回空列表表示没有更多的记录.
+        """
+        if self.search_after is not None and records:
+            first = records[0].get('sort')
+            if first is not None and first < self.search_after:
+                # 服务端没有按search_after返回, 继续翻页只会重复取回同样的记录
+                raise TransportError(f"search_after was not applied by the server: got {first} after {self.search_after}", self)
+        new = [r for r in records if r.get('_id') not in self.boundary_ids] if self.search_after is not None else records
+        if limit is not None:
+            new = new[:limit]
+        if new:
+            last = new[-1].get('sort')
+            if last is None:
+                raise TransportError("search_after paging requires the sort values of the hits")
+            if self.search_after is None or last != self.search_after:
+                self.boundary_ids = set()
+            self.search_after = last
+            self.boundary_ids.update(r.get('_id') for r in new if r.get('sort') == last)
+        self.fetched += len(new)
+        return new
@@ -0,0 +1,121 @@
+import csv
+import os
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from .model import DialogRound
+from .schema import Column, RoundSchema
+
+# 按优先级排列的ID类型及其在DialogRound上的属性名
+USER_ID_TYPES = ['iotDeviceId', 'deviceId', 'glassDeviceId', 'accountId', 'xjAccountId']
+
+USER_COLUMN_TITLE = "使用者"
+
+# (id_type, id)
+UserKey = Tuple[str, str]
+
+class UserResolver(object):
+    """
+    根据设备/账号ID查找使用者
+
+    映射文件是 id_type,id,user 格式的CSV(例如device_user_map.csv). 每种ID类型一个dict,
+    查找时按USER_ID_TYPES的优先级依次查找, 不需要为每个ID拼接字符串key.
+
+    reload_if_changed()根据文件的修改时间判断是否需要重新加载, 并返回映射发生变化的
+    (id_type, id), 调用方可以只重新计算受影响的行.
+
+    Args:
+        filename: 映射文件, 为None或文件不存在时所有查找结果为空
+        load: 是否立即加载映射文件
+    """
+    def __init__(self, filename: Optional[str] = None, load: bool = True):
+        self.filename = filename
+        self.mtime: Optional[float] = None
+        self._maps: Dict[str, Dict[str, str]] = {id_type: {} for id_type in USER_ID_TYPES}
+        self._lookups: List[Tuple[str, Dict[str, str]]] = []
+        if load:
+            self.reload()
+
+    def __len__(self):
+        return sum(len(m) for m in self._maps.values())
+
+    def _read(self) -> Dict[str, Dict[str, str]]:
+        maps: Dict[str, Dict[str, str]] = {id_type: {} for id_type in USER_ID_TYPES}
+        if self.filename is None or not os.path.exists(self.filename):
+            return maps
+        with open(self.filename, 'r', encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                id_type, id, user = row.get('id_type'), row.get('id'), row.get('user')
+                if id_type and id and user:
+                    maps.setdefault(id_type.strip(), {})[id.strip()] = user.strip()
+        return maps
+
+    def _file_mtime(self) -> Optional[float]:
+        if self.filename is None:
+            return None
+        try:
+            return os.stat(self.filename).st_mtime
+        except OSError:
+            return None
+
+    def reload(self) -> Set[UserKey]:
+        """
+        重新读取映射文件
+
+        Returns:
+            映射发生变化(新增, 删除或修改了使用者)的(id_type, id)集合
+        """
+        mtime = self._file_mtime()
+        maps = self._read()
+
+        changed: Set[UserKey] = set()
+        for id_type in set(self._maps) | set(maps):
+            old, new = self._maps.get(id_type, {}), maps.get(id_type, {})
+            for id in old.keys() | new.keys():
+                if old.get(id) != new.get(id):
+                    changed.add((id_type, id))
+
+        self._maps = maps
+        self._lookups = [(id_type, maps[id_type]) for id_type in USER_ID_TYPES]
+        self.mtime = mtime
+        return changed
+
+    def reload_if_changed(self) -> Optional[Set[UserKey]]:
+        """文件修改时间变化时重新加载, 返回变化的key; 文件没有变化时返回None"""
+        if self._file_mtime() == self.mtime:
+            return None
+        return self.reload()
+
+    def resolve(self, round: DialogRound) -> str:
+        """返回round的使用者, 找不到时返回空字符串"""
+        for id_type, users in self._lookups:
+            id = getattr(round, id_type)
+            if id:
+                user = users.get(id)
+                if user is not None:
+                    return user
+        return ""
+
+    @staticmethod
+    def affected(rounds: Iterable[DialogRound], changed: Set[UserKey]) -> List[int]:
+        """返回rounds中受changed影响的下标"""
+        if not changed:
+            return []
+        rows = []
+        for row, round in enumerate(rounds):
+            for id_type in USER_ID_TYPES:
+                id = getattr(round, id_type)
+                if id and (id_type, id) in changed:
+                    rows.append(row)
+                    break
+        return rows
+
+    def column(self, key: str = 'user', title: str = USER_COLUMN_TITLE) -> Column:
+        """使用者列, 可以加入RoundSchema供导出器和控制台使用"""
+        return Column(key, title, getter=lambda round, nlp, llm: self.resolve(round) or None, width=12, dictionary=True)
+
+
+def with_user_column(schema: RoundSchema, users: Optional[UserResolver]) -> RoundSchema:
+    """在schema的第一列之前加入使用者列; users为None时原样返回schema"""
+    if users is None:
+        return schema
+    return RoundSchema([users.column()] + schema.columns)
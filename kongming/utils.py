@@ -47,3 +47,15 @@ def adjust_timestamp(timestamp_str, seconds):
     # .isoformat(timespec='milliseconds') 会生成 YYYY-MM-DDTHH:MM:SS.sss+00:00
     # 然后我们将其转换回Z格式
     return adjusted_dt.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+def timestamp_to_epoch(timestamp_str):
+    """
+    把UTC时间戳字符串转换为Unix时间(秒)
+
+    Args:
+        timestamp_str: UTC时间戳字符串，例如 "2025-08-18T20:06:10.149Z"
+
+    Returns:
+        float: 自1970-01-01 00:00:00 UTC起的秒数
+    """
+    return datetime.fromisoformat(timestamp_str.replace('Z', '+00:00')).timestamp()
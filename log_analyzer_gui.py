@@ -1,84 +1,323 @@
 import sys
-import requests
 import os
 import configparser
+import json
 import base64
-import csv
+import queue
+import threading
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
     QPushButton, QTableWidget, QTableWidgetItem, QComboBox, QDateTimeEdit,
     QHeaderView, QStatusBar, QMessageBox, QSizePolicy, QCheckBox, QStyle,
-    QTableView, QToolBar # Added for QStandardItemModel and QToolBar
+    QTableView, QToolBar, QProgressBar, QFileDialog, QProgressDialog, QSplitter, QTextBrowser
 )
-from PyQt6.QtGui import QFont, QIntValidator, QPixmap, QIcon, QStandardItem, QStandardItemModel # Added QStandardItem, QStandardItemModel
-from PyQt6.QtCore import QThread, pyqtSignal, QDateTime, Qt, QSortFilterProxyModel, QPoint, QModelIndex, QRect # Added QSortFilterProxyModel, QPoint, QModelIndex, QRect
+from PyQt6.QtGui import QFont, QIntValidator, QPixmap, QIcon, QImage, QColor, QPainter
+from PyQt6.QtCore import QObject, QThread, QTimer, pyqtSignal, QDateTime, Qt, QSortFilterProxyModel, QPoint, QModelIndex, QRect, QAbstractTableModel, QUrl # Added QSortFilterProxyModel, QPoint, QModelIndex, QRect
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict, Any, Optional, Tuple
 
 # Import existing kongming modules
 # Ensure these imports are correct based on the actual file structure and class names
 try:
-    from kongming.elk import KongmingELKServer, KongmingEnvironmentType
+    from kongming.elk import KongmingELKServer, KongmingEnvironmentType, QueryCancelled
+    from kongming.analyzer import KongmingLogAnalyzer
+    from kongming.stats import STATS_INTERVALS, BucketSummary, RoundStats, latency_bin_labels
+    from kongming.sessions import Session, SessionIndex
+    from kongming.instrument import Instrumentation, recording
+    from kongming.profiling import profile
+    from kongming.constants import CLEAN_CONTEXT_MAGIC_STRING
     from kongming.model import DialogLogFilter, DialogRound, ID_TYPE, NLPRound, LLMRound, Location, NLPIntent, NLPUtterance, NLPError, OssFile
-    from kongming.utils import calculate_time_difference, convert_timestamp
+    from kongming.schema import DIALOG_ROUND_SCHEMA
+    from kongming.users import USER_COLUMN_TITLE, UserResolver
+    from kongming.images import ImageCache
+    from kongming.export import ExportCancelled, available_formats, export_dialog_rounds
+    from kongming.filtering import FilterEngine, ColumnFilter, ValueSetFilter, RangeFilter, SubstringFilter, build_partial_index, count_values
 except ImportError as e:
     print(f"Error importing kongming modules: {e}")
     print("Please ensure your PYTHONPATH is correctly set or that you are running from the project root.")
     sys.exit(1)
 
-class ImageFetcher(QThread):
-    finished = pyqtSignal(QPixmap)
-    error = pyqtSignal(str)
+# GUI表格在DIALOG_ROUND_SCHEMA的各列之前增加"使用者"列, 部分列使用不同的标题
+GUI_TITLE_OVERRIDES = {'files': "照片"}
+GUI_HEADERS = [USER_COLUMN_TITLE] + [GUI_TITLE_OVERRIDES.get(c.key, c.title) for c in DIALOG_ROUND_SCHEMA]
+# GUI columns (offset by the user column) that support range filters
+NUMERIC_COLUMNS = {pos + 1 for pos, c in enumerate(DIALOG_ROUND_SCHEMA) if c.type in (int, float)}
+
+def format_display_timestamp(timestamp_str):
+    """Convert an ISO 8601 UTC timestamp to local time for display"""
+    if not timestamp_str:
+        return ""
+    # QDateTime.fromString can parse ISO 8601 directly
+    dt = QDateTime.fromString(timestamp_str, Qt.DateFormat.ISODate)
+    if dt.isValid():
+        # Convert to local time
+        return dt.toLocalTime().toString("yyyy-MM-dd HH:mm:ss")
+    return timestamp_str # Fallback if parsing fails
+
+class ImageService(QObject):
+    """
+    Loads the images of the 照片 column through a shared ImageCache
+
+    Downloads, decoding and downscaling run on the cache's worker threads;
+    only the QImage -> QPixmap conversion happens on the UI thread. Requests
+    for the same url are deduplicated, thumbnails of rows in view are kept in
+    a bounded LRU.
+    """
+    image_ready = pyqtSignal(str, QImage)     # (url, full image)
+    thumbnail_ready = pyqtSignal(str, QImage) # (url, downscaled image)
+    failed = pyqtSignal(str, str)             # (url, message)
+
+    THUMBNAIL_SIZE = 64
+    MAX_THUMBNAILS = 500
+
+    def __init__(self, cache: ImageCache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self._thumbnails: 'OrderedDict[str, QPixmap]' = OrderedDict()
+        self._pending_thumbnails = set()
+        self.thumbnail_ready.connect(self._store_thumbnail)
 
-    def __init__(self, url):
-        super().__init__()
-        self.url = url
+    def request_image(self, url: str):
+        """Load the full image, image_ready or failed is emitted when done"""
+        self.cache.fetch_async(url).add_done_callback(lambda future: self._decode(url, future))
 
-    def run(self):
+    def _decode(self, url, future):
         try:
-            response = requests.get(self.url, stream=True, timeout=10) # Add timeout
-            response.raise_for_status()
-            pixmap = QPixmap()
-            pixmap.loadFromData(response.content)
-            if pixmap.isNull():
-                self.error.emit(f"Failed to load image data from {self.url}")
-            else:
-                self.finished.emit(pixmap)
-        except requests.exceptions.RequestException as e:
-            self.error.emit(f"Network error fetching image from {self.url}: {e}")
+            image = QImage.fromData(future.result())
         except Exception as e:
-            self.error.emit(f"An unexpected error occurred fetching image from {self.url}: {e}")
+            self.failed.emit(url, f"Network error fetching image from {url}: {e}")
+            return
+        if image.isNull():
+            self.failed.emit(url, f"Failed to load image data from {url}")
+        else:
+            self.image_ready.emit(url, image)
+
+    def thumbnail(self, url: str) -> Optional[QPixmap]:
+        pixmap = self._thumbnails.get(url)
+        if pixmap is not None:
+            self._thumbnails.move_to_end(url)
+        return pixmap
+
+    def prefetch_thumbnails(self, urls):
+        """Download and downscale the images of the rows in view in the background"""
+        for url in urls:
+            if url in self._thumbnails or url in self._pending_thumbnails:
+                continue
+            self._pending_thumbnails.add(url)
+            self.cache.fetch_async(url).add_done_callback(lambda future, url=url: self._scale(url, future))
+
+    def _scale(self, url, future):
+        image = QImage()
+        try:
+            image = QImage.fromData(future.result())
+        except Exception:
+            pass
+        if not image.isNull():
+            image = image.scaled(self.THUMBNAIL_SIZE, self.THUMBNAIL_SIZE,
+                                 Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+        self.thumbnail_ready.emit(url, image)
+
+    def _store_thumbnail(self, url, image):
+        self._pending_thumbnails.discard(url)
+        if image.isNull():
+            return
+        self._thumbnails[url] = QPixmap.fromImage(image)
+        while len(self._thumbnails) > self.MAX_THUMBNAILS:
+            self._thumbnails.popitem(last=False)
 
 from PyQt6.QtWidgets import QDialog, QMenu
 from PyQt6.QtWebEngineWidgets import QWebEngineView
+from PyQt6.QtWebEngineCore import QWebEngineProfile, QWebEnginePage
+
+def format_tooltip(text):
+    """Format tooltip text with line breaks for long text"""
+    tooltip_text = str(text)
+    if len(tooltip_text) > 80:
+        # Insert line breaks every 80 characters at word boundaries
+        words = tooltip_text.split(' ')
+        lines = []
+        current_line = ''
+        for word in words:
+            if len(current_line + ' ' + word) <= 80:
+                current_line += (' ' + word) if current_line else word
+            else:
+                if current_line:
+                    lines.append(current_line)
+                current_line = word
+        if current_line:
+            lines.append(current_line)
+        tooltip_text = '\n'.join(lines)
+    return tooltip_text
+
+class DialogRoundTableModel(QAbstractTableModel):
+    """
+    Table model backed directly by the list of DialogRound
+
+    Nothing is created per cell: the schema row of a round is extracted the
+    first time one of its cells is requested and cached as a tuple of display
+    strings. Tooltips, icons and alignment are computed in data().
+    """
+    USER_COLUMN = 0
+
+    def __init__(self, user_name_func=None, parent=None):
+        super().__init__(parent)
+        self._rounds: List[DialogRound] = []
+        self.generation = 0 # bumped on every reset, lets dependent indexes notice a new result set
+        self._values: List[Optional[tuple]] = []  # cached DIALOG_ROUND_SCHEMA.extract() results
+        self._texts: List[Optional[tuple]] = []   # cached display texts, including the user column
+        self._user_name_func = user_name_func or (lambda round: "")
+
+        self._extract = DIALOG_ROUND_SCHEMA.extract
+        self._timestamp_col = DIALOG_ROUND_SCHEMA.index('timestamp') + 1
+        self._files_col = DIALOG_ROUND_SCHEMA.index('files') + 1
+        self._tooltip_cols = {pos + 1 for pos, column in enumerate(DIALOG_ROUND_SCHEMA) if column.tooltip}
+        self._file_icon = None
+        self.thumbnail_func = None # url -> Optional[QPixmap], thumbnails replace the file icon when loaded
+
+    @property
+    def files_column(self) -> int:
+        return self._files_col
+
+    def first_file(self, row: int) -> str:
+        """First image url of a row, empty if none"""
+        return self.text(row, self._files_col).split('\n')[0]
+
+    def files_changed(self, rows):
+        """Repaint the 照片 cells of rows whose thumbnail became available"""
+        for row in rows:
+            index = self.index(row, self._files_col)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rounds)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(GUI_HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole:
+            if orientation == Qt.Orientation.Horizontal:
+                return GUI_HEADERS[section] if 0 <= section < len(GUI_HEADERS) else None
+            return str(section + 1)
+        return None
+
+    def set_rounds(self, rounds: List[DialogRound]):
+        self.beginResetModel()
+        self.generation += 1
+        self._rounds = list(rounds)
+        self._values = [None] * len(self._rounds)
+        self._texts = [None] * len(self._rounds)
+        self.endResetModel()
+
+    def append_rounds(self, rounds: List[DialogRound]):
+        if not rounds:
+            return
+        first = len(self._rounds)
+        self.beginInsertRows(QModelIndex(), first, first + len(rounds) - 1)
+        self._rounds.extend(rounds)
+        self._values.extend([None] * len(rounds))
+        self._texts.extend([None] * len(rounds))
+        self.endInsertRows()
+
+    def rounds(self) -> List[DialogRound]:
+        return self._rounds
+
+    def round_at(self, row: int) -> DialogRound:
+        return self._rounds[row]
+
+    def values(self, row: int) -> tuple:
+        """Schema values of a row (without the user column), None for missing"""
+        values = self._values[row]
+        if values is None:
+            values = self._values[row] = self._extract(self._rounds[row])
+        return values
+
+    def value(self, row: int, column: int):
+        """Raw value of a model column, the user column returns the user name"""
+        if column == self.USER_COLUMN:
+            return self.texts(row)[0]
+        return self.values(row)[column - 1]
+
+    def compute_texts(self, round: DialogRound) -> tuple:
+        """
+        Display texts of a round, including the user column
 
-def create_standard_item(text, tooltip=None):
-    """Create a QStandardItem with text and optional tooltip"""
-    item = QStandardItem(str(text))
-    if tooltip:
-        # Format tooltip with line breaks for long text
-        tooltip_text = str(tooltip)
-        if len(tooltip_text) > 80:
-            # Insert line breaks every 80 characters at word boundaries
-            words = tooltip_text.split(' ')
-            lines = []
-            current_line = ''
-            for word in words:
-                if len(current_line + ' ' + word) <= 80:
-                    current_line += (' ' + word) if current_line else word
-                else:
-                    if current_line:
-                        lines.append(current_line)
-                    current_line = word
-            if current_line:
-                lines.append(current_line)
-            tooltip_text = '\n'.join(lines)
-        item.setToolTip(tooltip_text)
-    return item
-
-def create_item(text, tooltip=None):
-    """Alias for create_standard_item for backward compatibility"""
-    return create_standard_item(text, tooltip)
+        Does not touch the caches, so it can be called from a worker thread.
+        """
+        values = self._extract(round)
+        texts = [self._user_name_func(round)]
+        texts.extend("" if value is None else str(value) for value in values)
+        texts[self._timestamp_col] = format_display_timestamp(values[self._timestamp_col - 1])
+        return tuple(texts)
+
+    def texts(self, row: int) -> tuple:
+        texts = self._texts[row]
+        if texts is None:
+            texts = self._texts[row] = self.compute_texts(self._rounds[row])
+        return texts
+
+    def set_texts(self, generation: int, start_row: int, texts: List[tuple]):
+        """Install texts computed in a worker thread, ignored if the result set was reset meanwhile"""
+        if generation != self.generation:
+            return
+        cache = self._texts
+        for row, row_texts in enumerate(texts, start_row):
+            if cache[row] is None:
+                cache[row] = row_texts
+
+    def text(self, row: int, column: int) -> str:
+        return self.texts(row)[column]
+
+    def refresh_users(self, changed) -> Dict[int, str]:
+        """
+        Recompute the user column of the rows affected by changed user mapping keys
+
+        Args:
+            changed: (id_type, id) keys returned by UserResolver.reload()
+
+        Returns:
+            {row: new user name} of the affected rows
+        """
+        users = {}
+        for row in UserResolver.affected(self._rounds, changed):
+            user = users[row] = self._user_name_func(self._rounds[row])
+            texts = self._texts[row]
+            if texts is not None:
+                self._texts[row] = (user,) + texts[1:]
+        if users:
+            self.dataChanged.emit(self.index(min(users), self.USER_COLUMN), self.index(max(users), self.USER_COLUMN))
+        return users
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row, column = index.row(), index.column()
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == self._files_col:
+                return "" # Display empty text, tooltip is URL
+            return self.text(row, column)
+        elif role == Qt.ItemDataRole.ToolTipRole:
+            if column in self._tooltip_cols:
+                text = self.text(row, column)
+                return format_tooltip(text) if text else None
+        elif role == Qt.ItemDataRole.DecorationRole:
+            if column == self._files_col and self.text(row, column):
+                if self.thumbnail_func is not None:
+                    pixmap = self.thumbnail_func(self.first_file(row))
+                    if pixmap is not None:
+                        return pixmap
+                if self._file_icon is None:
+                    self._file_icon = QApplication.instance().style().standardIcon(QStyle.StandardPixmap.SP_FileIcon)
+                return self._file_icon
+        elif role == Qt.ItemDataRole.TextAlignmentRole:
+            if column == self._files_col:
+                return Qt.AlignmentFlag.AlignCenter
+
+        return None
 
 class ImagePreviewPopup(QDialog):
     # Class variable to remember dialog size
@@ -131,38 +370,73 @@ class ImagePreviewPopup(QDialog):
             )
             self.image_label.setPixmap(scaled_pixmap)
 
-class MapDialog(QDialog):
-    def __init__(self, location_text, parent=None):
+DEFAULT_MAP_SDK_URL = "https://webapi.amap.com/maps?v=1.4.15&key=b4eb7a9939ad6c7f2831079165ef51e8&plugin=AMap.MarkerClusterer"
+DEFAULT_MAP_CENTER = (116.4074, 39.9042) # Beijing
+
+def parse_location(location_text) -> Optional[Tuple[float, float]]:
+    """Parse a 位置 cell ("lng, lat") into (lng, lat), None if it is not a location"""
+    coords = location_text.split(',')
+    if len(coords) != 2:
+        return None
+    try:
+        return float(coords[0].strip()), float(coords[1].strip())
+    except ValueError:
+        return None
+
+class MapView(QDialog):
+    """
+    One map window reused for every 位置 double-click
+
+    The page and the AMap SDK are loaded once into a QWebEngineView with a
+    persistent profile, so the SDK and tiles come from the disk HTTP cache
+    after the first load. Points are pushed with runJavaScript and drawn with
+    MarkerClusterer. sdk_url and tile_url (an AMap.TileLayer url template
+    such as http://localhost:8080/{z}/{x}/{y}.png) can point at a local
+    tile server.
+    """
+    CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'kongming', 'webengine')
+
+    def __init__(self, sdk_url=DEFAULT_MAP_SDK_URL, tile_url="", parent=None):
         super().__init__(parent)
         self.setWindowTitle("Location Map")
-        self.setWindowFlags(Qt.WindowType.Dialog | Qt.WindowType.WindowStaysOnTopHint)
-        self.setWindowModality(Qt.WindowModality.ApplicationModal)
+        self.setWindowFlags(Qt.WindowType.Window)
         self.resize(800, 600)
-        
+
+        self.profile = QWebEngineProfile("kongming-map", self)
+        self.profile.setCachePath(os.path.join(self.CACHE_DIR, 'cache'))
+        self.profile.setPersistentStoragePath(os.path.join(self.CACHE_DIR, 'storage'))
+        self.profile.setHttpCacheType(QWebEngineProfile.HttpCacheType.DiskHttpCache)
+        self.profile.setHttpCacheMaximumSize(256 * 1024 * 1024)
+
+        self.web_view = QWebEngineView(self)
+        self.web_view.setPage(QWebEnginePage(self.profile, self.web_view))
+        self.web_view.loadFinished.connect(self._page_loaded)
+
         layout = QVBoxLayout()
-        
-        # Parse coordinates from location text (assuming format like "lat,lng")
-        try:
-            coords = location_text.split(',')
-            if len(coords) == 2:
-                lat = float(coords[1].strip())
-                lng = float(coords[0].strip())
-            else:
-                lat, lng = 39.9042, 116.4074  # Default to Beijing
-        except:
-            lat, lng = 39.9042, 116.4074  # Default to Beijing
-        
-        # Create WebView
-        web_view = QWebEngineView()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.web_view)
+        self.setLayout(layout)
 
-        # HTML content with Amap (高德地图)
-        html_content = f"""
+        self._loaded = False
+        self._pending_script = None
+        self.load(sdk_url, tile_url)
+
+    def load(self, sdk_url, tile_url=""):
+        """(Re)load the page, only needed when the SDK or tile urls change"""
+        self.sdk_url = sdk_url
+        self.tile_url = tile_url
+        self._loaded = False
+        self.web_view.setHtml(self._html(), QUrl("https://localhost/"))
+
+    def _html(self):
+        lng, lat = DEFAULT_MAP_CENTER
+        return f"""
         <!DOCTYPE html>
         <html>
         <head>
             <meta charset="utf-8">
             <title>Location Map</title>
-            <script src="https://webapi.amap.com/maps?v=1.4.15&key=b4eb7a9939ad6c7f2831079165ef51e8"></script>
+            <script src="{self.sdk_url}"></script>
             <style>
                 * {{ margin: 0; padding: 0; box-sizing: border-box; }}
                 html, body {{ width: 100%; height: 100%; overflow: hidden; }}
@@ -172,19 +446,32 @@ class MapDialog(QDialog):
         <body>
             <div id="mapContainer"></div>
             <script>
-                var map = new AMap.Map('mapContainer', {{
-                    zoom: 15,
-                    center: [{lng}, {lat}],
-                    resizeEnable: true
-                }});
-                
-                var marker = new AMap.Marker({{
-                    position: [{lng}, {lat}],
-                    title: 'Location: {location_text}'
-                }});
-                
-                map.add(marker);
-                
+                var tileUrl = {json.dumps(self.tile_url)};
+                var options = {{ zoom: 15, center: [{lng}, {lat}], resizeEnable: true }};
+                if (tileUrl) {{
+                    options.layers = [new AMap.TileLayer({{
+                        getTileUrl: function(x, y, z) {{
+                            return tileUrl.replace('{{x}}', x).replace('{{y}}', y).replace('{{z}}', z);
+                        }}
+                    }})];
+                }}
+                var map = new AMap.Map('mapContainer', options);
+                var cluster = null;
+
+                // points: [[lng, lat, title], ...], focus: index of the point to center on or -1
+                function showPoints(points, focus) {{
+                    if (cluster) {{ cluster.setMap(null); }}
+                    var markers = points.map(function(p) {{
+                        return new AMap.Marker({{ position: [p[0], p[1]], title: p[2] }});
+                    }});
+                    cluster = new AMap.MarkerClusterer(map, markers, {{ gridSize: 60 }});
+                    if (focus >= 0) {{
+                        map.setZoomAndCenter(15, [points[focus][0], points[focus][1]]);
+                    }} else if (markers.length) {{
+                        map.setFitView(markers);
+                    }}
+                }}
+
                 // Auto resize map when window resizes
                 window.addEventListener('resize', function() {{
                     map.getSize();
@@ -193,24 +480,67 @@ class MapDialog(QDialog):
         </body>
         </html>
         """
-        
-        web_view.setHtml(html_content)
-        layout.addWidget(web_view)
-        
-        self.setLayout(layout)
+
+    def _page_loaded(self, ok):
+        self._loaded = ok
+        if ok and self._pending_script:
+            self.web_view.page().runJavaScript(self._pending_script)
+            self._pending_script = None
+
+    def show_points(self, points: List[Tuple[float, float, str]], focus: int = -1):
+        """
+        Plot points on the map
+
+        Args:
+            points: (lng, lat, title) of every location to show
+            focus: index of the point to center on, -1 fits all points in view
+        """
+        script = f"showPoints({json.dumps(points, ensure_ascii=False)}, {focus});"
+        if self._loaded:
+            self.web_view.page().runJavaScript(script)
+        else:
+            self._pending_script = script
+        self.show()
+        self.raise_()
+        self.activateWindow()
 
 class QueryWorker(QThread):
     finished = pyqtSignal(list)
     error = pyqtSignal(str)
     progress = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    rounds_ready = pyqtSignal(list)      # a batch of newly assembled DialogRound
+    hits_progress = pyqtSignal(int, int) # (hits fetched, hits planned)
 
     def __init__(self, server_config: Dict[str, str], filter_config: Dict[str, Any], query_size: int):
         super().__init__()
         self.server_config = server_config
         self.filter_config = filter_config
         self.query_size = query_size
+        self.cancel_event = threading.Event()
+        self.metrics = Instrumentation() # per-query stage timings, shown in the status bar
+
+    @staticmethod
+    def query_key(server_config: Dict[str, str], filter_config: Dict[str, Any], query_size: int) -> tuple:
+        """Identity of a query, identical submissions are coalesced onto the running worker"""
+        return (tuple(sorted(server_config.items())), tuple(sorted(filter_config.items())), query_size)
+
+    @property
+    def key(self) -> tuple:
+        return QueryWorker.query_key(self.server_config, self.filter_config, self.query_size)
+
+    def cancel(self):
+        """Stop fetching further pages; the request in flight is allowed to finish"""
+        self.cancel_event.set()
 
     def run(self):
+        # KONGMING_PROFILE=1 profiles each query into KONGMING_PROFILE_DIR (logs/ by default)
+        with recording(self.metrics), profile(name='query') as profiler:
+            self._run()
+        if profiler is not None:
+            self.progress.emit(f"Profile written to {', '.join(profiler.files)}")
+
+    def _run(self):
         try:
             self.progress.emit("Connecting to ELK server...")
             elk_server = KongmingELKServer(
@@ -231,37 +561,609 @@ class QueryWorker(QThread):
             )
 
             self.progress.emit("Executing query... This may take a while.")
-            # Assuming query_dialogs returns (records, rounds)
-            records, rounds = elk_server.query_dialogs(dialog_filter, size=self.query_size, pagesize=1000) # Use provided size
+            # Rounds are streamed page by page as soon as they are complete
+            rounds = []
+            for batch in elk_server.iter_dialogs(dialog_filter, size=self.query_size, pagesize=1000,
+                                                 progress=self.hits_progress.emit, cancel=self.cancel_event):
+                if self.cancel_event.is_set():
+                    raise QueryCancelled()
+                rounds += batch
+                self.rounds_ready.emit(batch)
+                self.progress.emit(f"Executing query... {len(rounds)} dialog rounds so far.")
             self.finished.emit(rounds)
             self.progress.emit(f"Query finished. Found {len(rounds)} dialog rounds.")
+        except QueryCancelled:
+            self.cancelled.emit()
         except Exception as e:
             self.error.emit(f"Query failed: {str(e)}")
             self.progress.emit("Query failed.")
 
-class LogFilterProxyModel(QSortFilterProxyModel):
+class ExportWorker(QThread):
+    """
+    Writes a snapshot of rounds to a file with the kongming exporters
+
+    The rounds are taken from the filtered view on the UI thread, the schema
+    extraction and file writing happen here, batch by batch.
+    """
+    progress = pyqtSignal(int, int) # (rows written, total rows)
+    finished = pyqtSignal(int)      # rows written
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, rounds: List[DialogRound], filename: str, users: Optional[UserResolver] = None, parent=None):
+        super().__init__(parent)
+        self.rounds = rounds
+        self.filename = filename
+        self.users = users
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        total = len(self.rounds)
+        try:
+            count = export_dialog_rounds(self.rounds, self.filename, users=self.users,
+                                         progress=lambda count: self.progress.emit(count, total),
+                                         cancel=self.cancel_event)
+            self.finished.emit(count)
+        except ExportCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.error.emit(f"Export failed: {e}")
+
+class TraceService(QObject):
+    """
+    Fetches the log records around a round and renders them with KongmingLogAnalyzer
+
+    Fetches run on a small thread pool, requests for a trace already in flight
+    are ignored, and rendered markdown is kept in an LRU keyed by trace id so
+    going back to a row is instant.
+    """
+    ready = pyqtSignal(str, str)  # (trace id, markdown)
+    failed = pyqtSignal(str, str) # (trace id, message)
+
+    MAX_TRACES = 100
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        self._filters = {} # {column_index: filter_text}
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='kongming-trace')
+        self.analyzer = KongmingLogAnalyzer()
+        self._cache: 'OrderedDict[str, str]' = OrderedDict()
+        self._pending = set()
+        self.ready.connect(self._store)
+        self.failed.connect(lambda trace_id, message: self._pending.discard(trace_id))
+
+    def cached(self, trace_id: str) -> Optional[str]:
+        markdown = self._cache.get(trace_id)
+        if markdown is not None:
+            self._cache.move_to_end(trace_id)
+        return markdown
+
+    def clear(self):
+        self._cache.clear()
+
+    def request(self, round: DialogRound, server_config: Dict[str, str]):
+        """Fetch and render the trace of round unless it is cached or being fetched"""
+        trace_id = round.traceId
+        if trace_id in self._cache or trace_id in self._pending:
+            return
+        self._pending.add(trace_id)
+        self.executor.submit(self._fetch, round, dict(server_config))
 
-    def setFilterByColumn(self, column_index, filter_text):
-        if filter_text:
-            self._filters[column_index] = filter_text
+    def _fetch(self, round: DialogRound, server_config: Dict[str, str]):
+        try:
+            elk_server = KongmingELKServer(
+                server=server_config["server"],
+                username=server_config["username"],
+                password=server_config["password"],
+                env=server_config["env"]
+            )
+            records = elk_server.query_round_records(round, env=server_config["env"])
+            if records is None:
+                self.failed.emit(round.traceId, "该轮对话缺少时间戳, 无法确定查询的时间窗口")
+            elif not records:
+                self.failed.emit(round.traceId, "没有找到该trace的日志")
+            else:
+                self.ready.emit(round.traceId, self.analyzer.render(records))
+        except Exception as e:
+            self.failed.emit(round.traceId, f"Trace fetch failed: {e}")
+
+    def _store(self, trace_id: str, markdown: str):
+        self._pending.discard(trace_id)
+        self._cache[trace_id] = markdown
+        while len(self._cache) > self.MAX_TRACES:
+            self._cache.popitem(last=False)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class StatsWorker(QThread):
+    """
+    Long-lived thread aggregating rounds into time buckets with RoundStats
+
+    reset() starts over with a new interval, add() queues a batch of rounds.
+    After each batch the summaries of all buckets (plus the overall one) are
+    emitted; only the buckets the batch touched are recomputed.
+    """
+    updated = pyqtSignal(int, list, object) # (generation, bucket summaries, overall summary)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._queue = queue.Queue()
+        self._generation = 0
+
+    def reset(self, generation: int, interval: int):
+        self._generation = generation
+        self._queue.put((generation, interval, None))
+
+    def add(self, generation: int, rounds: List[DialogRound]):
+        self._queue.put((generation, None, rounds))
+
+    def stop(self):
+        self._queue.put(None)
+        self.wait()
+
+    def run(self):
+        utc_offset = datetime.now().astimezone().utcoffset().total_seconds()
+        stats = RoundStats()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            generation, interval, rounds = item
+            if generation != self._generation:
+                continue
+            if rounds is None:
+                stats = RoundStats(interval, utc_offset)
+            else:
+                stats.add_rounds(rounds)
+            if self._queue.empty(): # skip intermediate results when batches pile up
+                self.updated.emit(generation, stats.summaries(), stats.total.summary())
+
+class LatencyHistogram(QWidget):
+    """
+    Grouped bar chart of the NLU and LLM latency distributions over the bins
+    of kongming.stats.LATENCY_BINS
+    """
+    NLU_COLOR = QColor(70, 130, 180)
+    LLM_COLOR = QColor(230, 140, 50)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.labels = latency_bin_labels()
+        self.nlu_counts: Tuple[int, ...] = ()
+        self.llm_counts: Tuple[int, ...] = ()
+        self.title = ""
+        self.setMinimumHeight(160)
+
+    def set_histograms(self, title: str, nlu_counts: Tuple[int, ...], llm_counts: Tuple[int, ...]):
+        self.title = title
+        self.nlu_counts = nlu_counts
+        self.llm_counts = llm_counts
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.GlobalColor.white)
+        metrics = painter.fontMetrics()
+        line = metrics.height()
+        margin = 8
+        # title row and room for the count above the tallest bar
+        chart = QRect(margin, margin + 2 * line, self.width() - 2 * margin, self.height() - 2 * margin - 4 * line)
+
+        painter.setPen(Qt.GlobalColor.black)
+        painter.drawText(margin, margin + metrics.ascent(), self.title)
+        # legend
+        x = self.width() - margin
+        for name, color in [("LLM", self.LLM_COLOR), ("NLU", self.NLU_COLOR)]:
+            x -= metrics.horizontalAdvance(name) + line + 12
+            painter.fillRect(x, margin + 2, line - 4, line - 4, color)
+            painter.drawText(x + line, margin + metrics.ascent(), name)
+
+        peak = max(max(self.nlu_counts, default=0), max(self.llm_counts, default=0))
+        slot = chart.width() / len(self.labels)
+        bar = max(1, int(slot * 0.4))
+        for pos, label in enumerate(self.labels):
+            left = int(chart.left() + pos * slot + slot * 0.1)
+            for offset, counts, color in [(0, self.nlu_counts, self.NLU_COLOR), (bar, self.llm_counts, self.LLM_COLOR)]:
+                count = counts[pos] if pos < len(counts) else 0
+                if count and peak:
+                    height = int(chart.height() * count / peak)
+                    painter.fillRect(left + offset, chart.bottom() - height, bar, height, color)
+                    painter.drawText(QRect(left + offset - 10, chart.bottom() - height - line, bar + 20, line),
+                                     Qt.AlignmentFlag.AlignCenter, str(count))
+            painter.drawText(QRect(int(chart.left() + pos * slot), chart.bottom() + 2, int(slot), line),
+                             Qt.AlignmentFlag.AlignCenter, label)
+        painter.drawLine(chart.left(), chart.bottom(), chart.right(), chart.bottom())
+        painter.end()
+
+class StatsView(QDialog):
+    """
+    Time-bucketed counts, latency percentiles and error rates as a heatmap table,
+    with a latency histogram panel below it
+
+    Each numeric cell is shaded by its value relative to the column maximum,
+    so slow or failing periods stand out without reading the numbers.
+    The histogram shows the selected period, or the whole query when no row is selected.
+    """
+    interval_changed = pyqtSignal(int)
+
+    HEADERS = ["时间", "轮数", "NLU p50", "NLU p95", "NLU p99", "LLM轮数", "LLM p50", "LLM p95", "LLM p99", "NLU错误率", "LLM错误率"]
+    FIELDS = ["count", "nlu_p50", "nlu_p95", "nlu_p99", "llm_count", "llm_p50", "llm_p95", "llm_p99", "nlu_error_rate", "llm_error_rate"]
+    TIME_FORMATS = {'minute': "yyyy-MM-dd HH:mm", 'hour': "yyyy-MM-dd HH:00", 'day': "yyyy-MM-dd"}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("统计")
+        self.setWindowFlags(Qt.WindowType.Window)
+        self.resize(900, 600)
+
+        layout = QVBoxLayout()
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(QLabel("时间粒度:"))
+        self.interval_combo = QComboBox()
+        self.interval_combo.addItem("分钟", 'minute')
+        self.interval_combo.addItem("小时", 'hour')
+        self.interval_combo.addItem("天", 'day')
+        self.interval_combo.currentIndexChanged.connect(
+            lambda: self.interval_changed.emit(STATS_INTERVALS[self.interval_combo.currentData()]))
+        top_layout.addWidget(self.interval_combo)
+        top_layout.addStretch()
+        self.total_label = QLabel()
+        top_layout.addWidget(self.total_label)
+        layout.addLayout(top_layout)
+
+        self.table = QTableWidget()
+        self.table.setColumnCount(len(self.HEADERS))
+        self.table.setHorizontalHeaderLabels(self.HEADERS)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setFont(QFont("Courier New", 9))
+        self.table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QTableWidget.SelectionMode.SingleSelection)
+        self.table.itemSelectionChanged.connect(self.update_histogram)
+
+        self.histogram = LatencyHistogram()
+        splitter = QSplitter(Qt.Orientation.Vertical)
+        splitter.addWidget(self.table)
+        splitter.addWidget(self.histogram)
+        splitter.setSizes([400, 200])
+        layout.addWidget(splitter)
+        self.setLayout(layout)
+
+        self.summaries: List[BucketSummary] = []
+        self.total: Optional[BucketSummary] = None
+
+    @property
+    def interval(self) -> int:
+        return STATS_INTERVALS[self.interval_combo.currentData()]
+
+    @staticmethod
+    def format_value(field, value):
+        if value is None:
+            return ""
+        if field.endswith('error_rate'):
+            return f"{value:.1%}"
+        if isinstance(value, float):
+            return f"{value:.3f}"
+        return str(value)
+
+    def set_summaries(self, summaries: List[BucketSummary], total: BucketSummary):
+        time_format = self.TIME_FORMATS[self.interval_combo.currentData()]
+        maxima = {field: max((getattr(s, field) or 0 for s in summaries), default=0) for field in self.FIELDS}
+
+        self.table.setUpdatesEnabled(False)
+        self.table.setRowCount(len(summaries))
+        for row, summary in enumerate(summaries):
+            start = QDateTime.fromSecsSinceEpoch(int(summary.start)).toString(time_format)
+            self.table.setItem(row, 0, QTableWidgetItem(start))
+            for column, field in enumerate(self.FIELDS, 1):
+                value = getattr(summary, field)
+                item = QTableWidgetItem(self.format_value(field, value))
+                item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                if value and maxima[field]:
+                    # white -> red by the share of the column maximum
+                    level = int(200 * value / maxima[field])
+                    item.setBackground(QColor(255, 255 - level, 255 - level))
+                self.table.setItem(row, column, item)
+        self.table.setUpdatesEnabled(True)
+
+        self.summaries = summaries
+        self.total = total
+        self.update_histogram()
+
+        self.total_label.setText(
+            f"共 {total.count} 轮, NLU p95 {self.format_value('nlu_p95', total.nlu_p95)}s, "
+            f"LLM p95 {self.format_value('llm_p95', total.llm_p95)}s, "
+            f"NLU错误率 {self.format_value('nlu_error_rate', total.nlu_error_rate)}, "
+            f"LLM错误率 {self.format_value('llm_error_rate', total.llm_error_rate)}")
+
+    def update_histogram(self):
+        """Show the latency distribution of the selected period, or of the whole query"""
+        rows = self.table.selectionModel().selectedRows()
+        if rows and rows[0].row() < len(self.summaries):
+            summary = self.summaries[rows[0].row()]
+            title = f"耗时分布: {self.table.item(rows[0].row(), 0).text()}"
+        elif self.total is not None:
+            summary = self.total
+            title = "耗时分布: 全部"
         else:
-            self._filters.pop(column_index, None)
+            self.histogram.set_histograms("", (), ())
+            return
+        self.histogram.set_histograms(title, summary.nlu_histogram, summary.llm_histogram)
+
+class SessionView(QDialog):
+    """
+    Conversations reconstructed from sessionId: sessions on the left, the
+    time-ordered turns of the selected session on the right
+
+    Turns that clear the context are highlighted; the 上下文 column numbers
+    the contexts the model saw between clears.
+    """
+    SESSION_HEADERS = ["会话ID", "使用者", "轮数", "开始时间", "时长(s)", "最大间隔(s)", "清除上下文"]
+    TURN_HEADERS = ["轮次", "时间", "间隔(s)", "上下文", "TraceId", "用户问题", "回答"]
+    CLEAR_COLOR = QColor(255, 235, 200)
+
+    def __init__(self, user_name_func=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("会话")
+        self.setWindowFlags(Qt.WindowType.Window)
+        self.resize(1000, 600)
+        self.user_name_func = user_name_func
+        self.index: Optional[SessionIndex] = None
+        self.session_ids: List[str] = [] # session of each row in the session table
+        self.current_session_id = None
+        self.focus_trace_id = None
+
+        layout = QVBoxLayout()
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(QLabel("最少轮数:"))
+        self.min_turns_input = QLineEdit("1")
+        self.min_turns_input.setValidator(QIntValidator(1, 1000000))
+        self.min_turns_input.setFixedWidth(60)
+        self.min_turns_input.editingFinished.connect(self.refresh)
+        top_layout.addWidget(self.min_turns_input)
+        self.cleared_only_checkbox = QCheckBox("仅显示清除过上下文的会话")
+        self.cleared_only_checkbox.toggled.connect(self.refresh)
+        top_layout.addWidget(self.cleared_only_checkbox)
+        top_layout.addStretch()
+        self.summary_label = QLabel()
+        top_layout.addWidget(self.summary_label)
+        layout.addLayout(top_layout)
+
+        self.session_table = self._table(self.SESSION_HEADERS)
+        self.session_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.session_table.setSelectionMode(QTableWidget.SelectionMode.SingleSelection)
+        self.session_table.currentCellChanged.connect(self._session_selected)
+        self.turn_table = self._table(self.TURN_HEADERS)
+
+        splitter = QSplitter(Qt.Orientation.Horizontal)
+        splitter.addWidget(self.session_table)
+        splitter.addWidget(self.turn_table)
+        splitter.setStretchFactor(0, 2)
+        splitter.setStretchFactor(1, 3)
+        layout.addWidget(splitter)
+        self.setLayout(layout)
+
+    @staticmethod
+    def _table(headers):
+        table = QTableWidget()
+        table.setColumnCount(len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        table.verticalHeader().setVisible(False)
+        table.setWordWrap(False)
+        table.setFont(QFont("Courier New", 9))
+        return table
+
+    @staticmethod
+    def _item(value, align_right=False, background=None):
+        item = QTableWidgetItem("" if value is None else str(value))
+        if align_right:
+            item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+        if background is not None:
+            item.setBackground(background)
+        return item
+
+    def set_index(self, index: SessionIndex):
+        self.index = index
+        self.refresh()
+
+    def refresh(self):
+        """Re-run the session query, keeping the selected session if it still matches"""
+        if self.index is None:
+            return
+        min_turns = int(self.min_turns_input.text() or 1)
+        sessions = self.index.sessions(min_turns=min_turns, clears_context=True if self.cleared_only_checkbox.isChecked() else None)
+        self.session_ids = [session.session_id for session in sessions]
+
+        self.session_table.blockSignals(True)
+        self.session_table.setUpdatesEnabled(False)
+        self.session_table.setRowCount(len(sessions))
+        for row, session in enumerate(sessions):
+            first = session.turns[0].round
+            self.session_table.setItem(row, 0, self._item(session.session_id))
+            self.session_table.setItem(row, 1, self._item(self.user_name_func(first) if self.user_name_func else ""))
+            self.session_table.setItem(row, 2, self._item(len(session), True))
+            self.session_table.setItem(row, 3, self._item(format_display_timestamp(first.timestamp)))
+            self.session_table.setItem(row, 4, self._item(f"{session.duration:.1f}", True))
+            self.session_table.setItem(row, 5, self._item(f"{session.max_gap:.1f}", True))
+            clears = session.context_clears
+            self.session_table.setItem(row, 6, self._item(clears, True, self.CLEAR_COLOR if clears else None))
+        self.session_table.setUpdatesEnabled(True)
+
+        current = self.session_ids.index(self.current_session_id) if self.current_session_id in self.session_ids else -1
+        if current >= 0:
+            self.session_table.setCurrentCell(current, 0)
+        self.session_table.blockSignals(False)
+        self.summary_label.setText(f"共 {len(sessions)} 个会话")
+        self.show_turns(self.index.session(self.current_session_id) if current >= 0 else None)
+
+    def show_session(self, session_id: str, trace_id: Optional[str] = None):
+        """Select a session (and scroll to one of its turns), relaxing the filters if they hide it"""
+        self.current_session_id = session_id
+        self.focus_trace_id = trace_id
+        if session_id not in self.session_ids:
+            self.min_turns_input.setText("1")
+            self.cleared_only_checkbox.blockSignals(True)
+            self.cleared_only_checkbox.setChecked(False)
+            self.cleared_only_checkbox.blockSignals(False)
+        self.refresh()
+
+    def _session_selected(self, row, column, previous_row, previous_column):
+        if 0 <= row < len(self.session_ids) and self.session_ids[row] != self.current_session_id:
+            self.current_session_id = self.session_ids[row]
+            self.focus_trace_id = None
+            self.show_turns(self.index.session(self.current_session_id))
+
+    def show_turns(self, session: Optional[Session]):
+        turns = session.turns if session is not None else []
+        self.turn_table.setUpdatesEnabled(False)
+        self.turn_table.setRowCount(len(turns))
+        focus_row = -1
+        for row, turn in enumerate(turns):
+            round = turn.round
+            nlp, llm = round.nlp_round, round.llm_round
+            query = nlp.query if nlp is not None else None
+            if query == CLEAN_CONTEXT_MAGIC_STRING:
+                query = "<清除上下文>"
+            background = self.CLEAR_COLOR if turn.clears_context else None
+            values = [
+                (turn.turn, True),
+                (format_display_timestamp(round.timestamp), False),
+                ("" if turn.gap is None else f"{turn.gap:.1f}", True),
+                (turn.context, True),
+                (round.traceId, False),
+                (query, False),
+                (llm.answer if llm is not None else None, False),
+            ]
+            for column, (value, align_right) in enumerate(values):
+                item = self._item(value, align_right, background)
+                if column >= 5 and value:
+                    item.setToolTip(format_tooltip(str(value)))
+                self.turn_table.setItem(row, column, item)
+            if round.traceId == self.focus_trace_id:
+                focus_row = row
+        self.turn_table.setUpdatesEnabled(True)
+        if focus_row >= 0:
+            self.turn_table.selectRow(focus_row)
+            self.turn_table.scrollToItem(self.turn_table.item(focus_row, 0))
+
+class IndexWorker(QThread):
+    """
+    Long-lived thread building the filter index of rows as they arrive
+
+    Batches of rounds are queued with submit(). For each batch the worker
+    computes the display texts and a partial per-column index, which the UI
+    thread only has to merge (proportional to the distinct values in the
+    batch, not to the number of cells).
+    """
+    indexed = pyqtSignal(int, int, list, list) # (generation, start row, texts, partial column indexes)
+
+    def __init__(self, compute_texts, column_count, parent=None):
+        super().__init__(parent)
+        self._compute_texts = compute_texts
+        self._column_count = column_count
+        self._queue = queue.Queue()
+        self._generation = 0
+
+    def submit(self, generation: int, start_row: int, rounds: List[DialogRound]):
+        self._generation = generation # batches of older result sets are skipped
+        self._queue.put((generation, start_row, rounds))
+
+    def stop(self):
+        self._queue.put(None)
+        self.wait()
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            generation, start_row, rounds = item
+            if generation != self._generation:
+                continue
+            texts = [self._compute_texts(round) for round in rounds]
+            partial = build_partial_index(texts, start_row, self._column_count)
+            self.indexed.emit(generation, start_row, texts, partial)
+
+class HistogramWorker(QThread):
+    """
+    Computes the faceted value counts of every column from a snapshot
+
+    The snapshot holds the per-row value lists of the index (append-only, so
+    reading their prefix is safe while new batches are merged) and the facet
+    masks computed on the UI thread.
+    """
+    ready = pyqtSignal(int, list) # (engine version, one value -> count dict per column)
+
+    def __init__(self, engine: FilterEngine, parent=None):
+        super().__init__(parent)
+        self.version = engine.version
+        self._row_count = engine.row_count
+        self._values = [index.values for index in engine.columns]
+        self._masks = engine.facet_masks()
+
+    def run(self):
+        histograms = [count_values(values, self._row_count, self._masks[column])
+                      for column, values in enumerate(self._values)]
+        self.ready.emit(self.version, histograms)
+
+class LogFilterProxyModel(QSortFilterProxyModel):
+    """
+    Proxy model answering filterAcceptsRow from a FilterEngine
+
+    The engine keeps per-column value -> row bitmaps of the source
+    DialogRoundTableModel. The index is built by an IndexWorker and merged
+    batch by batch, and a filter change is answered by bitmap intersection
+    instead of comparing cell text row by row. Rows not indexed yet are hidden
+    while filters are active.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.engine = FilterEngine(len(GUI_HEADERS))
+
+    @property
+    def filters(self):
+        return self.engine.filters
+
+    def reset_index(self):
+        self.engine.reset()
+        if self.engine.filters:
+            self.invalidateFilter()
+
+    def merge_index(self, start_row: int, partial):
+        self.engine.merge(start_row, partial)
+        if self.engine.filters:
+            self.invalidateFilter()
+
+    def update_column(self, column_index, values: Dict[int, str]):
+        """Re-index the rows of a column whose content changed in the source model"""
+        values = {row: value for row, value in values.items() if row < self.engine.row_count}
+        self.engine.update_values(column_index, values)
+        if values and column_index in self.engine.filters:
+            self.invalidateFilter()
+
+    def set_column_filter(self, column_index, column_filter: Optional[ColumnFilter]):
+        self.engine.set_filter(column_index, column_filter)
         self.invalidateFilter() # Re-apply filters
 
+    def setFilterByColumn(self, column_index, filter_text):
+        self.set_column_filter(column_index, ValueSetFilter([filter_text]) if filter_text else None)
+
+    def set_filter_mode(self, mode):
+        self.engine.set_mode(mode)
+        self.invalidateFilter()
+
+    def clear_filters(self):
+        self.engine.clear_filters()
+        self.invalidateFilter()
+
     def filterAcceptsRow(self, source_row, source_parent):
-        if not self._filters:
+        if not self.engine.filters:
             return True # No filters applied
-
-        for column_index, filter_text in self._filters.items():
-            index = self.sourceModel().index(source_row, column_index, source_parent)
-            if index.isValid():
-                data = self.sourceModel().data(index)
-                if str(data) != filter_text:  # Exact match instead of substring
-                    return False # Mismatch in this column
-        return True # All filters passed
+        return self.engine.accepts(source_row)
 
 # Removed FilterHeaderView class as it's no longer needed
 
@@ -273,9 +1175,22 @@ class LogAnalyzerApp(QWidget):
         self.setWindowTitle("Kongming Log Analyzer")
         self.setGeometry(100, 100, 1200, 800) # Increased window size
         
-        self.device_user_map = self.load_device_user_map()
+        # User mapping, hot-reloaded when the file changes
+        self.user_resolver = UserResolver(os.path.join(os.path.dirname(os.path.abspath(__file__)), "device_user_map.csv"), load=False)
+        try:
+            self.user_resolver.reload()
+        except Exception as e:
+            print(f"Error loading device_user_map.csv: {e}")
         self.init_ui()
         self.query_worker = None
+        self.map_view = None # created on first use and reused
+        self.export_worker = None
+        self.stats_view = None # created on first use, then fed as rows stream in
+        self.stats_worker = None
+        self.session_view = None # created on first use
+        self.map_sdk_url = DEFAULT_MAP_SDK_URL
+        self.map_tile_url = ""
+        self.retired_workers = [] # cancelled workers, kept alive until their thread exits
         self.image_preview_popup = None
         self.load_settings() # Call load_settings after init_ui
 
@@ -328,6 +1243,11 @@ class LogAnalyzerApp(QWidget):
                 self.glass_product_combo.setCurrentText(config.get('Query_Conditions', 'glass_product', fallback=""))
                 self.id_type_combo.setCurrentText(config.get('Query_Conditions', 'id_type', fallback=""))
 
+            # Load Map Config, urls may point at a local SDK/tile server
+            if 'Map' in config:
+                self.map_sdk_url = config.get('Map', 'sdk_url', fallback=DEFAULT_MAP_SDK_URL)
+                self.map_tile_url = config.get('Map', 'tile_url', fallback="")
+
             # Load Table Header State
             if 'Table' in config:
                 try:
@@ -361,6 +1281,32 @@ class LogAnalyzerApp(QWidget):
         
         toolbar.addSeparator()
         
+        self.export_button = QPushButton("导出结果")
+        self.export_button.clicked.connect(self.export_results)
+        toolbar.addWidget(self.export_button)
+
+        toolbar.addSeparator()
+
+        self.cancel_query_button = QPushButton("取消查询")
+        self.cancel_query_button.setEnabled(False)
+        self.cancel_query_button.clicked.connect(self.cancel_query)
+        toolbar.addWidget(self.cancel_query_button)
+
+        toolbar.addSeparator()
+
+        self.stats_button = QPushButton("统计")
+        self.stats_button.clicked.connect(self.show_stats)
+        toolbar.addWidget(self.stats_button)
+
+        self.session_button = QPushButton("会话")
+        self.session_button.clicked.connect(self.show_sessions)
+        toolbar.addWidget(self.session_button)
+
+        self.trace_button = QPushButton("Trace详情")
+        self.trace_button.setCheckable(True)
+        self.trace_button.toggled.connect(self.toggle_trace_panel)
+        toolbar.addWidget(self.trace_button)
+
         self.reload_user_map_button = QPushButton("重新加载用户映射")
         self.reload_user_map_button.clicked.connect(self.reload_user_mapping)
         toolbar.addWidget(self.reload_user_map_button)
@@ -461,9 +1407,33 @@ class LogAnalyzerApp(QWidget):
         results_group_layout = QVBoxLayout()
         results_group_layout.addWidget(QLabel("<h3>Query Results</h3>"))
 
-        self.data_model = QStandardItemModel()
+        self.data_model = DialogRoundTableModel(self.user_resolver.resolve)
         self.proxy_model = LogFilterProxyModel() # Use custom proxy model
         self.proxy_model.setSourceModel(self.data_model)
+
+        # Filter index is built off the UI thread, faceted value counts are
+        # recomputed in the background (debounced) whenever rows or filters change
+        self.index_worker = IndexWorker(self.data_model.compute_texts, len(GUI_HEADERS), self)
+        self.index_worker.indexed.connect(self.merge_index)
+        self.index_worker.start()
+        self.histograms = None # (engine version, per-column value counts)
+        self.histogram_worker = None
+        self.histogram_timer = QTimer(self)
+        self.histogram_timer.setSingleShot(True)
+        self.histogram_timer.setInterval(300)
+        self.histogram_timer.timeout.connect(self.compute_histograms)
+
+        # Conversations linked by sessionId, extended as rows stream in
+        self.session_index = SessionIndex()
+        self.session_timer = QTimer(self)
+        self.session_timer.setSingleShot(True)
+        self.session_timer.setInterval(300)
+        self.session_timer.timeout.connect(self.refresh_sessions)
+
+        self.user_map_timer = QTimer(self)
+        self.user_map_timer.setInterval(2000)
+        self.user_map_timer.timeout.connect(self.check_user_mapping)
+        self.user_map_timer.start()
         
         self.table_widget = QTableView() # Change to QTableView
         self.table_widget.setModel(self.proxy_model) # Set proxy model to table
@@ -471,83 +1441,74 @@ class LogAnalyzerApp(QWidget):
         self.table_widget.setSelectionBehavior(QTableView.SelectionBehavior.SelectItems) # Allow item selection for copying
         self.table_widget.setWordWrap(False) # Disable word wrap to keep single line display
 
-        self.setup_table_headers() # This will now set headers on data_model
+        self.setup_table_headers()
         self.table_widget.doubleClicked.connect(self.handle_cell_double_clicked)
-        results_group_layout.addWidget(self.table_widget)
+
+        # Images: pooled downloads with memory/disk LRU, thumbnails for the rows in view
+        self.image_service = ImageService(ImageCache(), self)
+        self.image_service.image_ready.connect(self.image_loaded)
+        self.image_service.failed.connect(self.image_failed)
+        self.image_service.thumbnail_ready.connect(self.thumbnail_loaded)
+        self.data_model.thumbnail_func = self.image_service.thumbnail
+        self.preview_url = None # only the latest double-clicked image is shown
+        self.thumbnail_rows = {} # url -> source rows in view
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(150)
+        self.prefetch_timer.timeout.connect(self.prefetch_visible_images)
+        self.table_widget.verticalScrollBar().valueChanged.connect(self.prefetch_timer.start)
+        self.proxy_model.rowsInserted.connect(self.prefetch_timer.start)
+        self.proxy_model.modelReset.connect(self.prefetch_timer.start)
+        self.proxy_model.layoutChanged.connect(self.prefetch_timer.start)
+        # Drill-down panel below the table: analyzer markdown of the current row's trace
+        self.trace_panel = QTextBrowser()
+        self.trace_panel.setOpenExternalLinks(True)
+        self.trace_panel.setVisible(False)
+        self.trace_service = TraceService(self)
+        self.trace_service.ready.connect(self.trace_loaded)
+        self.trace_service.failed.connect(self.trace_failed)
+        self.current_trace_id = None
+        self.table_widget.selectionModel().currentRowChanged.connect(self.show_current_trace)
+
+        results_splitter = QSplitter(Qt.Orientation.Vertical)
+        results_splitter.addWidget(self.table_widget)
+        results_splitter.addWidget(self.trace_panel)
+        results_splitter.setStretchFactor(0, 3)
+        results_splitter.setStretchFactor(1, 2)
+        results_group_layout.addWidget(results_splitter)
         main_layout.addLayout(results_group_layout)
 
         # --- Status Bar ---
         self.status_bar = QStatusBar()
+        self.query_progress_bar = QProgressBar()
+        self.query_progress_bar.setFixedWidth(200)
+        self.query_progress_bar.setFormat("%v / %m hits")
+        self.query_progress_bar.setVisible(False)
+        self.status_bar.addPermanentWidget(self.query_progress_bar)
+        self.metrics_label = QLabel()
+        self.metrics_label.setFont(QFont("Courier New", 8))
+        self.status_bar.addPermanentWidget(self.metrics_label)
         main_layout.addWidget(self.status_bar)
 
         self.setLayout(main_layout)
 
-    def load_device_user_map(self):
-        """Load device-user mapping from CSV file"""
-        device_user_map = {}
-        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "device_user_map.csv")
-        
-        if os.path.exists(csv_path):
-            try:
-                with open(csv_path, 'r', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        key = f"{row['id_type']}:{row['id']}"
-                        device_user_map[key] = row['user']
-            except Exception as e:
-                print(f"Error loading device_user_map.csv: {e}")
-        
-        return device_user_map
-    
-    def get_user_name(self, round_data):
-        """Get user name based on device IDs from the round data"""
-        # Check different ID types in priority order
-        id_checks = [
-            ('iotDeviceId', round_data.iotDeviceId),
-            ('deviceId', round_data.deviceId),
-            ('glassDeviceId', round_data.glassDeviceId),
-            ('accountId', round_data.accountId),
-            ('xjAccountId', round_data.xjAccountId)
-        ]
-        
-        for id_type, id_value in id_checks:
-            if id_value:
-                key = f"{id_type}:{id_value}"
-                if key in self.device_user_map:
-                    return self.device_user_map[key]
-        
-        return ""  # Return empty string if no match found
-
     def setup_table_headers(self):
-        # Headers based on kongming/excel.py's titles with "使用者" as first column
-        headers = [
-            "使用者", "时间戳", "trace_id", "眼镜类型", "位置", "originType", "functionType",
-            "locale", "时区", "语种", "首轮", "NLU查询", "NLU意图", "NLU回答",
-            "NLU Error", "NLU耗时", "LLM查询", "LLM意图", "LLM场景", "照片",
-            "角色扮演", "深度思考", "深度搜索", "视觉辅助", "清上下文", "LLM回答",
-            "LLM思考", "LLM搜索数据", "LLM状态", "LLM耗时", "deviceId",
-            "glassDeviceId", "iotDeviceId", "accountId", "xjAccountId",
-            "sessionId", "msgId",
-        ]
-        self.data_model.setColumnCount(len(headers))
-        self.data_model.setHorizontalHeaderLabels(headers)
-        # The QTableWidget will get its header from the proxy model, which gets it from the data model
+        # Headers come from DialogRoundTableModel (the shared DIALOG_ROUND_SCHEMA with "使用者" as first column)
         self.table_widget.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Interactive) # This will be handled by the view
         self.table_widget.verticalHeader().setVisible(True) # Show row numbers
         self.table_widget.setFont(QFont("Courier New", 8)) # Set smaller monospace font
 
-    def start_query(self):
-        if self.query_worker and self.query_worker.isRunning():
-            QMessageBox.warning(self, "Query in Progress", "A query is already running. Please wait or cancel the current query.")
-            return
-
-        server_config = {
+    def current_server_config(self) -> Dict[str, str]:
+        return {
             "server": self.server_url_input.text(),
             "username": self.username_input.text(),
             "password": self.password_input.text(),
             "env": self.env_combo.currentText()
         }
 
+    def start_query(self):
+        server_config = self.current_server_config()
+
         filter_config = {
             "timestamp_begin": self.start_time_edit.dateTime().toUTC().toString("yyyy-MM-ddTHH:mm:ss.zzzZ") if self.enable_start_time_checkbox.isChecked() else None,
             "timestamp_end": self.end_time_edit.dateTime().toUTC().toString("yyyy-MM-ddTHH:mm:ss.zzzZ") if self.enable_end_time_checkbox.isChecked() else None,
@@ -565,237 +1526,253 @@ class LogAnalyzerApp(QWidget):
             QMessageBox.critical(self, "Invalid Input", f"Invalid Query Size: {e}")
             return
 
+        running = self.query_worker is not None and self.query_worker.isRunning() and not self.query_worker.cancel_event.is_set()
+        if running and self.query_worker.key == QueryWorker.query_key(server_config, filter_config, query_size):
+            # Same query submitted again: keep the one in flight
+            self.status_bar.showMessage("相同的查询正在进行中")
+            return
+        if running:
+            # A newer query preempts the running one
+            self.retire_query_worker()
+        else:
+            QApplication.setOverrideCursor(Qt.CursorShape.BusyCursor) # Results stay usable while rows stream in
+
         # Clear current filters before starting new query
         self.clear_all_filters()
         
         self.status_bar.showMessage("Starting query...")
-        self.search_button.setEnabled(False) # Disable button during query
-        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor) # Set busy cursor
+        self.cancel_query_button.setEnabled(True)
+
+        # Start from an empty table, rows are appended as batches arrive
+        self.display_results([])
+        self.query_progress_bar.setRange(0, 0) # Busy indicator until the total is known
+        self.query_progress_bar.setVisible(True)
+        self.metrics_label.clear()
+        self.metrics_label.setToolTip("")
 
         self.query_worker = QueryWorker(server_config, filter_config, query_size)
-        self.query_worker.finished.connect(self.display_results)
-        self.query_worker.error.connect(self.show_error)
-        self.query_worker.progress.connect(self.status_bar.showMessage)
+        self.query_worker.rounds_ready.connect(self.append_results)
+        self.query_worker.hits_progress.connect(self.update_query_progress)
+        self.query_worker.finished.connect(self.query_finished)
+        self.query_worker.error.connect(self.query_failed)
+        self.query_worker.progress.connect(self.show_query_progress)
         self.query_worker.start()
 
+    def retire_query_worker(self):
+        """Cancel the current query worker and stop listening to it"""
+        worker = self.query_worker
+        self.query_worker = None
+        worker.cancel()
+        self.retired_workers = [w for w in self.retired_workers if w.isRunning()]
+        self.retired_workers.append(worker)
+
+    def cancel_query(self):
+        if self.query_worker is None or not self.query_worker.isRunning():
+            return
+        self.show_query_metrics() # Timings up to the cancellation
+        self.retire_query_worker()
+        self.end_query()
+        self.status_bar.showMessage(f"查询已取消, 保留已取回的 {self.data_model.rowCount()} 行")
+
+    def end_query(self):
+        self.query_progress_bar.setVisible(False)
+        self.cancel_query_button.setEnabled(False)
+        QApplication.restoreOverrideCursor() # Restore normal cursor
+
+    def is_current_query(self) -> bool:
+        """Signals of preempted or cancelled workers may still be queued, ignore them"""
+        return self.sender() is not None and self.sender() is self.query_worker
+
+    def show_query_progress(self, message: str):
+        if self.is_current_query():
+            self.status_bar.showMessage(message)
+
     def display_results(self, rounds: List[DialogRound]):
-        # Save current column widths before clearing data
+        # Save current column widths before resetting the model
         column_widths = []
         for i in range(self.data_model.columnCount()):
             column_widths.append(self.table_widget.horizontalHeader().sectionSize(i))
         
-        # Clear existing data and reset column count
-        self.data_model.clear()
-        self.setup_table_headers()  # Reset headers
-        self.data_model.setRowCount(len(rounds)) # Set row count on the data model
-        print(f"Initial column count: {self.data_model.columnCount()}")  # Debug
-        for row_idx, round in enumerate(rounds):
-            # Populate table based on the headers defined in setup_table_headers
-            # This mapping needs to be careful and match the order of headers
-            # and the logic from kongming/excel.py
-            col_idx = 0
-
-            if round is None:
-                continue
-
-            # First column: 使用者 (User)
-            user_name = self.get_user_name(round)
-            self.data_model.setItem(row_idx, col_idx, create_item(user_name))
-            col_idx += 1
-
-            # General
-            timestamp_str = round.nlp_round.request_timestamp if round.nlp_round and round.nlp_round.request_timestamp else ""
-            if timestamp_str:
-                # Assuming timestamp_str is in ISO 8601 format (e.g., "2025-08-20T12:34:56.789Z" or with offset)
-                # QDateTime.fromString can parse ISO 8601 directly
-                dt = QDateTime.fromString(timestamp_str, Qt.DateFormat.ISODate)
-                if dt.isValid():
-                    # Convert to local time
-                    local_dt = dt.toLocalTime()
-                    display_timestamp = local_dt.toString("yyyy-MM-dd HH:mm:ss")
-                else:
-                    display_timestamp = timestamp_str # Fallback if parsing fails
-            else:
-                display_timestamp = ""
-            self.data_model.setItem(row_idx, col_idx, create_item(display_timestamp))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(str(round.traceId) or ""))
-
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(str(int(round.glassProduct)) if round.glassProduct else ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(str(round.location) if round.location else ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(str(round.originType) if round.originType is not None else ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(str(round.functionType) if round.functionType is not None else ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(round.local or ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(round.timeZone or ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(round.nluLanguage or ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(str(round.sessionFirstFlag) if round.sessionFirstFlag is not None else ""))
-            col_idx += 1
-
-            # NLU Round
-            if round.nlp_round:
-                nlu_query_text = round.nlp_round.query if round.nlp_round.query != "CLEAN_CONTEXT_MAGIC_STRING" else "<清除上下文>"
-                self.data_model.setItem(row_idx, col_idx, create_item(nlu_query_text, nlu_query_text))
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(str(round.nlp_round.intent or "")))
-                col_idx += 1
-                nlu_utterance_text = str(round.nlp_round.utterance) if round.nlp_round.utterance else ""
-                self.data_model.setItem(row_idx, col_idx, create_item(nlu_utterance_text, nlu_utterance_text))
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(str(round.nlp_round.error) if round.nlp_round.error else ""))
-                col_idx += 1
-                nlu_latency = calculate_time_difference(round.nlp_round.request_timestamp, round.nlp_round.response_timestamp) if round.nlp_round.response_timestamp else ""
-                self.data_model.setItem(row_idx, col_idx, create_item(str(nlu_latency)))
-                col_idx += 1
-            else:
-                # Fill empty cells for NLU columns
-                for _ in range(5):
-                    self.data_model.setItem(row_idx, col_idx, create_item(""))
-                    col_idx += 1
-
-            # LLM Round
-            if round.llm_round:
-                llm_query_text = round.llm_round.query or ""
-                self.data_model.setItem(row_idx, col_idx, create_item(llm_query_text, llm_query_text))
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(round.llm_round.intent_name or ""))
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(str(round.llm_round.channel_type) if round.llm_round.channel_type is not None else ""))
-                col_idx += 1
-                files_text = "\n".join([file.ossUrl for file in round.llm_round.files]) if round.llm_round.files else ""
-                if files_text:
-                    item = create_standard_item("", files_text) # Display empty text, tooltip is URL
-                    item.setIcon(QApplication.instance().style().standardIcon(QStyle.StandardPixmap.SP_FileIcon))
-                    item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                    self.data_model.setItem(row_idx, col_idx, item)
-                else:
-                    item = create_standard_item("")
-                    item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                    self.data_model.setItem(row_idx, col_idx, item)
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(str(round.llm_round.play_status) if round.llm_round.play_status is not None else ""))
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(str(round.llm_round.use_deepseek) if round.llm_round.use_deepseek is not None else ""))
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(str(round.llm_round.use_search) if round.llm_round.use_search is not None else ""))
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(str(round.llm_round.visual_aids_status) if round.llm_round.visual_aids_status is not None else ""))
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(str(round.llm_round.clean_context) if round.llm_round.clean_context is not None else ""))
-                col_idx += 1
-                llm_answer_text = round.llm_round.answer or ""
-                self.data_model.setItem(row_idx, col_idx, create_item(llm_answer_text, llm_answer_text))
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(round.llm_round.reason or ""))
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(str(round.llm_round.thoughts_data) if round.llm_round.thoughts_data else ""))
-                col_idx += 1
-                self.data_model.setItem(row_idx, col_idx, create_item(str(round.llm_round.base_status) if round.llm_round.base_status is not None else ""))
-                col_idx += 1
-                llm_latency = calculate_time_difference(round.llm_round.request_timestamp, round.llm_round.response_timestamp) if round.llm_round.response_timestamp else ""
-                self.data_model.setItem(row_idx, col_idx, create_item(str(llm_latency)))
-                col_idx += 1
-            else:
-                # Fill empty cells for LLM columns
-                for _ in range(14):
-                    self.data_model.setItem(row_idx, col_idx, create_item(""))
-                    col_idx += 1
-
-            # IDs
-            self.data_model.setItem(row_idx, col_idx, create_item(round.deviceId or ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(round.glassDeviceId or ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(round.iotDeviceId or ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(round.accountId or ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(round.xjAccountId or ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(round.sessionId or ""))
-            col_idx += 1
-            self.data_model.setItem(row_idx, col_idx, create_item(round.msgId or ""))
-
-        # Ensure column count matches expected (added 1 for 使用者 column)
-        expected_columns = 37
-        if self.data_model.columnCount() > expected_columns:
-            print(f"Warning: Model has {self.data_model.columnCount()} columns, expected {expected_columns}")
-            self.data_model.setColumnCount(expected_columns)
-            self.setup_table_headers()  # Reset headers again
+        self.data_model.set_rounds([round for round in rounds if round is not None])
+        self.proxy_model.reset_index()
+        self.histograms = None
+        self.index_worker.submit(self.data_model.generation, 0, list(self.data_model.rounds())) # snapshot, the model list keeps growing
+        if self.stats_worker is not None:
+            self.reset_stats()
+        self.session_index.clear()
+        self.session_index.add_rounds(self.data_model.rounds())
+        self.session_timer.start()
 
         # Restore saved column widths
         for i, width in enumerate(column_widths):
             if i < self.data_model.columnCount():
                 self.table_widget.horizontalHeader().resizeSection(i, width)
-        
-        self.search_button.setEnabled(True) # Re-enable button
-        QApplication.restoreOverrideCursor() # Restore normal cursor
+
+    def append_results(self, rounds: List[DialogRound]):
+        if not self.is_current_query():
+            return
+        rounds = [round for round in rounds if round is not None]
+        start_row = self.data_model.rowCount()
+        self.data_model.append_rounds(rounds)
+        self.index_worker.submit(self.data_model.generation, start_row, rounds)
+        if self.stats_worker is not None:
+            self.stats_worker.add(self.data_model.generation, rounds)
+        if self.session_index.add_rounds(rounds):
+            self.session_timer.start()
+
+    def merge_index(self, generation: int, start_row: int, texts: list, partial: list):
+        """Merge a batch indexed by the IndexWorker"""
+        if generation != self.data_model.generation:
+            return # Result set was replaced meanwhile
+        self.data_model.set_texts(generation, start_row, texts)
+        self.proxy_model.merge_index(start_row, partial)
+        if self.proxy_model.engine.filters:
+            self.update_filter_status()
+        self.histogram_timer.start()
+
+    def compute_histograms(self):
+        """Start computing faceted value counts for the current index and filters"""
+        engine = self.proxy_model.engine
+        if not engine.filters:
+            return # Unfiltered counts come straight from the index
+        if self.histogram_worker and self.histogram_worker.isRunning():
+            self.histogram_timer.start() # Try again when the running one is done
+            return
+        self.histogram_worker = HistogramWorker(engine, self)
+        self.histogram_worker.ready.connect(self.set_histograms)
+        self.histogram_worker.start()
+
+    def set_histograms(self, version: int, histograms: list):
+        if version == self.proxy_model.engine.version:
+            self.histograms = (version, histograms)
+
+    def column_histogram(self, column_index) -> Dict[str, int]:
+        """Faceted value counts of a column: counts of rows passing the filters of the other columns"""
+        engine = self.proxy_model.engine
+        if self.histograms and self.histograms[0] == engine.version:
+            return dict(self.histograms[1][column_index])
+        return engine.histogram(column_index)
+
+    def update_query_progress(self, fetched: int, total: int):
+        if not self.is_current_query():
+            return
+        self.query_progress_bar.setRange(0, max(total, 1))
+        self.query_progress_bar.setValue(min(fetched, max(total, 1)))
+        self.show_query_metrics()
+
+    def show_query_metrics(self):
+        """Stage timings of the current query: one line in the status bar, the full report as tooltip"""
+        if self.query_worker is None:
+            return
+        metrics = self.query_worker.metrics
+        self.metrics_label.setText(metrics.summary())
+        report = metrics.report()
+        lines = [f"{name}: {stats['count']}x, {stats['total']:.3f}s" + (f", peak {stats['peak_bytes'] / 1024 / 1024:.1f} MB" if stats['peak_bytes'] is not None else "")
+                 for name, stats in sorted(report['spans'].items(), key=lambda item: -item[1]['total'])]
+        lines += [f"{name}: {value:,.0f}" for name, value in sorted(report['counters'].items())]
+        for name, counts in sorted(report['labels'].items()):
+            lines += [f"{name}[{label.strip()}]: {value:,.0f}" for label, value in sorted(counts.items(), key=lambda item: -item[1])[:10]]
+        self.metrics_label.setToolTip("\n".join(lines))
+
+    def query_finished(self, rounds: List[DialogRound]):
+        if not self.is_current_query():
+            return
+        self.end_query()
+        self.show_query_metrics()
+
+    def query_failed(self, message: str):
+        if not self.is_current_query():
+            return
+        self.end_query()
+        self.show_query_metrics()
+        self.show_error(message)
 
     def handle_cell_double_clicked(self, index: QModelIndex):
-        # Get the item from the proxy model
+        # Map the proxy index to the source model index to get the row in DialogRoundTableModel
         proxy_index = index
-        # Map the proxy index to the source model index to get the actual QStandardItem
         source_index = self.proxy_model.mapToSource(proxy_index)
-        item = self.data_model.itemFromIndex(source_index)
+        text = self.data_model.text(source_index.row(), source_index.column())
 
         # Get header text from the proxy model's header
         header_text = self.proxy_model.headerData(proxy_index.column(), Qt.Orientation.Horizontal)
         if header_text == "照片":
-            if item and item.toolTip():
-                self.image_fetcher = ImageFetcher(item.toolTip())
-                self.image_fetcher.finished.connect(self.show_image_preview)
-                self.image_fetcher.error.connect(self.show_image_fetch_error)
-                self.image_fetcher.start()
+            if text:
+                # Multiple files are joined by newlines, preview the first one
+                self.preview_url = self.data_model.first_file(source_index.row())
+                self.image_service.request_image(self.preview_url)
         elif header_text == "位置":
-            if item and item.text().strip():
-                self.show_map_dialog(item.text())
+            if text.strip():
+                self.show_map_dialog(source_index.row())
     
-    def show_map_dialog(self, location_text):
-        map_dialog = MapDialog(location_text, self)
-        map_dialog.exec()
+    def show_map_dialog(self, focus_row):
+        """Plot the locations of all rows passing the filters, centered on focus_row"""
+        location_col = DIALOG_ROUND_SCHEMA.index('location') + 1
+        points, focus = [], -1
+        for proxy_row in range(self.proxy_model.rowCount()):
+            row = self.proxy_model.mapToSource(self.proxy_model.index(proxy_row, 0)).row()
+            location = parse_location(self.data_model.text(row, location_col))
+            if location is None:
+                continue
+            if row == focus_row:
+                focus = len(points)
+            points.append((location[0], location[1], f"{self.data_model.text(row, 0)} {self.data_model.text(row, 1)}".strip()))
+
+        if self.map_view is None:
+            self.map_view = MapView(self.map_sdk_url, self.map_tile_url, self)
+        self.map_view.show_points(points, focus)
 
     def show_filter_dialog(self):
         from PyQt6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QListWidget, QListWidgetItem, QPushButton, QTableWidget, QTableWidgetItem
-        from collections import Counter
         
+        engine = self.proxy_model.engine
+
         dialog = QDialog(self)
         dialog.setWindowTitle("筛选结果")
-        dialog.resize(700, 500)
+        dialog.resize(760, 560)
         
         main_layout = QVBoxLayout()
         content_layout = QHBoxLayout()
         
-        # Left side - Column selection
+        # Left side - Column selection, filtered columns are shown in bold
         left_layout = QVBoxLayout()
         left_layout.addWidget(QLabel("Columns:"))
         column_list = QListWidget()
-        column_list.setFixedWidth(200)
+        column_list.setFixedWidth(220)
         
-        headers = []
+        def column_label(column_index):
+            header_text = self.data_model.headerData(column_index, Qt.Orientation.Horizontal)
+            if column_index in engine.filters:
+                return f"{header_text}  ({engine.filters[column_index].describe()})"
+            return header_text
+
         for i in range(self.data_model.columnCount()):
-            header_item = self.data_model.horizontalHeaderItem(i)
-            if header_item:
-                headers.append(header_item.text())
-                column_list.addItem(QListWidgetItem(header_item.text()))
+            item = QListWidgetItem(column_label(i))
+            if i in engine.filters:
+                font = item.font()
+                font.setBold(True)
+                item.setFont(font)
+            column_list.addItem(item)
         
         left_layout.addWidget(column_list)
+
+        left_layout.addWidget(QLabel("多列条件:"))
+        mode_combo = QComboBox()
+        mode_combo.addItem("全部满足 (AND)", FilterEngine.MODE_AND)
+        mode_combo.addItem("任一满足 (OR)", FilterEngine.MODE_OR)
+        mode_combo.setCurrentIndex(0 if engine.mode == FilterEngine.MODE_AND else 1)
+        left_layout.addWidget(mode_combo)
         content_layout.addLayout(left_layout)
         
-        # Right side - Value table with counts
+        # Right side - Value table with counts, substring and range conditions
         right_layout = QVBoxLayout()
-        right_layout.addWidget(QLabel("Values:"))
+        right_layout.addWidget(QLabel("Values (可多选, 计数为满足其他列条件的行数):"))
         value_table = QTableWidget()
         value_table.setColumnCount(2)
         value_table.setHorizontalHeaderLabels(["Value", "Count"])
         value_table.setFont(QFont("Courier New", 9))  # Set monospace font
         value_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        value_table.setSelectionMode(QTableWidget.SelectionMode.ExtendedSelection)
+        value_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
         
         # Set column resize modes
         header = value_table.horizontalHeader()
@@ -803,6 +1780,24 @@ class LogAnalyzerApp(QWidget):
         header.setSectionResizeMode(1, QHeaderView.ResizeMode.ResizeToContents)  # Count column minimal
         
         right_layout.addWidget(value_table)
+
+        substring_layout = QHBoxLayout()
+        substring_layout.addWidget(QLabel("包含:"))
+        substring_input = QLineEdit()
+        substring_layout.addWidget(substring_input)
+        right_layout.addLayout(substring_layout)
+
+        range_layout = QHBoxLayout()
+        range_layout.addWidget(QLabel("范围:"))
+        range_low_input = QLineEdit()
+        range_low_input.setPlaceholderText("最小值")
+        range_layout.addWidget(range_low_input)
+        range_layout.addWidget(QLabel("~"))
+        range_high_input = QLineEdit()
+        range_high_input.setPlaceholderText("最大值")
+        range_layout.addWidget(range_high_input)
+        right_layout.addLayout(range_layout)
+
         content_layout.addLayout(right_layout)
         
         main_layout.addLayout(content_layout)
@@ -810,17 +1805,25 @@ class LogAnalyzerApp(QWidget):
         # Update values when column selection changes
         def update_values():
             value_table.setRowCount(0)
+            substring_input.clear()
+            range_low_input.clear()
+            range_high_input.clear()
+
             current_item = column_list.currentItem()
             if current_item:
                 column_index = column_list.row(current_item)
-                values = []
-                for row in range(self.data_model.rowCount()):
-                    item = self.data_model.item(row, column_index)
-                    if item and item.text().strip():
-                        values.append(item.text())
-                
-                # Count occurrences
-                value_counts = Counter(values)
+                numeric = column_index in NUMERIC_COLUMNS
+                range_low_input.setEnabled(numeric)
+                range_high_input.setEnabled(numeric)
+
+                # Faceted counts, precomputed in the background when possible.
+                # Values of the current filter are kept even if no row has them now
+                value_counts = self.column_histogram(column_index)
+                value_counts.pop("", None)
+                current_filter = engine.filters.get(column_index)
+                if isinstance(current_filter, ValueSetFilter):
+                    for value in current_filter.values:
+                        value_counts.setdefault(value, 0)
                 
                 # Populate table
                 value_table.setRowCount(len(value_counts))
@@ -830,19 +1833,23 @@ class LogAnalyzerApp(QWidget):
                     count_item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
                     value_table.setItem(i, 1, count_item)
                 
-                # Select current filter value if exists
-                if column_index in self.proxy_model._filters:
-                    current_filter = self.proxy_model._filters[column_index]
+                # Show the current filter of this column if exists
+                if isinstance(current_filter, ValueSetFilter):
                     for i in range(value_table.rowCount()):
-                        if value_table.item(i, 0).text() == current_filter:
-                            value_table.selectRow(i)
-                            break
+                        if value_table.item(i, 0).text() in current_filter.values:
+                            value_table.item(i, 0).setSelected(True)
+                            value_table.item(i, 1).setSelected(True)
+                elif isinstance(current_filter, SubstringFilter):
+                    substring_input.setText(current_filter.text)
+                elif isinstance(current_filter, RangeFilter):
+                    range_low_input.setText("" if current_filter.low is None else str(current_filter.low))
+                    range_high_input.setText("" if current_filter.high is None else str(current_filter.high))
         
         column_list.currentItemChanged.connect(lambda: update_values())
         
         # Set initial selection if there's an active filter
-        if self.proxy_model._filters:
-            first_filter_column = next(iter(self.proxy_model._filters.keys()))
+        if engine.filters:
+            first_filter_column = next(iter(engine.filters.keys()))
             column_list.setCurrentRow(first_filter_column)
         else:
             column_list.setCurrentRow(0)
@@ -851,22 +1858,50 @@ class LogAnalyzerApp(QWidget):
         # Buttons
         button_layout = QHBoxLayout()
         apply_button = QPushButton("应用筛选")
+        clear_column_button = QPushButton("清除此列")
         cancel_button = QPushButton("取消")
-        
+
+        def parse_number(text):
+            text = text.strip()
+            return float(text) if text else None
+
         def apply_filter():
             current_column = column_list.currentItem()
-            current_row = value_table.currentRow()
-            if current_column and current_row >= 0:
+            if current_column:
                 column_index = column_list.row(current_column)
-                value_item = value_table.item(current_row, 0)
-                if value_item:
-                    self.apply_filter(column_index, value_item.text())
+                selected_values = {value_table.item(index.row(), 0).text() for index in value_table.selectionModel().selectedRows()}
+
+                try:
+                    low, high = parse_number(range_low_input.text()), parse_number(range_high_input.text())
+                except ValueError:
+                    QMessageBox.warning(dialog, "Invalid Input", "范围必须是数字")
+                    return
+
+                if substring_input.text():
+                    column_filter = SubstringFilter(substring_input.text())
+                elif low is not None or high is not None:
+                    column_filter = RangeFilter(low, high)
+                elif selected_values:
+                    column_filter = ValueSetFilter(selected_values)
+                else:
+                    column_filter = None
+
+                self.proxy_model.set_filter_mode(mode_combo.currentData())
+                self.apply_filter(column_index, column_filter)
+            dialog.accept()
+
+        def clear_column_filter():
+            current_column = column_list.currentItem()
+            if current_column:
+                self.apply_filter(column_list.row(current_column), None)
             dialog.accept()
         
         apply_button.clicked.connect(apply_filter)
+        clear_column_button.clicked.connect(clear_column_filter)
         cancel_button.clicked.connect(dialog.reject)
         
         button_layout.addWidget(apply_button)
+        button_layout.addWidget(clear_column_button)
         button_layout.addWidget(cancel_button)
         main_layout.addLayout(button_layout)
         
@@ -874,48 +1909,215 @@ class LogAnalyzerApp(QWidget):
         dialog.exec()
     
     def clear_all_filters(self):
-        self.proxy_model._filters.clear()
-        self.proxy_model.invalidateFilter()
+        self.proxy_model.clear_filters()
+        self.histograms = None
+        self.update_filter_status()
     
     def reload_user_mapping(self):
         """Reload user mapping file and refresh table data"""
-        self.device_user_map = self.load_device_user_map()
-        
-        # Refresh user column in existing data
-        for row in range(self.data_model.rowCount()):
-            # Get the round data from other columns to determine user (column indices adjusted for new first column)
-            device_id = self.data_model.item(row, 30).text() if self.data_model.item(row, 30) else ""
-            glass_device_id = self.data_model.item(row, 31).text() if self.data_model.item(row, 31) else ""
-            iot_device_id = self.data_model.item(row, 32).text() if self.data_model.item(row, 32) else ""
-            account_id = self.data_model.item(row, 33).text() if self.data_model.item(row, 33) else ""
-            xj_account_id = self.data_model.item(row, 34).text() if self.data_model.item(row, 34) else ""
-            
-            # Check different ID types in priority order
-            user_name = ""
-            id_checks = [
-                ('iotDeviceId', iot_device_id),
-                ('deviceId', device_id),
-                ('glassDeviceId', glass_device_id),
-                ('accountId', account_id),
-                ('xjAccountId', xj_account_id)
-            ]
-            
-            for id_type, id_value in id_checks:
-                if id_value:
-                    key = f"{id_type}:{id_value}"
-                    if key in self.device_user_map:
-                        user_name = self.device_user_map[key]
-                        break
-            
-            # Update user column (first column)
-            self.data_model.setItem(row, 0, create_item(user_name))
-        
-        self.status_bar.showMessage("用户映射已重新加载")
-
-    def apply_filter(self, column_index, filter_text):
-        # Clear all existing filters before applying new one
-        self.proxy_model._filters.clear()
-        self.proxy_model.setFilterByColumn(column_index, filter_text)
+        try:
+            changed = self.user_resolver.reload()
+        except Exception as e:
+            self.show_error(f"Error loading {self.user_resolver.filename}: {e}")
+            return
+        rows = self.apply_user_changes(changed)
+        self.status_bar.showMessage(f"用户映射已重新加载, {rows} 行的使用者已更新")
+
+    def check_user_mapping(self):
+        """Reload the user mapping when the file was modified"""
+        try:
+            changed = self.user_resolver.reload_if_changed()
+        except Exception as e:
+            print(f"Error loading {self.user_resolver.filename}: {e}")
+            return
+        if changed is not None:
+            rows = self.apply_user_changes(changed)
+            if rows:
+                self.status_bar.showMessage(f"用户映射文件已更新, {rows} 行的使用者已更新")
+
+    def apply_user_changes(self, changed) -> int:
+        """Recompute only the rows whose user changed, returns the number of rows"""
+        users = self.data_model.refresh_users(changed)
+        if users:
+            self.proxy_model.update_column(DialogRoundTableModel.USER_COLUMN, users)
+            self.histogram_timer.start()
+        return len(users)
+
+    def apply_filter(self, column_index, column_filter):
+        """Set (or clear with None) the filter of one column, filters on other columns are kept"""
+        if isinstance(column_filter, str):
+            column_filter = ValueSetFilter([column_filter]) if column_filter else None
+        self.proxy_model.set_column_filter(column_index, column_filter)
+        self.update_filter_status()
+        self.histogram_timer.start()
+
+    def update_filter_status(self):
+        engine = self.proxy_model.engine
+        if engine.filters:
+            pending = self.data_model.rowCount() - engine.row_count
+            suffix = f", {pending} 行索引中" if pending > 0 else ""
+            self.status_bar.showMessage(f"筛选: {len(engine.filters)} 列条件 ({engine.mode.upper()}), 显示 {self.proxy_model.rowCount()} / {self.data_model.rowCount()} 行{suffix}")
+        else:
+            self.status_bar.showMessage(f"显示全部 {self.data_model.rowCount()} 行")
+
+    EXPORT_FILTERS = {
+        "Excel (*.xlsx)": ".xlsx",
+        "CSV (*.csv)": ".csv",
+        "CSV gzip (*.csv.gz)": ".csv.gz",
+        "JSON Lines (*.jsonl)": ".jsonl",
+        "Parquet (*.parquet)": ".parquet",
+    }
+
+    def export_results(self):
+        """Export the rows of the current (filtered, sorted) view in the background"""
+        if self.export_worker is not None and self.export_worker.isRunning():
+            QMessageBox.warning(self, "Export in Progress", "An export is already running.")
+            return
+        if self.proxy_model.rowCount() == 0:
+            QMessageBox.information(self, "Export", "没有可以导出的行")
+            return
+
+        # formats whose optional dependency (pyarrow for Parquet) is missing are not offered
+        formats = available_formats()
+        filters = [name for name, suffix in self.EXPORT_FILTERS.items() if suffix.split('.')[1] in formats]
+        filename, selected_filter = QFileDialog.getSaveFileName(self, "导出结果", "", ";;".join(filters))
+        if not filename:
+            return
+        suffix = self.EXPORT_FILTERS.get(selected_filter)
+        if suffix and not filename.lower().endswith(suffix):
+            filename += suffix
+
+        # What you see is what gets exported: snapshot the view order on the UI thread
+        rounds = [self.data_model.round_at(self.proxy_model.mapToSource(self.proxy_model.index(row, 0)).row())
+                  for row in range(self.proxy_model.rowCount())]
+
+        progress_dialog = QProgressDialog(f"导出 {len(rounds)} 行到 {os.path.basename(filename)}", "取消", 0, len(rounds), self)
+        progress_dialog.setWindowTitle("导出结果")
+        progress_dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        progress_dialog.setMinimumDuration(300)
+        progress_dialog.setAutoClose(False)
+        progress_dialog.setAutoReset(False)
+
+        self.export_worker = ExportWorker(rounds, filename, self.user_resolver, self)
+        self.export_worker.progress.connect(lambda count, total: progress_dialog.setValue(count))
+        progress_dialog.canceled.connect(self.export_worker.cancel)
+
+        def done(message):
+            progress_dialog.close()
+            self.status_bar.showMessage(message)
+
+        self.export_worker.finished.connect(lambda count: done(f"已导出 {count} 行到 {filename}"))
+        self.export_worker.cancelled.connect(lambda: done("导出已取消"))
+        self.export_worker.error.connect(lambda message: (done(message), self.show_error(message)))
+        self.export_worker.start()
+
+    def show_stats(self):
+        if self.stats_view is None:
+            self.stats_view = StatsView(self)
+            self.stats_view.interval_changed.connect(lambda interval: self.reset_stats())
+            self.stats_worker = StatsWorker(self)
+            self.stats_worker.updated.connect(self.stats_updated)
+            self.stats_worker.start()
+            self.reset_stats()
+        self.stats_view.show()
+        self.stats_view.raise_()
+        self.stats_view.activateWindow()
+
+    def reset_stats(self):
+        """Recompute the statistics of all rows, e.g. for a new result set or interval"""
+        generation = self.data_model.generation
+        self.stats_worker.reset(generation, self.stats_view.interval)
+        self.stats_worker.add(generation, list(self.data_model.rounds()))
+
+    def stats_updated(self, generation: int, summaries: list, total):
+        if generation == self.data_model.generation:
+            self.stats_view.set_summaries(summaries, total)
+
+    def show_sessions(self):
+        """Open the session view on the session of the current row"""
+        if self.session_view is None:
+            self.session_view = SessionView(self.user_resolver.resolve, self)
+            self.session_view.set_index(self.session_index)
+        current = self.table_widget.currentIndex()
+        round = self.data_model.round_at(self.proxy_model.mapToSource(current).row()) if current.isValid() else None
+        if round is not None and self.session_index.session_of(round) is not None:
+            self.session_view.show_session(round.sessionId, round.traceId)
+        else:
+            self.session_view.refresh()
+        self.session_view.show()
+        self.session_view.raise_()
+        self.session_view.activateWindow()
+
+    def refresh_sessions(self):
+        """Debounced: the session view is re-queried at most every few hundred ms while rows stream in"""
+        if self.session_view is not None and self.session_view.isVisible():
+            self.session_view.refresh()
+
+    def toggle_trace_panel(self, checked: bool):
+        self.trace_panel.setVisible(checked)
+        if checked:
+            self.show_current_trace(self.table_widget.currentIndex())
+
+    def show_current_trace(self, current: QModelIndex, previous: QModelIndex = None):
+        """Show the trace of the current row, fetching it and its neighbours in the background"""
+        if not self.trace_panel.isVisible() or not current.isValid():
+            return
+        proxy_row = current.row()
+        round = self.data_model.round_at(self.proxy_model.mapToSource(self.proxy_model.index(proxy_row, 0)).row())
+        self.current_trace_id = round.traceId
+
+        markdown = self.trace_service.cached(round.traceId)
+        if markdown is not None:
+            self.trace_panel.setMarkdown(markdown)
+        else:
+            self.trace_panel.setPlainText(f"正在加载 {round.traceId} ...")
+
+        server_config = self.current_server_config()
+        self.trace_service.request(round, server_config)
+        for neighbour in [proxy_row + 1, proxy_row - 1]:
+            if 0 <= neighbour < self.proxy_model.rowCount():
+                row = self.proxy_model.mapToSource(self.proxy_model.index(neighbour, 0)).row()
+                self.trace_service.request(self.data_model.round_at(row), server_config)
+
+    def trace_loaded(self, trace_id: str, markdown: str):
+        if trace_id == self.current_trace_id:
+            self.trace_panel.setMarkdown(markdown)
+
+    def trace_failed(self, trace_id: str, message: str):
+        if trace_id == self.current_trace_id:
+            self.trace_panel.setPlainText(message)
+
+    def image_loaded(self, url: str, image: QImage):
+        if url == self.preview_url:
+            self.preview_url = None
+            self.show_image_preview(QPixmap.fromImage(image))
+
+    def image_failed(self, url: str, message: str):
+        if url == self.preview_url:
+            self.preview_url = None
+            self.show_image_fetch_error(message)
+
+    def prefetch_visible_images(self):
+        """Start loading thumbnails for the 照片 cells in view"""
+        viewport = self.table_widget.viewport()
+        top = self.table_widget.rowAt(0)
+        if top < 0:
+            return
+        bottom = self.table_widget.rowAt(viewport.height() - 1)
+        if bottom < 0:
+            bottom = self.proxy_model.rowCount() - 1
+
+        thumbnail_rows = {}
+        for proxy_row in range(top, bottom + 1):
+            row = self.proxy_model.mapToSource(self.proxy_model.index(proxy_row, 0)).row()
+            url = self.data_model.first_file(row)
+            if url:
+                thumbnail_rows.setdefault(url, []).append(row)
+        self.thumbnail_rows = thumbnail_rows
+        self.image_service.prefetch_thumbnails(thumbnail_rows.keys())
+
+    def thumbnail_loaded(self, url: str, image: QImage):
+        self.data_model.files_changed(self.thumbnail_rows.get(url, []))
 
     def show_image_preview(self, pixmap):
         if not pixmap.isNull():
@@ -928,8 +2130,6 @@ class LogAnalyzerApp(QWidget):
     def show_error(self, message: str):
         QMessageBox.critical(self, "Error", message)
         self.status_bar.showMessage("Error: " + message)
-        self.search_button.setEnabled(True) # Re-enable button
-        QApplication.restoreOverrideCursor() # Restore normal cursor
 
     def save_settings(self):
         config = configparser.ConfigParser()
@@ -964,6 +2164,12 @@ class LogAnalyzerApp(QWidget):
             'query_size': self.query_size_input.text()
         }
 
+        # Save Map Config
+        config['Map'] = {
+            'sdk_url': self.map_sdk_url.replace('%', '%%'), # escape configparser interpolation
+            'tile_url': self.map_tile_url.replace('%', '%%')
+        }
+
         # Save Table Header State
         header_state = self.table_widget.horizontalHeader().saveState()
         config['Table'] = {
@@ -976,6 +2182,20 @@ class LogAnalyzerApp(QWidget):
 
     def closeEvent(self, event):
         self.save_settings()
+        if self.query_worker is not None:
+            self.retire_query_worker()
+        for worker in self.retired_workers:
+            worker.wait()
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+            self.export_worker.wait()
+        self.index_worker.stop()
+        if self.stats_worker is not None:
+            self.stats_worker.stop()
+        self.image_service.cache.close()
+        self.trace_service.close()
+        if self.histogram_worker:
+            self.histogram_worker.wait()
         event.accept()
 
 if __name__ == "__main__":
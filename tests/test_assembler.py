@@ -0,0 +1,45 @@
+from kongming.elk import KongmingELKServer
+from kongming.model import DialogRoundAssembler
+from kongming.synthetic import SyntheticLogGenerator, dialog_hits
+
+
+def _record(trace_id, timestamp, field, message):
+    return {'_source': {'traceId': trace_id, '@timestamp': timestamp, field: message}}
+
+def _nlu_records(trace_id, second):
+    timestamp = '2025-08-18T00:%02d:%02d.000Z' % (second // 60, second % 60)
+    return [
+        _record(trace_id, timestamp, 'central-nlp-request', {'payload': {'q': trace_id}, 'metadata': {'deviceId': 'd'}}),
+        _record(trace_id, timestamp, 'central-nlp-response', {'payload': {'header': {'namespace': 'chat', 'name': 'chat'}, 'payload': {}}}),
+    ]
+
+def _assemble(records, pagesize):
+    assembler = DialogRoundAssembler()
+    rounds = []
+    for start in range(0, len(records), pagesize):
+        rounds += assembler.add_records(records[start:start + pagesize])
+    return rounds + assembler.flush()
+
+def test_late_answer_response_is_kept():
+    records = _nlu_records('late', 0)
+    records.append(_record('late', '2025-08-18T00:00:00.500Z', 'central-answer-request', {'query': 'late'}))
+    for second in range(1, 100):
+        records += _nlu_records(f'filler-{second}', second)
+    records.append(_record('late', '2025-08-18T00:01:40.000Z', 'central-answer-response', {'payload': {'answer': 'done', 'base_status': 2}}))
+
+    for pagesize in (1, 10, len(records)):
+        rounds = _assemble(records, pagesize)
+        assert len(rounds) == 100
+        assert rounds[0].traceId == 'late'
+        assert rounds[0].llm_round.answer == 'done'
+
+def test_paged_assembly_matches_one_shot():
+    server = KongmingELKServer.__new__(KongmingELKServer)
+    records = list(dialog_hits(server.transform_record(r) for r in SyntheticLogGenerator(traces=500, seed=1)))
+
+    def key(rounds):
+        return [(r.traceId, r.llm_round and (r.llm_round.answer, r.llm_round.response_timestamp)) for r in rounds]
+
+    expected = key(_assemble(records, len(records)))
+    for pagesize in (1, 7, 100):
+        assert key(_assemble(records, pagesize)) == expected